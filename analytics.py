@@ -0,0 +1,147 @@
+from collections import Counter
+from datetime import datetime
+
+# --- INBOX ANALYTICS ---
+# Running counters per sender, category, day, hour of day and weekday/hour,
+# kept in the message cache's database and updated in the same
+# transaction as the messages themselves. Each message's last
+# contribution is remembered in `facts`, so a re-sync or a new category
+# only moves the counters it changes. Evicting a message from the cache
+# does not count as a deletion; only expunges and UIDVALIDITY resets do.
+# Reading a chart costs one small query whatever the mailbox size.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS facts (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    category TEXT NOT NULL,
+    day TEXT,
+    hour INTEGER,
+    weekday INTEGER,
+    PRIMARY KEY (account, mailbox, uidvalidity, uid)
+);
+CREATE TABLE IF NOT EXISTS counters (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (account, mailbox, kind, key)
+);
+CREATE INDEX IF NOT EXISTS counters_rank ON counters (account, mailbox, kind, count);
+"""
+
+UNCATEGORIZED = "Uncategorized"
+
+
+def message_facts(msg):
+    # (sender, category, day, hour, weekday); time fields are None when the Date header was unreadable
+    sender = (msg.get("sender_email") or msg.get("sender") or "").strip().lower() or "(unknown)"
+    category = msg.get("category") or UNCATEGORIZED
+    day = hour = weekday = None
+    if msg.get("timestamp") is not None:
+        local = datetime.fromtimestamp(msg["timestamp"])
+        day, hour, weekday = local.strftime("%Y-%m-%d"), local.hour, local.weekday()
+    return sender, category, day, hour, weekday
+
+
+def _contributions(facts, sign, counts):
+    sender, category, day, hour, weekday = facts
+    counts[("sender", sender)] += sign
+    counts[("category", category)] += sign
+    if day is not None:
+        counts[("day", day)] += sign
+        counts[("hour", str(hour))] += sign
+        counts[("weekday_hour", f"{weekday}-{hour}")] += sign
+
+
+def _apply(db, account, mailbox, counts):
+    rows = [(account, mailbox, kind, key, n) for (kind, key), n in counts.items() if n]
+    db.executemany(
+        "INSERT INTO counters VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (account, mailbox, kind, key) DO UPDATE SET count = count + excluded.count",
+        rows,
+    )
+    # Only counters that went down can have reached zero
+    db.executemany(
+        "DELETE FROM counters WHERE account=? AND mailbox=? AND kind=? AND key=? AND count <= 0",
+        [row[:4] for row in rows if row[4] < 0],
+    )
+
+
+def _stored(db, account, mailbox, uidvalidity, uids):
+    stored = {}
+    for start in range(0, len(uids), 500):
+        chunk = uids[start:start + 500]
+        marks = ",".join("?" * len(chunk))
+        for row in db.execute(
+            f"SELECT uid, sender, category, day, hour, weekday FROM facts "
+            f"WHERE account=? AND mailbox=? AND uidvalidity=? AND uid IN ({marks})",
+            (account, mailbox, uidvalidity, *chunk),
+        ):
+            stored[row[0]] = row[1:]
+    return stored
+
+
+def record(db, account, mailbox, uidvalidity, messages):
+    # Call inside the caller's transaction
+    new = {int(msg["uid"]): message_facts(msg) for msg in messages}
+    if not new:
+        return
+    old = _stored(db, account, mailbox, uidvalidity, list(new))
+    counts = Counter()
+    changed = []
+    for uid, facts in new.items():
+        if old.get(uid) == facts:
+            continue
+        if uid in old:
+            _contributions(old[uid], -1, counts)
+        _contributions(facts, 1, counts)
+        changed.append((account, mailbox, uidvalidity, uid, *facts))
+    db.executemany("INSERT OR REPLACE INTO facts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", changed)
+    _apply(db, account, mailbox, counts)
+
+
+def forget(db, account, mailbox, uidvalidity, uids):
+    uids = [int(u) for u in uids]
+    old = _stored(db, account, mailbox, uidvalidity, uids)
+    if not old:
+        return
+    counts = Counter()
+    for facts in old.values():
+        _contributions(facts, -1, counts)
+    db.executemany(
+        "DELETE FROM facts WHERE account=? AND mailbox=? AND uidvalidity=? AND uid=?",
+        [(account, mailbox, uidvalidity, uid) for uid in old],
+    )
+    _apply(db, account, mailbox, counts)
+
+
+def reset(db, account, mailbox):
+    db.execute("DELETE FROM facts WHERE account=? AND mailbox=?", (account, mailbox))
+    db.execute("DELETE FROM counters WHERE account=? AND mailbox=?", (account, mailbox))
+
+
+def counts(db, account, mailbox, kind, limit=None, since=None):
+    # [(key, count)], largest first for senders / categories, in key order
+    # otherwise; since filters on the key (e.g. "2024-01-01" for days)
+    order = "count DESC, key" if kind in ("sender", "category") else "key"
+    query = "SELECT key, count FROM counters WHERE account=? AND mailbox=? AND kind=?"
+    params = [account, mailbox, kind]
+    if since is not None:
+        query += " AND key >= ?"
+        params.append(since)
+    query += f" ORDER BY {order}"
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    return db.execute(query, params).fetchall()
+
+
+def total(db, account, mailbox):
+    return db.execute(
+        "SELECT COALESCE(SUM(count), 0) FROM counters WHERE account=? AND mailbox=? AND kind='category'",
+        (account, mailbox),
+    ).fetchone()[0]
@@ -1,290 +1,213 @@
-import imaplib
-import email
-import ollama
+import json
 import pandas as pd
 import plotly.express as px
 import streamlit as st
-import pytesseract
-import io
 import math
-from PIL import Image
-from email.header import decode_header
-from bs4 import BeautifulSoup
-from email.utils import parsedate_to_datetime
-from email.mime.text import MIMEText
-from gtts import gTTS
-import time
+from mail_agent import (
+    fetch_emails, load_email_bodies, apply_ocr_results, remember_category, fetch_headers, triage_arrivals, bulk_load,
+    stream_summary, stream_reply, stream_inbox_answer, podcast_briefing, speak, join_briefing,
+    save_draft_to_gmail, mail_pool, close_mail_pool, sync_mailbox,
+)
+from briefing import by_priority
+from models import start_warm_up, usage, model_for, ROUTES
+from mail_cache import get_cache
+from triage import triage_emails
+from llm_stream import describe_stats
+from ocr_pipeline import get_ocr_pipeline
+from page_loader import get_page_loader, close_page_loader
+from imap_idle import InboxWatcher, start_watcher, get_watcher, stop_watcher
+from bulk_triage import BulkTriage, search_criteria as bulk_criteria, start_bulk_triage, get_bulk_triage, stop_bulk_triage
+from tracing import (
+    enabled as tracing_enabled, enable as enable_tracing, disable as disable_tracing, reset as reset_tracing,
+    trace_path, spans as traced_spans, counters as trace_counters, stage_stats, durations, slowest_messages, message_spans,
+)
 
-# --- HELPER FUNCTIONS ---
+# --- UI HELPERS ---
 
-def _is_lxml_available():
-    try:
-        import lxml
-        return True
-    except ImportError:
-        return False
+def get_category_color(category):
+    if not category: return "#808080"
+    if "Security" in category: return "#ff4b4b" 
+    if "Job" in category: return "#00c853"      
+    if "Personal" in category: return "#29b6f6" 
+    if "Newsletter" in category: return "#ffa726" 
+    return "#808080"
 
-def clean_email_body(raw_html):
-    parser = 'lxml' if _is_lxml_available() else 'html.parser'
-    soup = BeautifulSoup(raw_html, parser)
-    return soup.get_text(separator=' ', strip=True)
+def ensure_bodies(mail_items):
+    error = load_email_bodies(
+        st.session_state.creds['user'],
+        st.session_state.creds['pass'],
+        mail_items,
+        enable_ocr=st.session_state.get("enable_ocr", False)
+    )
+    if error:
+        st.error(f"Could not load message content: {error}")
+    for mail in mail_items:
+        if mail.get('body') is None: mail['body'] = "No text content found."
+    apply_ocr_results(st.session_state.creds['user'], mail_items)
 
-def safe_decode(byte_data, encoding="utf-8"):
-    try:
-        if not encoding: encoding = "utf-8"
-        return byte_data.decode(encoding)
-    except Exception:
-        return byte_data.decode("utf-8", errors="replace")
+def show_stream(tokens, stats, stop_key):
+    # Renders tokens as they arrive. Pressing Stop reruns the script, which
+    # closes the generator and with it the request to Ollama.
+    stop = st.empty()
+    stop.button("⏹ Stop", key=stop_key)
+    text = st.write_stream(tokens)
+    stop.empty()
+    caption = describe_stats(stats)
+    if caption:
+        st.caption(caption)
+    return text if isinstance(text, str) else "".join(map(str, text))
 
-def extract_text_from_image(image_bytes):
-    try:
-        image = Image.open(io.BytesIO(image_bytes))
-        text = pytesseract.image_to_string(image)
-        return text.strip()
-    except Exception:
-        return ""
+@st.fragment(run_every="2s")
+def ocr_progress():
+    # Polls the background OCR workers and reruns the page once they finish
+    if get_ocr_pipeline().pending() == 0:
+        st.rerun()
+    st.caption("🔍 Scanning images in the background...")
 
-def text_to_audio(text):
-    try:
-        tts = gTTS(text=text, lang='en')
-        audio_buffer = io.BytesIO()
-        tts.write_to_fp(audio_buffer)
-        audio_buffer.seek(0)
-        return audio_buffer
-    except Exception:
-        return None
+def page_loader():
+    user, password = st.session_state.creds['user'], st.session_state.creds['pass']
+    return get_page_loader(user, lambda limit, folder, page: fetch_emails(user, password, limit, folder, page))
 
-def save_draft_to_gmail(username, password, to_email, subject, body):
-    try:
-        msg = MIMEText(body)
-        msg['Subject'] = f"Re: {subject}"
-        msg['From'] = username
-        msg['To'] = to_email
-        
-        mail = imaplib.IMAP4_SSL("imap.gmail.com")
-        mail.login(username, password)
-        
-        date_now = imaplib.Time2Internaldate(time.localtime())
-        
-        try:
-            mail.append('[Gmail]/Drafts', None, date_now, msg.as_bytes())
-            mail.logout()
-            return True, "Saved to [Gmail]/Drafts"
-        except:
-            try:
-                mail.append('Drafts', None, date_now, msg.as_bytes())
-                mail.logout()
-                return True, "Saved to Drafts"
-            except Exception as e:
-                return False, str(e)
+@st.fragment(run_every="0.5s")
+def page_progress(view):
+    # Polls the page worker and reruns the page once the result is in
+    if page_loader().ready(*view):
+        st.rerun()
+    st.caption(f"⏳ Loading page {view[0]}...")
 
-    except Exception as e:
-        return False, str(e)
+def inbox_watcher():
+    user, password = st.session_state.creds['user'], st.session_state.creds['pass']
+    def factory():
+        return InboxWatcher(
+            lambda: mail_pool(user, password).dedicated(), user, fetch_headers,
+            cache=get_cache(), triage=lambda mail, items: triage_arrivals(mail, user, items)
+        )
+    return start_watcher(user, factory)
 
-# --- CORE LOGIC ---
+def bulk_triage_job(criteria):
+    user, password = st.session_state.creds['user'], st.session_state.creds['pass']
+    def factory():
+        return BulkTriage(
+            lambda: mail_pool(user, password).dedicated(), user,
+            lambda mail, uids, uidvalidity, mailbox: bulk_load(mail, user, uids, uidvalidity, mailbox),
+            criteria=criteria, cache=get_cache()
+        )
+    return start_bulk_triage(user, factory)
 
-def fetch_emails(username, password, limit=10, folder="ALL", enable_ocr=False, page=1):
-    try:
-        mail = imaplib.IMAP4_SSL("imap.gmail.com")
-        mail.login(username, password)
-        mail.select("inbox")
-        
-        status, search_data = mail.search(None, folder)
-        
-        if not search_data[0]:
-            return [], 0 
+@st.fragment(run_every="2s")
+def bulk_progress():
+    job = get_bulk_triage(st.session_state.creds['user'])
+    if job is None:
+        return
+    stats = job.stats
+    if job.state in ("starting", "running"):
+        st.progress(job.progress(), text=f"{stats['applied']}/{stats['total']} written back ({job.mode or '...'})")
+    elif job.state == "done":
+        st.caption(f"✅ {stats['applied']} emails triaged in {stats['commands']} server commands")
+        if stats["flagged"]:
+            st.warning(f"The server cannot move messages: {stats['flagged']} were copied to their Triage folder and flagged "
+                       "as deleted, but stay in the inbox until your mail client expunges (compacts) it.")
+    elif job.state == "stopped":
+        st.caption(f"⏸ Stopped at {stats['applied']}/{stats['total']}; start again to resume")
+    else:
+        st.caption(f"⚠️ Stopped: {job.last_error}; start again to resume")
 
-        mail_ids = search_data[0].split()
-        total_emails = len(mail_ids)
-        
-        end_idx = total_emails - ((page - 1) * limit)
-        start_idx = max(0, end_idx - limit)
-        
-        if end_idx <= 0:
-            return [], total_emails 
-            
-        batch_ids = mail_ids[start_idx:end_idx]
-        batch_ids = list(reversed(batch_ids)) 
-        
-        messages = []
-        
-        for num in batch_ids:
-            try:
-                _, msg_data = mail.fetch(num, "(RFC822)")
-                for response_part in msg_data:
-                    if isinstance(response_part, tuple):
-                        msg = email.message_from_bytes(response_part[1])
-                        
-                        subject_header = decode_header(msg["Subject"])[0]
-                        subject, encoding = subject_header
-                        if isinstance(subject, bytes):
-                            subject = safe_decode(subject, encoding)
-                        
-                        sender = msg.get("From")
-                        sender_email = sender
-                        if "<" in sender:
-                            sender_email = sender.split("<")[1].replace(">", "")
-                        
-                        raw_date = msg.get("Date")
-                        try:
-                            dt_obj = parsedate_to_datetime(raw_date)
-                            local_dt = dt_obj.astimezone()
-                            date = local_dt.strftime("%b %d, %I:%M %p")
-                        except Exception:
-                            date = raw_date 
+def apply_inbox_updates(events, view, loader):
+    # Patches the page in memory; returns the number of new arrivals
+    page, limit, folder = view
+    emails = st.session_state.get("emails") or []
+    arrived = 0
+    for kind, payload in events:
+        if kind == "reset" or folder != "ALL":
+            # Filtered views and UIDVALIDITY changes are simply reloaded
+            st.session_state.loaded_view = None
+        elif kind == "new":
+            st.session_state.total_emails += len(payload)
+            if page == 1:
+                emails[:0] = payload
+                del emails[limit:]
+            else:
+                # Older pages shift by the new arrivals
+                st.session_state.loaded_view = None
+        elif kind == "expunged":
+            st.session_state.total_emails -= len(payload)
+            emails[:] = [m for m in emails if m["uid"] not in payload]
+        elif kind == "flags":
+            for mail in emails:
+                if mail["uid"] in payload:
+                    mail["flags"] = payload[mail["uid"]]
+        if kind == "new":
+            arrived += len(payload)
+    if events:
+        # Prefetched neighbours are now off by the shifted messages
+        loader.invalidate()
+    st.session_state.emails = emails
+    return arrived
 
-                        body = "No text content found."
-                        has_image = False
-                        
-                        if msg.is_multipart():
-                            full_text = ""
-                            for part in msg.walk():
-                                content_type = part.get_content_type()
-                                content_disposition = str(part.get("Content-Disposition"))
-                                
-                                if "attachment" not in content_disposition:
-                                    if content_type == "text/plain":
-                                        payload = part.get_payload(decode=True)
-                                        full_text += safe_decode(payload) + "\n"
-                                    elif content_type == "text/html":
-                                        payload = part.get_payload(decode=True)
-                                        html_body = safe_decode(payload)
-                                        full_text += clean_email_body(html_body) + "\n"
-                                
-                                if enable_ocr and "image" in content_type:
-                                    img_data = part.get_payload(decode=True)
-                                    if len(img_data) > 5000:
-                                        ocr_text = extract_text_from_image(img_data)
-                                        if ocr_text:
-                                            full_text += f"\n\n[🔍 IMAGE TEXT DETECTED]:\n{ocr_text}\n"
-                                            has_image = True
-                            
-                            body = full_text
-                        else:
-                            content_type = msg.get_content_type()
-                            payload = msg.get_payload(decode=True)
-                            if content_type == "text/html":
-                                html_body = safe_decode(payload)
-                                body = clean_email_body(html_body)
-                            else:
-                                body = safe_decode(payload)
-                        
-                        messages.append({
-                            "id": num.decode(),
-                            "subject": subject,
-                            "sender": sender,
-                            "sender_email": sender_email,
-                            "date": date,
-                            "body": body,
-                            "category": None,
-                            "has_image": has_image
-                        })
-            except Exception:
-                continue 
-        
-        mail.close()
-        mail.logout()
-        return messages, total_emails 
-        
-    except Exception as e:
-        return str(e)
+@st.fragment(run_every="2s")
+def live_status():
+    watcher = get_watcher(st.session_state.creds['user'])
+    if watcher is None:
+        return
+    if not watcher.events.empty():
+        st.rerun()
+    if watcher.mode == "idle":
+        st.caption("🟢 Live: listening for new mail")
+    elif watcher.mode == "poll":
+        st.caption("🟡 Live: polling (server has no IDLE)")
+    elif watcher.last_error:
+        st.caption(f"🔴 Live: reconnecting... {watcher.last_error}")
+    else:
+        st.caption("⏳ Live: connecting...")
 
-def rule_based_classify(sender, subject, body):
-    sender = sender.lower()
-    subject = subject.lower()
-    body = body.lower()[:500]
-    
-    sec_keywords = ["security alert", "verification code", "2fa", "unauthorized access", "password reset"]
-    if any(k in sender or k in subject or k in body for k in sec_keywords):
-        return "Security Alert"
+def toggle_tracing():
+    if st.session_state.tracing:
+        enable_tracing()
+    else:
+        disable_tracing()
+
+def performance_panel():
+    # Where this session's time went, from the tracing spans kept in memory
+    stages = stage_stats()
+    if not stages:
+        st.info("Nothing traced yet. Load a page or open an email.")
+        return
+    if trace_counters:
+        cols = st.columns(4)
+        for n, (name, value) in enumerate(sorted(trace_counters.items())):
+            cols[n % 4].metric(name, f"{value:,}")
     
-    job_keywords = ["application", "interview", "offer", "reject", "candidate", "linkedin", "workday", "greenhouse", "lever", "recruiter", "admission", "grad school", "university", "phd", "master"]
-    if any(k in sender or k in subject for k in job_keywords):
-        return "Job Application"
-        
-    news_keywords = ["newsletter", "digest", "weekly", "edition", "unsubscribe", "medium", "substack"]
-    if any(k in sender for k in news_keywords):
-        return "Newsletter"
+    st.subheader("Stages")
+    st.dataframe(pd.DataFrame(stages).round(2), hide_index=True, use_container_width=True)
+    stage = st.selectbox("Stage", [row['stage'] for row in stages], key="perf_stage")
+    fig_hist = px.histogram(pd.DataFrame({'ms': durations(stage)}), x='ms', nbins=40, title=f"{stage} duration (ms)")
+    st.plotly_chart(fig_hist, use_container_width=True)
     
-    promo_keywords = ["sale", "discount", "% off", "deal", "limited time"]
-    if any(k in subject for k in promo_keywords):
-        return "Promotion/Spam"
-
-    return None 
-
-def classify_email(sender, subject, body):
-    category = rule_based_classify(sender, subject, body)
-    if category:
-        return category
+    st.subheader("Slowest Messages")
+    slow = slowest_messages()
+    if slow:
+        subjects = {m['uid']: m['subject'] for m in st.session_state.get('emails') or []}
+        for row in slow:
+            row['subject'] = subjects.get(row['uid'], "")
+        st.dataframe(pd.DataFrame(slow).round(2), hide_index=True, use_container_width=True)
+        uid = st.selectbox("Message", [row['uid'] for row in slow], key="perf_uid",
+                           format_func=lambda u: f"{u} {subjects.get(u, '')}")
+        st.dataframe(pd.DataFrame(message_spans(uid)).drop(columns=['start', 'thread'], errors='ignore'),
+                     hide_index=True, use_container_width=True)
+    else:
+        st.caption("No per-message spans yet.")
     
-    try:
-        categories = "['Job Application', 'Security Alert', 'Personal', 'Newsletter', 'Promotion/Spam']"
-        prompt = f"Classify this email into exactly one of these categories: {categories}.\nSender: {sender}\nSubject: {subject}\nBody: {body[:1000]}\nReply ONLY with the category name."
-        response = ollama.chat(model='llama3.2', messages=[{'role': 'user', 'content': prompt}])
-        content = response['message']['content'].strip()
-        for cat in ['Job Application', 'Security Alert', 'Personal', 'Newsletter', 'Promotion/Spam']:
-            if cat in content:
-                return cat
-        return "Personal"
-    except Exception:
-        return "Personal"
-
-def summarize_with_ollama(text):
-    try:
-        response = ollama.chat(model='llama3.2', messages=[
-            {'role': 'user', 'content': f"Summarize this email in 2 sentences. Capture the main action item:\n\n{text[:4000]}"},
-        ])
-        return response['message']['content']
-    except Exception as e:
-        return f"Ollama Error: {e}"
-
-def generate_reply(email_text, user_notes):
-    try:
-        # Retrieve real name from Session State
-        user_name = st.session_state.get("user_full_name", "Sai")
-        
-        prompt = f"""
-        You are an email assistant for {user_name}.
-        
-        Incoming Email:
-        {email_text[:1000]}
-        
-        My Draft Notes:
-        {user_notes}
-        
-        Task: Write a professional reply based on my notes.
-        
-        STRICT RULES:
-        1. Output ONLY the email body.
-        2. Do NOT write "Here is a draft" or "Subject:".
-        3. Do NOT include placeholders like "[Your Name]".
-        4. Sign off specifically as "{user_name}".
-        """
-        
-        response = ollama.chat(model='llama3.2', messages=[{'role': 'user', 'content': prompt}])
-        return response['message']['content']
-    except Exception as e:
-        return f"Error: {e}"
-
-def ask_inbox(emails, query):
-    try:
-        context_blob = ""
-        for mail in emails:
-            context_blob += f"--- START EMAIL ---\nFrom: {mail['sender']}\nSubject: {mail['subject']}\nContent: {mail['body'][:500]}...\n--- END EMAIL ---\n\n"
-        
-        prompt = f"Context:\n{context_blob}\n\nUser Question: {query}\n\nAnswer based on the emails."
-        response = ollama.chat(model='llama3.2', messages=[{'role': 'user', 'content': prompt}])
-        return response['message']['content']
-    except Exception as e:
-        return f"Error: {e}"
-
-def get_category_color(category):
-    if not category: return "#808080"
-    if "Security" in category: return "#ff4b4b" 
-    if "Job" in category: return "#00c853"      
-    if "Personal" in category: return "#29b6f6" 
-    if "Newsletter" in category: return "#ffa726" 
-    return "#808080"
+    col_path, col_download, col_clear = st.columns([2, 1, 1])
+    with col_path:
+        if trace_path():
+            st.caption(f"Trace written to `{trace_path()}`")
+    with col_download:
+        lines = "".join(json.dumps(r, default=str) + "\n" for r in list(traced_spans))
+        st.download_button("⬇️ Spans (JSONL)", lines, file_name="trace.jsonl", mime="application/json")
+    with col_clear:
+        if st.button("🗑️ Clear"):
+            reset_tracing()
+            st.rerun()
 
 # --- UI SETUP ---
 st.set_page_config(page_title="Local Email AI", layout="wide")
@@ -311,6 +234,8 @@ if "current_page" not in st.session_state:
     st.session_state.current_page = 1
 if "total_emails" not in st.session_state:
     st.session_state.total_emails = 0
+if "tracing" not in st.session_state:
+    st.session_state.tracing = tracing_enabled()
 
 # --- SIDEBAR ---
 with st.sidebar:
@@ -326,6 +251,8 @@ with st.sidebar:
         st.write("") 
         if st.button("Connect Account", type="primary", use_container_width=True):
             if email_user and email_pass:
+                # Models load in the background while IMAP logs in
+                start_warm_up(email_user)
                 with st.spinner("Verifying credentials..."):
                     st.session_state.current_page = 1
                     result = fetch_emails(email_user, email_pass, limit=10, folder="ALL", page=1)
@@ -340,6 +267,8 @@ with st.sidebar:
                         st.session_state.logged_in = True
                         st.session_state.emails = emails
                         st.session_state.total_emails = total
+                        st.session_state.loaded_view = (1, 10, "ALL")
+                        st.session_state.requested_view = None
                         st.rerun()
     else:
         st.subheader("👋 Welcome Back")
@@ -351,22 +280,40 @@ with st.sidebar:
         
         # 1. PODCAST
         st.markdown("##### 🎙️ Daily Briefing")
+        briefing_order = st.radio("Order", ["Newest first", "By priority"], horizontal=True, key="briefing_order")
         if st.button("▶️ Play Audio Summary", type="primary", use_container_width=True):
              if "emails" in st.session_state and st.session_state.emails:
-                 with st.spinner("Generating Audio Briefing..."):
-                     top_emails = st.session_state.emails[:5]
-                     # Personalized Greeting
-                     podcast_script = f"Good morning, {st.session_state.user_full_name}. Here is your daily briefing. "
-                     for mail in top_emails:
-                         sender_clean = mail['sender'].split('<')[0].strip().replace('"', '')
-                         podcast_script += f"From {sender_clean}: {mail['subject']}. "
-                         short_sum = summarize_with_ollama(mail['body'])
-                         podcast_script += f"{short_sum}. Next email. "
-                     podcast_script += "That concludes your briefing."
-                     audio_file = text_to_audio(podcast_script)
-                     if audio_file:
-                         st.audio(audio_file, format='audio/mp3', start_time=0)
-                         st.toast("Podcast Ready!", icon="🎙️")
+                 top_emails = st.session_state.emails[:5]
+                 if briefing_order == "By priority":
+                     top_emails = by_priority(top_emails)
+                 ensure_bodies(top_emails)
+                 st.session_state.pop("briefing_audio", None)
+                 # The greeting plays while the emails are still being summarised
+                 texts, clips = [], []
+                 with st.status("Generating Audio Briefing...", expanded=True) as status:
+                     for n, (summary, text, clip) in enumerate(podcast_briefing(st.session_state.user_full_name, top_emails)):
+                         status.update(label=f"Briefing: {n + 1} of {len(top_emails) + 2} segments ready")
+                         if clip is None:
+                             continue
+                         texts.append(text)
+                         clips.append(clip)
+                         st.caption(text if summary is None else text.split(". ")[0])
+                         st.audio(clip[0], format=clip[1], autoplay=n == 0)
+                     status.update(label="Briefing ready", state="complete", expanded=False)
+                 try:
+                     full = join_briefing(texts, clips)
+                 except Exception as e:
+                     full = None
+                     st.error(f"Could not join the briefing audio: {e}")
+                 else:
+                     if not full:
+                         st.error("Could not generate audio")
+                 if full:
+                     st.session_state.briefing_audio = full
+                     st.toast("Podcast Ready!", icon="🎙️")
+        if "briefing_audio" in st.session_state:
+            audio, mime = st.session_state.briefing_audio
+            st.audio(audio, format=mime, start_time=0)
         
         st.divider()
         
@@ -374,8 +321,15 @@ with st.sidebar:
         with st.expander("⚙️ View Settings", expanded=False):
             filter_type = st.radio("Inbox Filter", ["All Emails", "Unread Only"])
             limit_per_page = st.select_slider("Emails per Page", options=[5, 10, 15, 20], value=10)
-            enable_ocr = st.toggle("Enable Image Scan (OCR)")
-        
+            st.toggle("Enable Image Scan (OCR)", key="enable_ocr")
+            st.toggle("Live Updates (IMAP IDLE)", key="live_updates", help="Push new mail into the inbox as it arrives")
+            st.toggle("Auto-Triage New Mail", key="auto_triage_new", disabled=not st.session_state.get("live_updates"))
+            st.toggle("Performance Tracing", key="tracing", on_change=toggle_tracing, help="Time each stage and show it in a Performance tab")
+            st.caption("Models: " + ", ".join(f"{task} → {model_for(task)}" for task in ROUTES))
+            calls = usage()
+            if calls:
+                st.dataframe(pd.DataFrame(calls).round(2), hide_index=True, use_container_width=True)
+
         # 3. NAVIGATION LOGIC
         st.markdown("##### 🧭 Navigation")
         
@@ -404,31 +358,74 @@ with st.sidebar:
                 st.write("") 
 
         search_criteria = 'UNSEEN' if filter_type == "Unread Only" else 'ALL'
+        view = (st.session_state.current_page, limit_per_page, search_criteria)
+        loader = page_loader()
         if st.button("🔄 Refresh Inbox", use_container_width=True):
-            with st.spinner("Fetching latest emails..."):
-                result = fetch_emails(
-                    st.session_state.creds['user'], 
-                    st.session_state.creds['pass'], 
-                    limit=limit_per_page, 
-                    folder=search_criteria, 
-                    enable_ocr=enable_ocr, 
-                    page=st.session_state.current_page
-                )
-                if isinstance(result, str):
-                    st.error(result)
-                else:
-                    emails, total = result
-                    st.session_state.emails = emails
-                    st.session_state.total_emails = total
+            loader.invalidate()
+            st.session_state.loaded_view = None
+        
+        if st.session_state.get("live_updates"):
+            watcher = inbox_watcher()
+            watcher.auto_triage = st.session_state.get("auto_triage_new", False)
+            arrived = apply_inbox_updates(watcher.poll_events(), view, loader)
+            if arrived:
+                st.toast(f"{arrived} new email{'s' if arrived > 1 else ''}", icon="📬")
+            live_status()
+        else:
+            stop_watcher(st.session_state.creds['user'])
+        
+        # Pages load on the background worker; neighbours are prefetched.
+        # The page on screen stays until the user navigates or refreshes,
+        # so a view asks the loader once, not on every rerun.
+        if st.session_state.get("loaded_view") != view or st.session_state.get("requested_view") != view:
+            loader.request(*view, last_page=total_pages)
+            st.session_state.requested_view = view
+        if st.session_state.get("loaded_view") != view:
+            result = loader.get(*view)
+            if result is None:
+                page_progress(view)
+            elif isinstance(result, str):
+                st.error(result)
+                st.session_state.loaded_view = view
+            else:
+                emails, total = result
+                st.session_state.emails = emails
+                st.session_state.total_emails = total
+                st.session_state.loaded_view = view
+
+        # 4. BULK TRIAGE
+        with st.expander("📦 Bulk Triage", expanded=False):
+            st.caption("Classifies the whole inbox and writes the result back: Gmail gets Triage/<category> labels, other servers Triage/<category> folders.")
+            use_range = st.toggle("Only a date range", key="bulk_range")
+            since = before = None
+            if use_range:
+                since = st.date_input("From", key="bulk_since")
+                before = st.date_input("Until (exclusive)", key="bulk_before")
+            col_start, col_stop = st.columns(2)
+            with col_start:
+                if st.button("▶️ Start", use_container_width=True, help="Resumes an interrupted run"):
+                    bulk_triage_job(bulk_criteria(search_criteria, since, before))
+            with col_stop:
+                if st.button("⏹ Stop", key="bulk_stop", use_container_width=True):
+                    stop_bulk_triage(st.session_state.creds['user'])
+            bulk_progress()
 
         st.divider()
         col_logout, col_reset = st.columns(2)
         with col_logout:
             if st.button("Logout", use_container_width=True):
+                stop_watcher(st.session_state.creds['user'])
+                stop_bulk_triage(st.session_state.creds['user'])
+                close_page_loader(st.session_state.creds['user'])
+                close_mail_pool(st.session_state.creds['user'])
                 st.session_state.clear()
                 st.rerun()
         with col_reset:
             if st.button("Reset App", use_container_width=True):
+                stop_watcher(st.session_state.creds['user'])
+                stop_bulk_triage(st.session_state.creds['user'])
+                close_page_loader(st.session_state.creds['user'])
+                close_mail_pool(st.session_state.creds['user'])
                 st.session_state.clear()
                 st.rerun()
 
@@ -440,24 +437,38 @@ if st.session_state.logged_in:
         with st.expander("🤖 Chat with your Inbox", expanded=False):
             user_query = st.text_input("Ask a question:", placeholder="e.g., 'What does the screenshot in the last email say?'")
             if user_query and "emails" in st.session_state:
-                with st.spinner("Analyzing..."):
-                    answer = ask_inbox(st.session_state.emails, user_query)
-                    st.info(answer)
+                # Answer once per question; other widgets rerun the script too
+                if st.session_state.get("chat_query") == user_query:
+                    st.info(st.session_state.chat_answer)
+                else:
+                    ensure_bodies(st.session_state.emails)
+                    stats = {}
+                    answer = show_stream(stream_inbox_answer(st.session_state.emails, user_query, st.session_state.creds['user'], stats), stats, "stop_chat")
+                    if not stats.get("cancelled"):
+                        st.session_state.chat_query = user_query
+                        st.session_state.chat_answer = answer
     with col_b:
         if "emails" in st.session_state and st.session_state.emails:
             if st.button("✨ Auto-Triage"):
                 progress_text = "Classifying emails..."
                 my_bar = st.progress(0, text=progress_text)
+                ensure_bodies(st.session_state.emails)
                 total = len(st.session_state.emails)
-                for i, mail in enumerate(st.session_state.emails):
-                    category = classify_email(mail['sender'], mail['subject'], mail['body'])
-                    st.session_state.emails[i]['category'] = category
-                    my_bar.progress((i + 1) / total, text=f"Classifying {i+1}/{total}")
+                # Rules first, then batched model calls; results arrive out of order
+                for done, (i, category) in enumerate(triage_emails(st.session_state.emails), start=1):
+                    if category is None:
+                        # Model unreachable: shown as Personal, but not remembered
+                        st.session_state.emails[i]['category'] = "Personal"
+                    else:
+                        st.session_state.emails[i]['category'] = category
+                        remember_category(st.session_state.creds['user'], st.session_state.emails[i])
+                    my_bar.progress(done / total, text=f"Classifying {done}/{total}")
                 my_bar.empty()
                 st.rerun()
     st.divider()
     
-    tab1, tab2 = st.tabs(["📧 Inbox List", "📊 Dashboard Analytics"])
+    tabs = st.tabs(["📧 Inbox List", "📊 Dashboard Analytics"] + (["⏱️ Performance"] if st.session_state.tracing else []))
+    tab1, tab2 = tabs[:2]
     
     with tab1:
         if "emails" in st.session_state and st.session_state.emails:
@@ -465,6 +476,10 @@ if st.session_state.logged_in:
                 if 'category' not in mail: mail['category'] = None
                 if 'has_image' not in mail: mail['has_image'] = False
             
+            # Merge any OCR text that finished since the last rerun; never wait for it
+            if apply_ocr_results(st.session_state.creds['user'], st.session_state.emails):
+                ocr_progress()
+            
             priority_map = {"Security Alert": 0, "Job Application": 1, "Personal": 2, "Newsletter": 3, "Promotion/Spam": 4}
             sorted_emails = sorted(st.session_state.emails, key=lambda x: priority_map.get(x.get('category'), 5))
 
@@ -487,26 +502,35 @@ if st.session_state.logged_in:
                         st.markdown(f"##### {mail['subject']}")
                         st.caption(f"From: {mail['sender']} | {mail['date']}")
                         
-                        with st.expander("View Content"):
+                        # Body parts are only downloaded once the user opens the message
+                        if st.toggle("View Content", key=f"view_{mail['id']}"):
+                            ensure_bodies([mail])
                             st.text(mail['body'])
                     
                     with col2:
                         if st.button(f"Summarize", key=f"sum_{mail['id']}"):
-                            with st.spinner("Thinking..."):
-                                summary = summarize_with_ollama(mail['body'])
-                                st.info(summary)
-                                audio = text_to_audio(summary)
-                                if audio:
-                                    st.audio(audio, format='audio/mp3')
+                            ensure_bodies([mail])
+                            stats = {}
+                            summary = show_stream(stream_summary(mail['body'], stats), stats, f"stop_sum_{mail['id']}")
+                            clip = speak(summary)
+                            if clip:
+                                st.audio(clip[0], format=clip[1])
                         
                         with st.expander("Draft Reply"):
                             user_notes = st.text_area("Notes", key=f"note_{mail['id']}")
+                            streamed = False
                             if st.button("Generate Reply", key=f"rep_{mail['id']}"):
-                                st.session_state[f"generated_reply_{mail['id']}"] = generate_reply(mail['body'], user_notes)
+                                ensure_bodies([mail])
+                                stats = {}
+                                reply_text = show_stream(stream_reply(mail['body'], user_notes, st.session_state.get("user_full_name", "Sai"), stats), stats, f"stop_rep_{mail['id']}")
+                                if not stats.get("cancelled"):
+                                    st.session_state[f"generated_reply_{mail['id']}"] = reply_text
+                                streamed = True
                             
                             if f"generated_reply_{mail['id']}" in st.session_state:
                                 reply_text = st.session_state[f"generated_reply_{mail['id']}"]
-                                st.success(reply_text)
+                                if not streamed:
+                                    st.success(reply_text)
                                 
                                 if st.button("💾 Save to Gmail Drafts", key=f"save_{mail['id']}"):
                                     with st.spinner("Uploading to Gmail..."):
@@ -527,22 +551,67 @@ if st.session_state.logged_in:
             st.info("No emails found.")
 
     with tab2:
-        if "emails" in st.session_state and st.session_state.emails:
-            df = pd.DataFrame(st.session_state.emails)
-            if "category" in df.columns:
-                st.subheader("Inbox Composition")
-                df['category'] = df['category'].fillna("Uncategorized")
-                counts = df['category'].value_counts().reset_index()
-                counts.columns = ['Category', 'Count']
-                fig_pie = px.pie(counts, values='Count', names='Category', title='Email Categories', color_discrete_sequence=px.colors.qualitative.Pastel)
+        # Counters cover every email synced so far, not just this page, and
+        # are read straight from the cache's running totals
+        user = st.session_state.creds['user']
+        cache = get_cache()
+        analysed = cache.analytics_total(user, "inbox")
+        col_info, col_scan = st.columns([3, 1])
+        with col_info:
+            st.caption(f"{analysed:,} of {st.session_state.total_emails:,} emails analysed")
+        with col_scan:
+            if analysed < st.session_state.total_emails and st.button("🔎 Scan whole inbox"):
+                with st.spinner("Fetching headers for the whole inbox..."):
+                    sync_mailbox(user, st.session_state.creds['pass'])
+                st.rerun()
+        
+        if analysed:
+            categories = pd.DataFrame(cache.analytics(user, "inbox", "category"), columns=['Category', 'Count'])
+            st.subheader("Inbox Composition")
+            if set(categories['Category']) == {"Uncategorized"}:
+                st.info("Run 'Auto-Triage' or Bulk Triage to see Category Analytics!")
+            else:
+                fig_pie = px.pie(categories, values='Count', names='Category', title='Email Categories', color_discrete_sequence=px.colors.qualitative.Pastel)
                 st.plotly_chart(fig_pie, use_container_width=True)
-                
-                st.subheader("Top Senders")
-                sender_counts = df['sender'].value_counts().head(5).reset_index()
-                sender_counts.columns = ['Sender', 'Count']
-                fig_bar = px.bar(sender_counts, x='Count', y='Sender', orientation='h', title="Most Active Senders", color='Count', color_continuous_scale='Bluered')
-                st.plotly_chart(fig_bar, use_container_width=True)
+            
+            st.subheader("Top Senders")
+            sender_counts = pd.DataFrame(cache.analytics(user, "inbox", "sender", limit=10), columns=['Sender', 'Count'])
+            fig_bar = px.bar(sender_counts, x='Count', y='Sender', orientation='h', title="Most Active Senders", color='Count', color_continuous_scale='Bluered')
+            fig_bar.update_yaxes(autorange="reversed")
+            st.plotly_chart(fig_bar, use_container_width=True)
+            
+            st.subheader("Volume Over Time")
+            period = st.radio("Period", ["30 days", "90 days", "1 year", "All"], index=1, horizontal=True, key="volume_period")
+            days = {"30 days": 30, "90 days": 90, "1 year": 365}.get(period)
+            since = (pd.Timestamp.now().normalize() - pd.Timedelta(days=days - 1)) if days else None
+            daily = pd.DataFrame(cache.analytics(user, "inbox", "day", since=since.strftime("%Y-%m-%d") if days else None), columns=['Day', 'Emails'])
+            if not daily.empty:
+                daily['Day'] = pd.to_datetime(daily['Day'])
+                # Quiet days have no counter; show them as zero
+                start = since if days else daily['Day'].min()
+                daily = daily.set_index('Day').reindex(pd.date_range(start, max(daily['Day'].max(), pd.Timestamp.now().normalize())), fill_value=0).rename_axis('Day').reset_index()
+                st.plotly_chart(px.bar(daily, x='Day', y='Emails', title="Emails per Day"), use_container_width=True)
             else:
-                st.info("Run 'Auto-Triage' first to see Category Analytics!")
+                st.caption("No emails in this period.")
+            
+            hourly = pd.DataFrame(cache.analytics(user, "inbox", "hour"), columns=['Hour', 'Emails'])
+            if not hourly.empty:
+                col_hour, col_week = st.columns(2)
+                with col_hour:
+                    hourly['Hour'] = hourly['Hour'].astype(int)
+                    hourly = hourly.set_index('Hour').reindex(range(24), fill_value=0).reset_index()
+                    st.plotly_chart(px.bar(hourly, x='Hour', y='Emails', title="Emails by Hour of Day"), use_container_width=True)
+                with col_week:
+                    grid = [[0] * 24 for _ in range(7)]
+                    for key, count in cache.analytics(user, "inbox", "weekday_hour"):
+                        weekday, hour = map(int, key.split("-"))
+                        grid[weekday][hour] = count
+                    fig_heat = px.imshow(grid, x=list(range(24)), y=["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"],
+                                         labels={"x": "Hour", "y": "", "color": "Emails"}, title="Weekly Rhythm", color_continuous_scale="Blues", aspect="auto")
+                    st.plotly_chart(fig_heat, use_container_width=True)
         else:
-            st.info("Fetch emails to see analytics.")
\ No newline at end of file
+            st.info("Fetch emails to see analytics.")
+
+    if st.session_state.tracing:
+        with tabs[2]:
+            performance_panel()
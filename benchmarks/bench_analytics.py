@@ -0,0 +1,85 @@
+import argparse
+import random
+import statistics
+import time
+
+import pandas as pd
+
+from mail_cache import MailCache
+
+from benchmarks.bench_rules import SENDERS, SUBJECTS
+from triage import CATEGORIES
+
+# --- DASHBOARD ANALYTICS BENCHMARK ---
+# Data preparation for the Dashboard tab: a DataFrame over every cached
+# message with value_counts on each rerun vs. reading the running
+# counters kept by the message cache.
+
+
+def synthetic_messages(count, seed=0):
+    rng = random.Random(seed)
+    start = 1_600_000_000
+    return [{
+        "uid": uid, "sender": rng.choice(SENDERS), "sender_email": rng.choice(SENDERS), "subject": rng.choice(SUBJECTS),
+        "timestamp": start + rng.randint(0, 3 * 365 * 86400), "category": rng.choice(CATEGORIES + [None]), "body": None,
+    } for uid in range(1, count + 1)]
+
+
+def dashboard_dataframe(messages):
+    df = pd.DataFrame(messages)
+    df['category'] = df['category'].fillna("Uncategorized")
+    when = pd.to_datetime(df['timestamp'], unit='s')
+    return (df['category'].value_counts(), df['sender'].value_counts().head(10),
+            when.dt.date.value_counts(), when.dt.hour.value_counts())
+
+
+def dashboard_counters(cache):
+    return [cache.analytics("bench", "inbox", kind, limit=10 if kind == "sender" else None)
+            for kind in ("category", "sender", "day", "hour", "weekday_hour")]
+
+
+def timed(fn, repeat=5):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def run(count):
+    messages = synthetic_messages(count)
+    cache = MailCache(":memory:", max_messages=count + 1, max_bytes=1 << 40)
+    cache.set_mailbox_state("bench", "inbox", 1, count)
+    start = time.perf_counter()
+    for i in range(0, count, 500):
+        cache.put_messages("bench", "inbox", 1, messages[i:i + 500])
+    sync = time.perf_counter() - start
+    # What the old tab had to do first: every cached message back into memory
+    load = lambda: list(cache.get_messages("bench", "inbox", 1, range(1, count + 1), touch=False).values())
+    return {
+        "messages": count,
+        "sync_s": sync,
+        "dataframe_ms": timed(lambda: dashboard_dataframe(load())),
+        "counters_ms": timed(lambda: dashboard_counters(cache)),
+        "triage_update_ms": timed(lambda: cache.update_messages(
+            "bench", "inbox", 1, {uid: {"category": "Newsletter"} for uid in range(1, 21)})),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Dashboard analytics")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'messages':>9} {'sync s':>7} {'DataFrame ms':>13} {'counters ms':>12} {'20 triaged ms':>14}")
+    for size in args.sizes:
+        r = run(size)
+        results.append(r)
+        print(f"{r['messages']:>9} {r['sync_s']:>7.2f} {r['dataframe_ms']:>13.1f} {r['counters_ms']:>12.2f} {r['triage_update_ms']:>14.2f}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import random
+import time
+
+from briefing import briefing_segments, by_priority, stream_briefing
+from tts import AudioCache, Speaker, BACKENDS
+from triage import CATEGORIES
+
+from benchmarks.bench_rules import SENDERS, SUBJECTS
+
+# --- PODCAST BRIEFING BENCHMARK ---
+# Old flow (every summary in turn, then one TTS call for the whole script)
+# vs. the pipeline (concurrent summaries, one TTS call per segment, cached).
+# The model and the TTS engine are stand-ins that sleep for a fixed
+# latency plus a per-character cost, so the numbers show the scheduling,
+# not any one machine's Ollama or network.
+
+
+class StubBackend:
+    name = "stub"
+    mime = "audio/mp3"
+    offline = True
+    voice = "stub"
+    latency = 0.3
+    per_char = 0.001
+
+    def available(self):
+        return True
+
+    def synthesize(self, text):
+        time.sleep(self.latency + self.per_char * len(text))
+        return text.encode("utf-8")
+
+
+def stub_summarize(latency):
+    def summarize(body):
+        time.sleep(latency)
+        return f"A short summary of an email about {body[:40]}"
+    return summarize
+
+
+def synthetic_emails(count, seed=0):
+    rng = random.Random(seed)
+    return [{"sender": rng.choice(SENDERS), "subject": rng.choice(SUBJECTS), "body": rng.choice(SUBJECTS) * 20,
+             "category": rng.choice(CATEGORIES)} for _ in range(count)]
+
+
+def sequential(emails, summarize, backend):
+    start = time.perf_counter()
+    summaries = [summarize(mail["body"]) for mail in emails]
+    backend.synthesize("".join(briefing_segments("Alex", emails, summaries)))
+    total = time.perf_counter() - start
+    return total, total
+
+
+def pipelined(emails, summarize, speaker, workers):
+    start = time.perf_counter()
+    first = None
+    for _ in stream_briefing("Alex", emails, summarize, speaker.speak, workers):
+        if first is None:
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the podcast briefing")
+    parser.add_argument("--emails", type=int, default=5)
+    parser.add_argument("--summary-s", type=float, default=1.5, help="stub model latency per summary")
+    parser.add_argument("--tts-s", type=float, default=0.3, help="stub TTS latency per call")
+    parser.add_argument("--workers", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    StubBackend.latency = args.tts_s
+    BACKENDS["stub"] = StubBackend
+    emails = synthetic_emails(args.emails)
+    summarize = stub_summarize(args.summary_s)
+    speaker = Speaker("stub", AudioCache(":memory:"))
+
+    # The app's LLM cache answers repeat summaries; stand in for it here
+    summaries = {}
+
+    def remembered(body):
+        if body not in summaries:
+            summaries[body] = summarize(body)
+        return summaries[body]
+
+    rows = [("sequential, one TTS call", *sequential(emails, summarize, StubBackend())),
+            (f"pipelined, {args.workers} workers", *pipelined(emails, remembered, speaker, args.workers)),
+            ("replay (cached)", *pipelined(emails, remembered, speaker, args.workers)),
+            ("re-ordered by priority", *pipelined(by_priority(emails), remembered, speaker, args.workers))]
+
+    print(f"{'run':<26} {'first audio s':>14} {'total s':>8}")
+    for name, first, total in rows:
+        print(f"{name:<26} {first:>14.2f} {total:>8.2f}")
+    print(f"TTS calls: {speaker.stats['synthesized']}, cache hits: {speaker.stats['hits']}")
+    return rows
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Every cache goes to a throwaway directory, so each run starts cold and the
+# real ~/.email_agent is never touched. Must be set before the app modules
+# are imported: they read it at import time.
+os.environ["EMAIL_AGENT_HOME"] = tempfile.mkdtemp(prefix="email_agent_bench_")
+os.environ["EMAIL_AGENT_TTS"] = "stub"
+
+import mail_agent  # noqa: E402
+import tracing  # noqa: E402
+from mail_agent import (  # noqa: E402
+    fetch_emails, load_email_bodies, apply_ocr_results, recent_emails, sync_mailbox, ask_inbox, podcast_briefing,
+)
+from models import call_log  # noqa: E402
+from triage import triage_emails  # noqa: E402
+from tts import BACKENDS  # noqa: E402
+
+from benchmarks.bench_briefing import StubBackend  # noqa: E402
+from benchmarks.imap_stub import start_stub, synthetic_mailbox  # noqa: E402
+from benchmarks.ollama_stub import start_ollama_stub, point_ollama_at  # noqa: E402
+
+# --- END-TO-END BENCHMARK ---
+# The app's own code paths against a local IMAP server seeded with a
+# synthetic mailbox and the local Ollama stand-in, scenario by scenario:
+#
+#   fetch    inbox pages via fetch_emails, cold then from the cache, and opening their bodies
+#   triage   Auto-Triage of the newest emails, then the same emails again (cached)
+#   ask      indexing the mailbox for chat, then ask_inbox questions
+#   ocr      loading pages with image scan on until every image is done
+#   podcast  the spoken briefing: time to first audio, total, cached replay
+#
+# Each scenario also records the tracing breakdown per stage. Results go to
+# a JSON file named after the commit, so two commits can be compared:
+#
+#   python -m benchmarks.bench_e2e                                  -> benchmarks/results/e2e-<commit>.json
+#   python -m benchmarks.bench_e2e --compare benchmarks/results/e2e-abc1234.json
+#   python -m benchmarks.bench_e2e --compare old.json new.json      (no run)
+#
+# Model time is the stand-in's laptop-CPU speed multiplied by --llm-scale;
+# only compare runs made with the same options.
+
+USER, PASSWORD = "bench@example.com", "pw"
+QUESTIONS = ["what do I need to review for the project meeting?", "any security alerts this week?",
+             "who asked me for an update?", "did anyone send an invoice?"]
+SCENARIOS = ("fetch", "triage", "ask", "ocr", "podcast")
+
+
+def _ms(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {"p50_ms": values[len(values) // 2] * 1000, "p95_ms": values[min(len(values) - 1, int(len(values) * 0.95))] * 1000,
+            "mean_ms": statistics.mean(values) * 1000}
+
+
+def _page(page, limit):
+    result = fetch_emails(USER, PASSWORD, limit=limit, folder="ALL", page=page)
+    if isinstance(result, str):
+        raise RuntimeError(result)
+    return result[0]
+
+
+def scenario_fetch(args):
+    cold, warm, bodies = [], [], []
+    for page in range(1, args.pages + 1):
+        start = time.perf_counter()
+        emails = _page(page, args.limit)
+        cold.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        load_email_bodies(USER, PASSWORD, emails)
+        bodies.append(time.perf_counter() - start)
+    for page in range(1, args.pages + 1):
+        start = time.perf_counter()
+        _page(page, args.limit)
+        warm.append(time.perf_counter() - start)
+    metrics = {"pages": args.pages, "messages_per_s": args.pages * args.limit / sum(cold)}
+    metrics.update({f"page_cold_{k}": v for k, v in _ms(cold).items()})
+    metrics.update({f"page_warm_{k}": v for k, v in _ms(warm).items()})
+    metrics.update({f"bodies_{k}": v for k, v in _ms(bodies).items()})
+    return metrics
+
+
+def scenario_triage(args):
+    emails = recent_emails(USER, PASSWORD, args.triage)
+    metrics = {"emails": len(emails)}
+    for run in ("cold", "warm"):
+        start = time.perf_counter()
+        labels = list(triage_emails(emails))
+        elapsed = time.perf_counter() - start
+        metrics[f"{run}_s"] = elapsed
+        metrics[f"{run}_emails_per_s"] = len(labels) / elapsed if elapsed else None
+    return metrics
+
+
+def scenario_ask(args):
+    start = time.perf_counter()
+    sync_mailbox(USER, PASSWORD, bodies=True)
+    metrics = {"sync_index_s": time.perf_counter() - start, "indexed": mail_agent.get_vector_index().stats()["messages"]}
+    emails = recent_emails(USER, PASSWORD, args.limit)
+    times = []
+    for n in range(args.questions):
+        start = time.perf_counter()
+        answer = ask_inbox(emails, QUESTIONS[n % len(QUESTIONS)], account=USER)
+        times.append(time.perf_counter() - start)
+        if answer.startswith("Error"):
+            raise RuntimeError(answer)
+    chats = [e for e in list(call_log) if e["task"] == "chat"][-args.questions:]
+    metrics["first_question_ms"] = times[0] * 1000
+    metrics.update({f"question_{k}": v for k, v in _ms(times).items()})
+    metrics["prompt_tokens_mean"] = statistics.mean(e["prompt_tokens"] or 0 for e in chats) if chats else None
+    return metrics
+
+
+def scenario_ocr(args):
+    pipeline = mail_agent.get_ocr_pipeline()
+    emails = []
+    for page in range(1, args.pages + 1):
+        emails += [m for m in _page(page, args.limit)
+                   if any(p["type"].startswith("image/") for p in m["parts"])]
+    start = time.perf_counter()
+    load_email_bodies(USER, PASSWORD, emails, enable_ocr=True)
+    fetched = time.perf_counter() - start
+    while apply_ocr_results(USER, emails) and time.perf_counter() - start < args.timeout:
+        time.sleep(0.05)
+    return {"emails_with_images": len(emails), "fetch_with_ocr_s": fetched, "all_done_s": time.perf_counter() - start,
+            "pending": pipeline.pending(), "text_found": sum(1 for m in emails if m.get("has_image")),
+            "tesseract": shutil.which("tesseract") is not None}
+
+
+def scenario_podcast(args):
+    emails = recent_emails(USER, PASSWORD, args.briefing)
+    metrics = {"emails": len(emails)}
+    for run in ("cold", "replay"):
+        start = time.perf_counter()
+        first = None
+        for _ in podcast_briefing("Alex", emails):
+            if first is None:
+                first = time.perf_counter() - start
+        metrics[f"{run}_first_audio_s"] = first
+        metrics[f"{run}_total_s"] = time.perf_counter() - start
+    return metrics
+
+
+def run_scenario(name, args, llm):
+    tracing.reset()
+    requests = len(llm.requests)
+    start = time.perf_counter()
+    try:
+        metrics = globals()[f"scenario_{name}"](args)
+        error = None
+    except Exception as e:
+        metrics, error = {}, f"{type(e).__name__}: {e}"
+    result = {"wall_s": time.perf_counter() - start, "metrics": metrics, "llm_requests": len(llm.requests) - requests,
+              "stages": [{k: round(v, 3) if isinstance(v, float) else v for k, v in row.items()} for row in tracing.stage_stats()],
+              "counters": dict(tracing.counters)}
+    if error:
+        result["error"] = error
+    return result
+
+
+def _git(*command):
+    try:
+        return subprocess.run(["git", *command], capture_output=True, text=True, timeout=30,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except Exception:
+        return ""
+
+
+def run(args):
+    imap = start_stub(synthetic_mailbox(args.messages, args.html_ratio, args.attachment_ratio, args.seed, args.image_ratio),
+                      latency=args.imap_latency_ms / 1000)
+    llm = start_ollama_stub(scale=args.llm_scale, latency=args.llm_latency_ms / 1000)
+    point_ollama_at(llm.url)
+    mail_agent.IMAP_SERVER.clear()
+    mail_agent.IMAP_SERVER.update(host="127.0.0.1", port=imap.port, use_ssl=False)
+    StubBackend.latency = args.tts_latency_ms / 1000
+    BACKENDS["stub"] = StubBackend
+    tracing.enable(None)
+
+    results = {"commit": _git("rev-parse", "--short", "HEAD") or None, "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+               "date": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+               "options": {k: v for k, v in vars(args).items() if k not in ("compare", "out")}, "scenarios": {}}
+    for name in args.scenarios:
+        print(f"running {name}...", file=sys.stderr, flush=True)
+        results["scenarios"][name] = run_scenario(name, args, llm)
+    imap.shutdown()
+    llm.shutdown()
+    return results
+
+
+def _flat(results):
+    return {(name, key): value for name, scenario in results["scenarios"].items()
+            for key, value in dict(scenario["metrics"], wall_s=scenario["wall_s"]).items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)}
+
+
+def print_results(results):
+    for name, scenario in results["scenarios"].items():
+        print(f"\n{name}" + (f"  FAILED: {scenario['error']}" if scenario.get("error") else f"  ({scenario['wall_s']:.2f}s)"))
+        for key, value in scenario["metrics"].items():
+            print(f"  {key:<24} {value:>12.2f}" if isinstance(value, float) else f"  {key:<24} {value!s:>12}")
+        for row in scenario["stages"][:5]:
+            print(f"  · {row['stage']:<22} {row['count']:>6} x {row['mean_ms']:>9.2f}ms  p95 {row['p95_ms']:>9.2f}ms")
+
+
+def print_comparison(base, new):
+    print(f"\n{'scenario':<10} {'metric':<24} {base.get('commit') or 'base':>12} {new.get('commit') or 'new':>12} {'change':>8}")
+    old, now = _flat(base), _flat(new)
+    for key in old:
+        if key not in now:
+            continue
+        change = f"{(now[key] - old[key]) / old[key]:+.0%}" if old[key] else ""
+        print(f"{key[0]:<10} {key[1]:<24} {old[key]:>12.2f} {now[key]:>12.2f} {change:>8}")
+    differ = [k for k in set(base.get("options", {})) | set(new.get("options", {}))
+              if k != "scenarios" and base.get("options", {}).get(k) != new.get("options", {}).get(k)]
+    if differ:
+        print(f"\nnote: the runs used different options: {', '.join(sorted(differ))}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end benchmark against local IMAP and Ollama stand-ins")
+    parser.add_argument("--scenarios", type=lambda s: [x for x in s.split(",") if x], default=list(SCENARIOS),
+                        help="comma-separated subset of " + ",".join(SCENARIOS))
+    parser.add_argument("--messages", type=int, default=300, help="mailbox size")
+    parser.add_argument("--html-ratio", type=float, default=0.5)
+    parser.add_argument("--attachment-ratio", type=float, default=0.1)
+    parser.add_argument("--image-ratio", type=float, default=0.1, help="share of emails with a scanned image")
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=20, help="emails per page")
+    parser.add_argument("--triage", type=int, default=40, help="emails to Auto-Triage")
+    parser.add_argument("--questions", type=int, default=3)
+    parser.add_argument("--briefing", type=int, default=5, help="emails in the podcast briefing")
+    parser.add_argument("--imap-latency-ms", type=float, default=10.0, help="per IMAP command")
+    parser.add_argument("--llm-latency-ms", type=float, default=5.0, help="per Ollama request, on top of model time")
+    parser.add_argument("--llm-scale", type=float, default=0.01, help="wall seconds per simulated model second")
+    parser.add_argument("--tts-latency-ms", type=float, default=100.0, help="per TTS call")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for OCR")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="results file (default benchmarks/results/e2e-<commit>.json)")
+    parser.add_argument("--compare", nargs="+", metavar="RESULTS", help="BASE.json [NEW.json]: compare with a run, or two saved runs")
+    args = parser.parse_args(argv)
+
+    if args.compare and len(args.compare) > 1:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            print_comparison(json.load(f), json.load(g))
+        return None
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    results = run(args)
+    print_results(results)
+    out = args.out or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                   f"e2e-{results['commit'] or 'unknown'}{'-dirty' if results['dirty'] else ''}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"\nresults written to {out}")
+    if args.compare:
+        with open(args.compare[0]) as f:
+            print_comparison(json.load(f), results)
+    return results
+
+
+if __name__ == "__main__":
+    main()
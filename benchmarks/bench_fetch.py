@@ -0,0 +1,88 @@
+import argparse
+import email
+import imaplib
+import statistics
+import time
+
+from imap_fetch import iter_fetch
+from benchmarks.imap_stub import start_stub, synthetic_mailbox
+
+# --- FETCH BENCHMARK ---
+# Compares the old one-FETCH-per-message loop with the batched engine
+# against a local IMAP stand-in with simulated round-trip latency.
+
+
+def page_ids(mail, page, limit):
+    _, search_data = mail.search(None, "ALL")
+    mail_ids = search_data[0].split()
+    end_idx = len(mail_ids) - ((page - 1) * limit)
+    start_idx = max(0, end_idx - limit)
+    return list(reversed(mail_ids[start_idx:end_idx]))
+
+
+def load_page_per_message(mail, ids):
+    messages = []
+    for num in ids:
+        _, msg_data = mail.fetch(num, "(RFC822)")
+        for response_part in msg_data:
+            if isinstance(response_part, tuple):
+                messages.append(email.message_from_bytes(response_part[1]))
+    return messages
+
+
+def load_page_batched(mail, ids):
+    return [email.message_from_bytes(attrs["RFC822"]) for _, attrs in iter_fetch(mail, ids, "(RFC822)")]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def run(loader, port, pages, limit):
+    mail = imaplib.IMAP4("127.0.0.1", port)
+    mail.login("bench", "bench")
+    mail.select("inbox")
+    latencies = []
+    count = 0
+    for page in range(1, pages + 1):
+        start = time.perf_counter()
+        count += len(loader(mail, page_ids(mail, page, limit)))
+        latencies.append(time.perf_counter() - start)
+    mail.logout()
+    total = sum(latencies)
+    return {
+        "messages": count,
+        "messages_per_sec": count / total if total else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark per-message vs batched IMAP fetch")
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--pages", type=int, default=15)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    args = parser.parse_args(argv)
+
+    server = start_stub(synthetic_mailbox(args.messages), latency=args.latency_ms / 1000)
+    try:
+        results = {
+            "per_message": run(load_page_per_message, server.port, args.pages, args.limit),
+            "batched": run(load_page_batched, server.port, args.pages, args.limit),
+        }
+    finally:
+        server.shutdown()
+
+    print(f"{args.pages} pages x {args.limit} msgs, {args.latency_ms:.0f} ms simulated RTT")
+    for name, r in results.items():
+        print(f"{name:>12}: {r['messages_per_sec']:8.1f} msg/s  p50 {r['p50_ms']:7.1f} ms  p95 {r['p95_ms']:7.1f} ms")
+    return results
+
+
+if __name__ == "__main__":
+    main()
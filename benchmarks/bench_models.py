@@ -0,0 +1,97 @@
+import argparse
+import random
+import threading
+import time
+
+import ollama
+
+import models
+from mail_agent import _summary_messages, _summary_text, _reply_prompt, _reply_text
+from triage import _batch_prompt, batch_schema
+
+from benchmarks.bench_prompts import synthetic_email
+from benchmarks.ollama_stub import start_ollama_stub, point_ollama_at
+
+# --- MODEL ROUTING BENCHMARK ---
+# One morning session against the local Ollama stand-in (load times and
+# token speeds of a laptop CPU, see ollama_stub.PROFILES): log in after the
+# models were unloaded overnight, summarize one email, triage the inbox,
+# step away for --idle seconds, then draft a reply.
+#   old: every task on llama3.2, Ollama's default keep-alive (5 min), no
+#        warm-up, no num_ctx/num_predict
+#   new: the models.py routes, warm-up during the fetch, 30 min keep-alive,
+#        labels from the 1B model with num_predict
+# Both send the label schema: it makes the answers valid, not faster.
+# Times are the simulated seconds (wall time / --scale).
+
+
+def session(srv, mails, routed, args):
+    def call(task, messages, **extra):
+        if routed:
+            return models.chat(task, messages, **extra)
+        return ollama.chat(model="llama3.2", messages=messages, **extra)
+
+    srv.unload_all()
+    rows = {}
+    start = time.perf_counter()
+    warm = threading.Thread(target=models.warm_up) if routed else None
+    if warm:
+        warm.start()
+    time.sleep(args.fetch * args.scale)
+    rows["login (fetch)"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    response = call("summary", _summary_messages(_summary_text(mails[0]["body"])))
+    rows["first summary"] = time.perf_counter() - start
+    tokens = response.get("eval_count") or 0
+
+    start = time.perf_counter()
+    for i in range(0, len(mails), 5):
+        batch = mails[i:i + 5]
+        response = call("classify_batch", [{"role": "user", "content": _batch_prompt(batch)}], format=batch_schema(len(batch)))
+        tokens += response.get("eval_count") or 0
+    rows[f"triage {len(mails)}"] = time.perf_counter() - start
+
+    srv.idle(args.idle)
+    start = time.perf_counter()
+    prompt = _reply_prompt(_reply_text(mails[1]["body"], "say yes", "Sam"), "say yes", "Sam")
+    response = call("reply", [{"role": "user", "content": prompt}])
+    rows["reply after idle"] = time.perf_counter() - start
+    tokens += response.get("eval_count") or 0
+    if warm:
+        warm.join()
+    return {k: v / args.scale for k, v in rows.items()}, tokens, list(srv.loads)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark model routing, keep-alive and warm-up")
+    parser.add_argument("--emails", type=int, default=50)
+    parser.add_argument("--fetch", type=float, default=3.0, help="seconds the IMAP fetch takes at login")
+    parser.add_argument("--idle", type=float, default=600.0, help="seconds between triage and the reply")
+    parser.add_argument("--scale", type=float, default=0.02, help="wall seconds per simulated second")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    srv = start_ollama_stub(scale=args.scale)
+    point_ollama_at(srv.url)
+
+    rng = random.Random(args.seed)
+    mails = [synthetic_email(rng, n) for n in range(args.emails)]
+    results = {}
+    for label, routed in (("old", False), ("new", True)):
+        srv.loads.clear()
+        results[label] = session(srv, mails, routed, args)
+
+    (old, old_tokens, old_loads), (new, new_tokens, new_loads) = results["old"], results["new"]
+    print(f"{'step':<18} {'old s':>8} {'new s':>8}")
+    for step in old:
+        print(f"{step:<18} {old[step]:>8.2f} {new[step]:>8.2f}")
+    print(f"{'total':<18} {sum(old.values()):>8.2f} {sum(new.values()):>8.2f}")
+    print(f"generated tokens: old {old_tokens}, new {new_tokens}")
+    print(f"model loads: old {old_loads}, new {new_loads}")
+    srv.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    main()
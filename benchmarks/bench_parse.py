@@ -0,0 +1,224 @@
+import argparse
+import email
+import imaplib
+import importlib.util
+import multiprocessing
+import os
+import pickle
+import queue as queues
+import random
+import resource
+import tempfile
+import time
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from imap_fetch import iter_fetch, fetch_sections, parse_bodystructure
+from mail_agent import assemble_body, _wanted_sections, _section_caps
+from mime_parse import MAX_PART_BYTES, MAX_TEXT_CHARS
+
+from benchmarks.bench_rules import SENDERS, SUBJECTS, WORDS
+from benchmarks.imap_stub import Mailbox, start_stub
+
+# --- MIME PARSE BENCHMARK ---
+# The old body path (the whole message over RFC822, email.message_from_bytes,
+# then a BeautifulSoup tree per HTML part) vs. the app's: BODYSTRUCTURE, a
+# partial BODY.PEEK of each text part up to its byte cap, then
+# mail_agent.assemble_body (part_text per section). The app's fetches are
+# taken from the local IMAP stand-in beforehand, so only parsing is timed.
+# Both outputs are cut at the same text cap, as the app does. MB/s is over
+# the bytes each mode parses: whole messages for the old path, the fetched
+# parts for the app's. Each mode runs in a fresh process so peak RSS is its
+# own. Point --corpus at a folder of
+# .eml files exported from a real mailbox; without it a synthetic corpus
+# (plain mail, large HTML newsletters, attachments) is generated.
+
+
+def _paragraphs(rng, count):
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 80))) for _ in range(count)]
+
+
+def _newsletter(rng, blocks):
+    rows = "".join(
+        f'<tr><td style="padding:12px;font-family:Arial,sans-serif;color:#333333;font-size:14px">'
+        f'<a href="https://example.com/track?id={rng.getrandbits(64):x}">{rng.choice(SUBJECTS)}</a>'
+        f"<p>{text}</p></td></tr><!-- block {n} -->"
+        for n, text in enumerate(_paragraphs(rng, blocks))
+    )
+    style = "<style>" + "".join(f".c{n}{{margin:0;padding:{n}px}}" for n in range(500)) + "</style>"
+    return f"<html><head><title>Newsletter</title>{style}</head><body><table>{rows}</table></body></html>"
+
+
+def synthetic_corpus(folder, count, seed=0):
+    rng = random.Random(seed)
+    for n in range(count):
+        kind = n % 4
+        if kind == 0:
+            msg = MIMEText("\n\n".join(_paragraphs(rng, rng.randint(2, 10))))
+        elif kind == 1:
+            msg = MIMEMultipart("alternative")
+            blocks = rng.randint(200, 3000)
+            msg.attach(MIMEText("\n\n".join(_paragraphs(rng, 5)), "plain"))
+            msg.attach(MIMEText(_newsletter(rng, blocks), "html"))
+        elif kind == 2:
+            msg = MIMEMultipart()
+            msg.attach(MIMEText("\n\n".join(_paragraphs(rng, 3))))
+            msg.attach(MIMEApplication(rng.randbytes(rng.randint(200_000, 3_000_000)), Name="report.pdf"))
+        else:
+            msg = MIMEText("\n\n".join(_paragraphs(rng, 20)), "plain", "iso-8859-1")
+        msg["From"] = rng.choice(SENDERS)
+        msg["Subject"] = rng.choice(SUBJECTS)
+        msg["Date"] = "Mon, 01 Jan 2024 09:00:00 +0000"
+        with open(os.path.join(folder, f"{n:04d}.eml"), "wb") as f:
+            f.write(msg.as_bytes())
+
+
+def parse_legacy(path, max_text_chars=MAX_TEXT_CHARS):
+    from bs4 import BeautifulSoup
+
+    with open(path, "rb") as f:
+        msg = email.message_from_bytes(f.read())
+    text = ""
+    for part in msg.walk():
+        content_type = part.get_content_type()
+        if "attachment" in str(part.get("Content-Disposition")):
+            continue
+        payload = part.get_payload(decode=True)
+        if payload is None:
+            continue
+        if content_type == "text/plain":
+            text += payload.decode(part.get_content_charset() or "utf-8", errors="replace") + "\n"
+        elif content_type == "text/html":
+            html_body = payload.decode(part.get_content_charset() or "utf-8", errors="replace")
+            text += BeautifulSoup(html_body, "lxml").get_text(separator=" ", strip=True) + "\n"
+    return text[:max_text_chars]
+
+
+def app_fetches(paths, out, max_part_bytes=MAX_PART_BYTES):
+    # (parts, payloads) per message exactly as fetch_bodies receives them,
+    # pickled to `out` for the measuring process
+    server = start_stub(Mailbox(open(p, "rb").read() for p in paths))
+    mail = imaplib.IMAP4("127.0.0.1", server.port)
+    try:
+        mail.login("bench", "bench")
+        mail.select("inbox")
+        structures = list(iter_fetch(mail, list(range(1, len(paths) + 1)), "(BODYSTRUCTURE)", uid=True))
+        fetched = []
+        for uid, attrs in structures:
+            parts = parse_bodystructure(attrs["BODYSTRUCTURE"])
+            sections = _wanted_sections({"parts": parts}, False)
+            caps = _section_caps(parts, sections, max_part_bytes)
+            payloads = dict(fetch_sections(mail, [uid], sections, caps)).get(uid, {})
+            fetched.append((parts, payloads))
+    finally:
+        mail.logout()
+        server.shutdown()
+    with open(out, "wb") as f:
+        pickle.dump(fetched, f)
+    return sum(len(v or b"") for _, payloads in fetched for v in payloads.values())
+
+
+def _peak_rss_kb():
+    # ru_maxrss survives exec on Linux, so a spawned child would report the
+    # parent's peak; VmHWM belongs to this process alone
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _measure(mode, paths, fetched_path, caps, queue):
+    max_part_bytes, max_text_chars = caps
+    if mode == "legacy":
+        items = paths
+        size = sum(os.path.getsize(p) for p in paths)
+        parse = lambda path: parse_legacy(path, max_text_chars)
+    else:
+        with open(fetched_path, "rb") as f:
+            items = pickle.load(f)
+        size = sum(len(v or b"") for _, payloads in items for v in payloads.values())
+        parse = lambda item: assemble_body(*item, max_part_bytes=max_part_bytes, max_text_chars=max_text_chars)[0]
+    parse(items[0])  # warm imports before taking the baseline
+    baseline = _peak_rss_kb()
+    start = time.perf_counter()
+    chars = sum(len(parse(item)) for item in items)
+    elapsed = time.perf_counter() - start
+    peak = _peak_rss_kb()
+    queue.put({
+        "mode": mode,
+        "messages": len(items),
+        "mb_parsed": size / 1e6,
+        "mb_per_sec": size / elapsed / 1e6,
+        "msgs_per_sec": len(items) / elapsed,
+        "peak_rss_mb": peak / 1024,
+        "rss_growth_mb": (peak - baseline) / 1024,
+        "text_chars": chars,
+    })
+
+
+def run(mode, paths, fetched_path, timeout=600, caps=(MAX_PART_BYTES, MAX_TEXT_CHARS)):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_measure, args=(mode, paths, fetched_path, caps, queue))
+    proc.start()
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                return queue.get(timeout=1)
+            except queues.Empty:
+                # A child that died (e.g. on an ImportError) never sends a result
+                if not proc.is_alive():
+                    raise RuntimeError(f"{mode} run exited with code {proc.exitcode}") from None
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{mode} run timed out after {timeout}s") from None
+    finally:
+        if proc.is_alive():
+            proc.terminate()
+        proc.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark MIME body parsing")
+    parser.add_argument("--corpus", default=None, help="folder of .eml files (default: synthetic corpus)")
+    parser.add_argument("--messages", type=int, default=200, help="size of the synthetic corpus")
+    parser.add_argument("--modes", nargs="+", default=["legacy", "app"], choices=["legacy", "app"])
+    parser.add_argument("--timeout", type=float, default=600.0, help="seconds per mode")
+    parser.add_argument("--max-part-bytes", type=int, default=MAX_PART_BYTES, help="bytes fetched per text part")
+    parser.add_argument("--max-text-chars", type=int, default=MAX_TEXT_CHARS, help="characters kept per message")
+    args = parser.parse_args(argv)
+    caps = (args.max_part_bytes, args.max_text_chars)
+
+    modes = list(args.modes)
+    if "legacy" in modes and not all(importlib.util.find_spec(m) for m in ("bs4", "lxml")):
+        print("skipping legacy mode: it needs `pip install beautifulsoup4 lxml`")
+        modes.remove("legacy")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = args.corpus
+        if folder is None:
+            folder = tmp
+            synthetic_corpus(folder, args.messages)
+        paths = sorted(os.path.join(folder, name) for name in os.listdir(folder) if name.endswith(".eml"))
+        size = sum(os.path.getsize(p) for p in paths)
+        fetched_path = os.path.join(tmp, "fetched.pickle")
+        fetched = app_fetches(paths, fetched_path, args.max_part_bytes) if "app" in modes else 0
+        print(f"{len(paths)} messages, {size / 1e6:.1f} MB; the app fetches {fetched / 1e6:.1f} MB of it")
+
+        results = []
+        print(f"{'mode':>10} {'MB parsed':>10} {'MB/s':>8} {'msgs/s':>8} {'peak RSS MB':>12} {'RSS growth MB':>14} {'text chars':>12}")
+        for mode in modes:
+            r = run(mode, paths, fetched_path, args.timeout, caps)
+            results.append(r)
+            print(f"{r['mode']:>10} {r['mb_parsed']:>10.1f} {r['mb_per_sec']:>8.1f} {r['msgs_per_sec']:>8.1f} {r['peak_rss_mb']:>12.1f} "
+                  f"{r['rss_growth_mb']:>14.1f} {r['text_chars']:>12,}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import argparse
+import random
+import statistics
+import time
+
+import triage
+from mail_agent import _summary_messages, _summary_text, _reply_prompt, _reply_text, _inbox_prompt
+from prompts import clean_text, estimate_tokens
+
+from benchmarks.bench_rules import SENDERS, SUBJECTS, WORDS
+
+# --- PROMPT BUDGET BENCHMARK ---
+# The original character cuts vs. the token-budget prompt builder, over
+# synthetic emails with reply chains, signatures, newsletter footers and
+# tracking links. Reports prompt tokens, how much of the new text of each
+# email reached the prompt and how many prompt tokens were noise. Prefill
+# time is estimated from --prefill-tps (CPU inference of a 3B model is in
+# the tens to low hundreds of tokens per second).
+
+
+def legacy_summary(body):
+    return f"Summarize this email in 2 sentences. Capture the main action item:\n\n{body[:4000]}"
+
+
+def legacy_reply(body, notes, name):
+    return _reply_prompt(body[:1000], notes, name)
+
+
+def legacy_classify(mail):
+    return (f"Classify this email into exactly one of these categories: {triage.CATEGORIES}.\nSender: {mail['sender']}\n"
+            f"Subject: {mail['subject']}\nBody: {mail['body'][:1000]}\nReply ONLY with the category name.")
+
+
+def legacy_classify_batch(batch):
+    emails = "".join(f"Email {n}:\nSender: {m['sender']}\nSubject: {m['subject']}\nBody: {m['body'][:1000]}\n\n"
+                     for n, m in enumerate(batch, start=1))
+    return (f"Classify each email into exactly one of these categories: {triage.CATEGORIES}.\n\n{emails}"
+            f'Reply ONLY with a JSON object mapping each email number to its category, e.g. {{"1": "Personal", "2": "Newsletter"}}.')
+
+
+def legacy_chat(emails, query):
+    blob = "".join(f"--- START EMAIL ---\nFrom: {m['sender']}\nSubject: {m['subject']}\nContent: {m['body'][:500]}...\n--- END EMAIL ---\n\n"
+                   for m in emails)
+    return f"Context:\n{blob}\n\nUser Question: {query}\n\nAnswer based on the emails."
+
+
+# Body lines that talk about footer things and must survive cleaning
+MENTIONS = [
+    "Please review the updated privacy policy and sign it by Friday.",
+    "How do I unsubscribe the interns from the vendor list?",
+    "Legal says the © notice on the slides should read all rights reserved.",
+]
+FOOTER = ("\n\nYou are receiving this email because you signed up at example.com.\nUnsubscribe | View this email in your browser | "
+          "Update your preferences\n© 2024 Example Inc. All rights reserved. 1 Main St, Springfield")
+
+
+def check_cleaning():
+    # Regression cases for clean_text: mentions stay, the trailing footer goes
+    for mention in MENTIONS:
+        for body in (f"Hi team,\n\n{mention}\n\nThanks,\nSam", f"Quick one.\n{mention}", mention + FOOTER):
+            cleaned = clean_text(body)
+            if mention not in cleaned or "receiving this" in cleaned:
+                raise AssertionError(f"clean_text({body!r}) gave {cleaned!r}")
+
+
+def synthetic_email(rng, n):
+    # Fresh sentences carry a marker (fresh<n>x<i>) so coverage can be counted
+    fresh = []
+    for i in range(rng.randint(2, 25)):
+        words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 18)))
+        if rng.random() < 0.15:
+            words += f" https://click.example.com/track/{rng.getrandbits(128):032x}?utm_source=email&utm_campaign=x{i}"
+        fresh.append(f"fresh{n}x{i} {words}.")
+    if rng.random() < 0.2:
+        fresh.append(f"fresh{n}x{len(fresh)} {rng.choice(MENTIONS)}")
+    body = " ".join(fresh[:3]) + "\n\n" + "\n\n".join(" ".join(fresh[i:i + 3]) for i in range(3, len(fresh), 3))
+    noise = ""
+    if rng.random() < 0.6:
+        noise += "\n\n--\nAlex Kim\nSenior Project Manager | Example Corp\n+1 555 0100\nSent from my iPhone"
+    for depth in range(rng.choice([0, 0, 1, 2, 4])):
+        quoted = "\n".join("> " * (depth + 1) + " ".join(rng.choice(WORDS) for _ in range(14)) for _ in range(rng.randint(5, 30)))
+        noise += f"\n\nOn Mon, Jan {depth + 1}, 2024 at 9:0{depth} AM {rng.choice(SENDERS)} wrote:\n{quoted}"
+    if rng.random() < 0.3:
+        noise += FOOTER
+    return {"sender": rng.choice(SENDERS), "subject": rng.choice(SUBJECTS), "body": body + noise, "fresh": fresh}
+
+
+def coverage(prompt, mail):
+    kept = sum(1 for sentence in mail["fresh"] if sentence.split()[0] in prompt)
+    return kept / len(mail["fresh"])
+
+
+def noise_share(prompt, frame, mails):
+    # Share of the email text in the prompt that is not the emails' own new
+    # text: quoted history, signatures, footers, tracking links
+    body = estimate_tokens(prompt) - estimate_tokens(frame)
+    fresh = sum(estimate_tokens(clean_text(s)) for m in mails for s in m["fresh"] if s.split()[0] in prompt)
+    return max(0.0, 1 - fresh / body) if body > 0 else 0.0
+
+
+def run(mails, query, build_old, build_new, group=1):
+    rows = {"old": [], "new": []}
+    for start in range(0, len(mails), group):
+        chunk = mails[start:start + group]
+        empty = [dict(m, body="") for m in chunk]
+        for label, build in (("old", build_old), ("new", build_new)):
+            began = time.perf_counter()
+            prompt = build(chunk, query)
+            elapsed = time.perf_counter() - began
+            rows[label].append((estimate_tokens(prompt), statistics.mean(coverage(prompt, m) for m in chunk),
+                                noise_share(prompt, build(empty, query), chunk), elapsed))
+    return {label: [statistics.mean(column) for column in zip(*values)] for label, values in rows.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark prompt construction")
+    parser.add_argument("--emails", type=int, default=300)
+    parser.add_argument("--prefill-tps", type=float, default=60.0, help="prompt tokens per second of the local model")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    check_cleaning()
+    rng = random.Random(args.seed)
+    mails = [synthetic_email(rng, n) for n in range(args.emails)]
+    query = "what do I need to review for the project meeting tomorrow?"
+    tasks = [
+        ("summary", lambda c, q: legacy_summary(c[0]["body"]), lambda c, q: _summary_messages(_summary_text(c[0]["body"]))[0]["content"], 1),
+        ("reply", lambda c, q: legacy_reply(c[0]["body"], "say yes", "Sam"),
+         lambda c, q: _reply_prompt(_reply_text(c[0]["body"], "say yes", "Sam"), "say yes", "Sam"), 1),
+        ("classify", lambda c, q: legacy_classify(c[0]),
+         lambda c, q: triage._classify_prompt(c[0]["sender"], c[0]["subject"], triage._prompt_body(c[0]["body"])), 1),
+        ("classify x5", lambda c, q: legacy_classify_batch(c), lambda c, q: triage._batch_prompt(c), 5),
+        ("chat, 10 emails", legacy_chat, lambda c, q: _inbox_prompt(c, q), 10),
+    ]
+    print(f"{'task':<16} {'tokens old':>10} {'new':>6} {'new text kept old':>18} {'new':>6} {'noise old':>10} {'new':>6} "
+          f"{'prefill s old':>14} {'new':>6} {'build ms':>9}")
+    results = {}
+    for name, old, new, group in tasks:
+        r = run(mails, query, old, new, group)
+        results[name] = r
+        (t_old, c_old, n_old, _), (t_new, c_new, n_new, b_new) = r["old"], r["new"]
+        print(f"{name:<16} {t_old:>10.0f} {t_new:>6.0f} {c_old:>18.0%} {c_new:>6.0%} {n_old:>10.0%} {n_new:>6.0%} "
+              f"{t_old / args.prefill_tps:>14.2f} {t_new / args.prefill_tps:>6.2f} {b_new * 1000:>9.2f}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import random
+import statistics
+import time
+
+import mail_cache
+from mail_cache import MailCache
+from vector_index import HASH_MODEL, VectorIndex
+
+from benchmarks.bench_rules import SENDERS, SUBJECTS, WORDS
+
+# --- INBOX RETRIEVAL BENCHMARK ---
+# Per-question cost of "Chat with your Inbox" as the cached mailbox grows:
+# stuffing every email into the prompt vs top-k retrieval from the index.
+# Also times the incremental update the background indexer runs when a
+# batch of new messages reaches the cache. Uses the hashed embedding
+# backend unless --embed-model is given.
+
+QUESTIONS = ["Did I get any interview updates?", "What is the invoice total?", "When is dinner on Sunday?",
+             "Any security alerts about new sign-ins?", "What did the team say about the project notes?"]
+
+
+def synthetic_cache(count, seed=0):
+    rng = random.Random(seed)
+    cache = MailCache(":memory:")
+    messages = [{
+        "uid": uid, "sender": rng.choice(SENDERS), "subject": rng.choice(SUBJECTS), "date": "Jan 01, 09:00 AM",
+        "body": " ".join(rng.choice(WORDS) for _ in range(rng.randint(50, 400))),
+    } for uid in range(1, count + 1)]
+    cache.put_messages("bench", "inbox", 1, messages)
+    cache.set_mailbox_state("bench", "inbox", 1, count)
+    return cache, messages
+
+
+def stuffed_prompt_chars(messages):
+    return sum(len(m["sender"]) + len(m["subject"]) + min(len(m["body"]), 500) + 60 for m in messages)
+
+
+def run(count, k, embed_model):
+    cache, messages = synthetic_cache(count)
+    mail_cache._cache = cache
+    index = VectorIndex(":memory:", model=embed_model or HASH_MODEL)
+    if not embed_model:
+        index._backend = HASH_MODEL
+
+    start = time.perf_counter()
+    index.sync("bench", "inbox", max_new=None)
+    build = time.perf_counter() - start
+
+    # What the background indexer does when a sync brings in new mail
+    arrivals = [dict(m, uid=count + m["uid"]) for m in messages[:50]]
+    cache.put_messages("bench", "inbox", 1, arrivals)
+    start = time.perf_counter()
+    index.sync("bench", "inbox", max_new=None)
+    update = time.perf_counter() - start
+
+    latencies, prompt_chars = [], []
+    for question in QUESTIONS * 4:
+        start = time.perf_counter()
+        hits = index.search("bench", "inbox", question, k)
+        latencies.append(time.perf_counter() - start)
+        prompt_chars.append(sum(len(h["text"]) + len(h["sender"] or "") + 60 for h in hits))
+    return {
+        "messages": count,
+        "index_build_s": build,
+        "update_50_ms": update * 1000,
+        "question_p50_ms": statistics.median(latencies) * 1000,
+        "retrieved_prompt_chars": statistics.mean(prompt_chars),
+        "stuffed_prompt_chars": stuffed_prompt_chars(messages),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark retrieval for Chat with your Inbox")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 1000, 10000])
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--embed-model", default=None, help="Ollama embedding model (default: hashed vectors)")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'messages':>9} {'build s':>8} {'+50 new ms':>11} {'question p50 ms':>16} {'retrieved chars':>16} {'stuffed chars':>14}")
+    for size in args.sizes:
+        r = run(size, args.k, args.embed_model)
+        results.append(r)
+        print(f"{r['messages']:>9} {r['index_build_s']:>8.2f} {r['update_50_ms']:>11.1f} {r['question_p50_ms']:>16.1f} "
+              f"{r['retrieved_prompt_chars']:>16,.0f} {r['stuffed_prompt_chars']:>14,}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import random
+import time
+
+from rules import get_rules
+
+# --- RULE MATCHING BENCHMARK ---
+# The original hard-coded rule_based_classify vs the compiled rule set,
+# over synthetic messages. Both must agree on every message.
+
+
+def legacy_rule_based_classify(sender, subject, body):
+    sender = sender.lower()
+    subject = subject.lower()
+    body = body.lower()[:500]
+
+    sec_keywords = ["security alert", "verification code", "2fa", "unauthorized access", "password reset"]
+    if any(k in sender or k in subject or k in body for k in sec_keywords):
+        return "Security Alert"
+
+    job_keywords = ["application", "interview", "offer", "reject", "candidate", "linkedin", "workday", "greenhouse", "lever", "recruiter", "admission", "grad school", "university", "phd", "master"]
+    if any(k in sender or k in subject for k in job_keywords):
+        return "Job Application"
+
+    news_keywords = ["newsletter", "digest", "weekly", "edition", "unsubscribe", "medium", "substack"]
+    if any(k in sender for k in news_keywords):
+        return "Newsletter"
+
+    promo_keywords = ["sale", "discount", "% off", "deal", "limited time"]
+    if any(k in subject for k in promo_keywords):
+        return "Promotion/Spam"
+
+    return None
+
+
+SENDERS = ["Mom <mom@example.com>", "LinkedIn <jobs-noreply@linkedin.com>", "Medium Daily Digest <noreply@medium.com>",
+           "Alex Kim <alex.kim@example.com>", "Bank <alerts@bank.example.com>", "Shop <hello@shop.example.com>"]
+SUBJECTS = ["Dinner on Sunday", "Your application was received", "Top stories this week", "Big SALE today",
+            "Security alert: new sign-in", "Photos from the trip", "Re: project notes"]
+WORDS = "hello meeting update please review thanks team project tomorrow lunch notes invoice the and for with".split()
+
+
+def synthetic_messages(count, seed=0):
+    rng = random.Random(seed)
+    return [(rng.choice(SENDERS), rng.choice(SUBJECTS), " ".join(rng.choice(WORDS) for _ in range(rng.randint(50, 400))))
+            for _ in range(count)]
+
+
+def measure(fn, messages):
+    start = time.perf_counter()
+    labels = [fn(*m) for m in messages]
+    return labels, len(messages) / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark rule-based classification throughput")
+    parser.add_argument("--messages", type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    messages = synthetic_messages(args.messages)
+    rules = get_rules()
+    legacy_labels, legacy_rate = measure(legacy_rule_based_classify, messages)
+    compiled_labels, compiled_rate = measure(rules.classify, messages)
+    if legacy_labels != compiled_labels:
+        raise SystemExit("compiled rule set disagrees with the legacy classifier")
+
+    print(f"{args.messages} messages")
+    print(f"    legacy: {legacy_rate:12,.0f} msg/s")
+    print(f"  compiled: {compiled_rate:12,.0f} msg/s  ({compiled_rate / legacy_rate:.2f}x)")
+    return {"legacy_msgs_per_sec": legacy_rate, "compiled_msgs_per_sec": compiled_rate}
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+
+import llm_cache
+import triage
+from triage import classify_email, triage_emails
+
+# --- TRIAGE BENCHMARK ---
+# Sequential classify_email vs the batched/concurrent engine, against a
+# stubbed model whose latency is a fixed per-request cost plus a cost per
+# email in the prompt (prefill). `--model-slots` mirrors OLLAMA_NUM_PARALLEL.
+
+PERSONAL = [
+    ("Mom <mom@example.com>", "Dinner on Sunday?"),
+    ("Alex Kim <alex.kim@example.com>", "Photos from the trip"),
+    ("Landlord <rent@example.org>", "Water shut-off on Tuesday"),
+]
+RULED = [
+    ("LinkedIn <jobs-noreply@linkedin.com>", "Your application was received"),
+    ("Google <no-reply@accounts.google.com>", "Security alert"),
+    ("Medium Daily Digest <noreply@medium.com>", "Top stories for you"),
+    ("Store <deals@shop.example.com>", "Limited time: 40% off"),
+]
+
+
+def synthetic_emails(count, unmatched_ratio=0.5, seed=0):
+    rng = random.Random(seed)
+    emails = []
+    for i in range(count):
+        sender, subject = rng.choice(PERSONAL if rng.random() < unmatched_ratio else RULED)
+        emails.append({"sender": sender, "subject": f"{subject} #{i}", "body": "Hi, just checking in about next week. " * 10})
+    return emails
+
+
+class StubModel:
+    def __init__(self, request_ms, per_email_ms, slots=1):
+        self.request_s = request_ms / 1000
+        self.per_email_s = per_email_ms / 1000
+        self.slots = threading.Semaphore(slots)
+        self.calls = 0
+
+    def chat(self, task, messages, **kwargs):
+        # Same signature as models.chat
+        self.calls += 1
+        prompt = messages[-1]['content']
+        numbers = re.findall(r'^Email (\d+):', prompt, re.MULTILINE)
+        with self.slots:
+            time.sleep(self.request_s + self.per_email_s * max(1, len(numbers)))
+        if kwargs.get('format') and numbers:
+            return {'message': {'content': json.dumps({n: "Personal" for n in numbers})}}
+        if kwargs.get('format'):
+            return {'message': {'content': json.dumps({"category": "Personal"})}}
+        return {'message': {'content': "Personal"}}
+
+
+def run_sequential(emails):
+    return [classify_email(m['sender'], m['subject'], m['body']) for m in emails]
+
+
+def run_engine(emails, batch_size, workers):
+    results = [None] * len(emails)
+    for i, category in triage_emails(emails, batch_size=batch_size, max_workers=workers):
+        results[i] = category
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark sequential vs batched Auto-Triage")
+    parser.add_argument("--emails", type=int, default=100)
+    parser.add_argument("--request-ms", type=float, default=300.0)
+    parser.add_argument("--per-email-ms", type=float, default=40.0)
+    parser.add_argument("--batch-size", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--model-slots", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    emails = synthetic_emails(args.emails)
+    stub = StubModel(args.request_ms, args.per_email_ms, args.model_slots)
+    real_chat = triage.chat
+    triage.chat = stub.chat
+    results = {}
+    try:
+        runs = (
+            ("sequential", lambda: run_sequential(emails), True),
+            ("batched", lambda: run_engine(emails, args.batch_size, args.workers), True),
+            ("warm cache", lambda: run_engine(emails, args.batch_size, args.workers), False),
+        )
+        for name, fn, cold in runs:
+            if cold:
+                llm_cache._cache = llm_cache.LLMCache(":memory:")
+            stub.calls = 0
+            start = time.perf_counter()
+            labels = fn()
+            elapsed = time.perf_counter() - start
+            results[name] = {"seconds": elapsed, "emails_per_sec": len(emails) / elapsed, "model_calls": stub.calls, "labelled": sum(1 for l in labels if l)}
+    finally:
+        triage.chat = real_chat
+        llm_cache._cache = None
+
+    print(f"{args.emails} emails, stub model {args.request_ms:.0f} ms/request + {args.per_email_ms:.0f} ms/email, {args.model_slots} slot(s)")
+    for name, r in results.items():
+        print(f"{name:>11}: {r['emails_per_sec']:7.1f} emails/s  {r['seconds']:6.2f} s  {r['model_calls']:3d} model calls")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+import email
+import io
+import queue
+import random
+import re
+import select
+import socketserver
+import threading
+import time
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import format_datetime, parsedate_to_datetime
+from datetime import datetime, timedelta, timezone
+
+# --- LOCAL IMAP STAND-IN ---
+# Just enough IMAP4rev1 for imaplib to log in, search and fetch from a
+# synthetic mailbox. `latency` is added once per command to model the
+# round-trip to a remote server.
+
+SENDERS = [
+    ("LinkedIn", "jobs-noreply@linkedin.com"),
+    ("Google", "no-reply@accounts.google.com"),
+    ("Medium Daily Digest", "noreply@medium.com"),
+    ("Alex Kim", "alex.kim@example.com"),
+    ("Store", "deals@shop.example.com"),
+    ("Workday", "recruiting@myworkday.com"),
+]
+SUBJECTS = [
+    "Your application was received",
+    "Security alert: new sign-in",
+    "Weekly digest: top stories",
+    "Lunch tomorrow?",
+    "Limited time: 40% off everything",
+    "Interview availability",
+]
+
+
+_IMAGES = {}
+
+
+def synthetic_image(variant):
+    # A scanned-looking PNG with a few lines of text, over the 5 KB below
+    # which the app does not bother with OCR. Eight variants, so some
+    # images repeat across messages like logos do.
+    if variant not in _IMAGES:
+        from PIL import Image, ImageDraw
+
+        rng = random.Random(variant)
+        image = Image.new("L", (640, 200), 255)
+        draw = ImageDraw.Draw(image)
+        for row in range(5):
+            words = " ".join(rng.choice(["invoice", "total", "due", "order", "receipt", "amount", "paid"]) for _ in range(6))
+            draw.text((20, 20 + row * 34), f"{words} {rng.randint(10, 9999)}", fill=0)
+        # Paper grain, so the PNG does not compress to nothing
+        image.putdata([p if p < 128 else 255 - rng.randint(0, 40) for p in image.getdata()])
+        out = io.BytesIO()
+        image.save(out, "PNG")
+        _IMAGES[variant] = out.getvalue()
+    return _IMAGES[variant]
+
+
+def synthetic_message(i, html_ratio=0.5, attachment_ratio=0.0, rng=random, image_ratio=0.0):
+    name, addr = SENDERS[i % len(SENDERS)]
+    subject = f"{SUBJECTS[i % len(SUBJECTS)]} #{i}"
+    text = " ".join(rng.choice(["hello", "meeting", "update", "please", "review", "thanks", "team", "project"]) for _ in range(120))
+
+    msg = MIMEMultipart("mixed")
+    alt = MIMEMultipart("alternative")
+    alt.attach(MIMEText(text, "plain"))
+    if rng.random() < html_ratio:
+        html = "<html><body>" + "".join(f"<p>{text[j:j + 80]}</p>" for j in range(0, len(text), 80)) + "</body></html>"
+        alt.attach(MIMEText(html, "html"))
+    msg.attach(alt)
+    if rng.random() < attachment_ratio:
+        blob = MIMEText("x" * 20000, "plain")
+        blob.add_header("Content-Disposition", "attachment", filename=f"report_{i}.txt")
+        msg.attach(blob)
+    if image_ratio and rng.random() < image_ratio:
+        scan = MIMEImage(synthetic_image(i % 8), "png")
+        scan.add_header("Content-Disposition", "inline", filename=f"scan_{i}.png")
+        msg.attach(scan)
+
+    msg["Subject"] = subject
+    msg["From"] = f"{name} <{addr}>"
+    msg["To"] = "me@example.com"
+    msg["Date"] = format_datetime(datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=17 * i))
+    return msg.as_bytes()
+
+
+def _quote(value):
+    if value is None:
+        return "NIL"
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _bodystructure(part):
+    if part.is_multipart():
+        children = "".join(_bodystructure(p) for p in part.get_payload())
+        return f"({children} {_quote(part.get_content_subtype())})"
+
+    params = part.get_params() or []
+    params = " ".join(f"{_quote(k)} {_quote(v)}" for k, v in params[1:])
+    payload = part.get_payload()
+    encoding = part.get("Content-Transfer-Encoding", "7bit")
+    fields = [
+        _quote(part.get_content_maintype()), _quote(part.get_content_subtype()),
+        f"({params})" if params else "NIL", "NIL", "NIL", _quote(encoding), str(len(payload.encode())),
+    ]
+    if part.get_content_maintype() == "text":
+        fields.append(str(payload.count("\n")))
+    disposition = part.get_content_disposition()
+    if disposition:
+        filename = part.get_filename()
+        disp_params = f"({_quote('filename')} {_quote(filename)})" if filename else "NIL"
+        fields += ["NIL", f"({_quote(disposition)} {disp_params})"]
+    return "(" + " ".join(fields) + ")"
+
+
+def _section(msg, raw, spec):
+    spec = spec.upper()
+    header, _, text = raw.partition(b"\r\n\r\n")
+    if spec == "":
+        return raw
+    if spec == "HEADER":
+        return header + b"\r\n\r\n"
+    if spec == "TEXT":
+        return text
+    if spec.startswith("HEADER.FIELDS"):
+        names = re.findall(r'[^\s()"]+', spec[len("HEADER.FIELDS"):])
+        lines = [f"{k}: {v}" for k, v in msg.items() if k.upper() in names]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+    part = msg
+    for index in spec.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(index) - 1]
+        elif index != "1":
+            return b""
+    payload = part.get_payload()
+    return payload.encode() if isinstance(payload, str) else b""
+
+
+class Mailbox:
+    def __init__(self, raw_messages=(), uidvalidity=1):
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.modseq = 1
+        self.messages = []
+        self.lock = threading.RLock()
+        self.watchers = []
+        for raw in raw_messages:
+            self.append(raw)
+
+    def notify(self, line):
+        # Untagged updates for every open connection
+        for watcher in list(self.watchers):
+            watcher.put(line)
+
+    def append(self, raw, flags=()):
+        with self.lock:
+            self.modseq += 1
+            self.messages.append({"uid": self.uidnext, "raw": raw, "flags": set(flags), "labels": set(), "modseq": self.modseq})
+            self.uidnext += 1
+            self.notify(f"* {len(self.messages)} EXISTS\r\n")
+            return self.messages[-1]["uid"]
+
+    def set_flags(self, uid, flags):
+        with self.lock:
+            for seq, msg in enumerate(self.messages, start=1):
+                if msg["uid"] == uid:
+                    self.modseq += 1
+                    msg["flags"] = set(flags)
+                    msg["modseq"] = self.modseq
+                    self.notify(f"* {seq} FETCH (UID {uid} FLAGS ({' '.join(sorted(msg['flags']))}))\r\n")
+
+    def expunge(self, uid):
+        with self.lock:
+            for seq, msg in enumerate(self.messages, start=1):
+                if msg["uid"] == uid:
+                    del self.messages[seq - 1]
+                    self.notify(f"* {seq} EXPUNGE\r\n")
+                    return
+
+
+def synthetic_mailbox(count, html_ratio=0.5, attachment_ratio=0.0, seed=0, image_ratio=0.0):
+    rng = random.Random(seed)
+    return Mailbox(synthetic_message(i, html_ratio, attachment_ratio, rng, image_ratio) for i in range(count))
+
+
+def _parse_set(spec, maximum):
+    result = []
+    for chunk in spec.split(","):
+        if ":" in chunk:
+            lo, hi = chunk.split(":")
+            lo = maximum if lo == "*" else int(lo)
+            hi = maximum if hi == "*" else int(hi)
+            lo, hi = min(lo, hi), max(lo, hi)
+            result.extend(range(lo, hi + 1))
+        else:
+            result.append(maximum if chunk == "*" else int(chunk))
+    return result
+
+
+def _fetch_items(spec):
+    spec = spec.strip()
+    if spec.startswith("(") and spec.endswith(")"):
+        spec = spec[1:-1]
+    return re.findall(r'[^\s\[]+(?:\[[^\]]*\])?(?:<[\d.]+>)?', spec)
+
+
+class IMAPStubHandler(socketserver.StreamRequestHandler):
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.wfile.write(data)
+
+    def handle(self):
+        mailbox = self.server.mailbox
+        self.selected = False
+        # Updates queue up per connection and are delivered on NOOP or IDLE
+        self.updates = queue.Queue()
+        with mailbox.lock:
+            mailbox.watchers.append(self.updates)
+        try:
+            self.serve(mailbox)
+        finally:
+            with mailbox.lock:
+                mailbox.watchers.remove(self.updates)
+
+    def flush_updates(self):
+        while not self.updates.empty():
+            self.send(self.updates.get())
+
+    def serve(self, mailbox):
+        self.send("* OK IMAP4rev1 stub ready\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.decode(errors="replace").rstrip("\r\n")
+            if not line:
+                continue
+            tag, _, rest = line.partition(" ")
+            cmd, _, args = rest.partition(" ")
+            cmd = cmd.upper()
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            handler = getattr(self, f"cmd_{cmd.lower()}", None)
+            if handler is None:
+                self.send(f"{tag} BAD unknown command\r\n")
+                continue
+            if handler(tag, args, mailbox) is False:
+                return
+
+    def cmd_capability(self, tag, args, mailbox):
+        self.send(f"* CAPABILITY {self.server.capabilities}\r\n{tag} OK CAPABILITY completed\r\n")
+
+    def cmd_login(self, tag, args, mailbox):
+        self.send(f"{tag} OK LOGIN completed\r\n")
+
+    def cmd_noop(self, tag, args, mailbox):
+        self.flush_updates()
+        self.send(f"{tag} OK NOOP completed\r\n")
+
+    def cmd_select(self, tag, args, mailbox):
+        if "(CONDSTORE)" in args.upper() and "CONDSTORE" not in self.server.capabilities:
+            self.send(f"{tag} BAD CONDSTORE not supported\r\n")
+            return
+        self.selected = True
+        with mailbox.lock:
+            modseq = ""
+            if "CONDSTORE" in self.server.capabilities:
+                modseq = f"* OK [HIGHESTMODSEQ {mailbox.modseq}] Highest\r\n"
+            self.send(
+                f"* {len(mailbox.messages)} EXISTS\r\n"
+                f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid\r\n"
+                f"* OK [UIDNEXT {mailbox.uidnext}] Predicted next UID\r\n"
+                f"{modseq}"
+                f"{tag} OK [READ-WRITE] SELECT completed\r\n"
+            )
+
+    cmd_examine = cmd_select
+
+    def cmd_close(self, tag, args, mailbox):
+        self.selected = False
+        self.send(f"{tag} OK CLOSE completed\r\n")
+
+    def cmd_logout(self, tag, args, mailbox):
+        self.send(f"* BYE logging out\r\n{tag} OK LOGOUT completed\r\n")
+        return False
+
+    def cmd_idle(self, tag, args, mailbox):
+        if "IDLE" not in self.server.capabilities:
+            self.send(f"{tag} BAD IDLE not supported\r\n")
+            return
+        self.send("+ idling\r\n")
+        while True:
+            self.flush_updates()
+            readable, _, _ = select.select([self.connection], [], [], 0.02)
+            if readable:
+                line = self.rfile.readline()
+                if not line:
+                    return False
+                if line.strip().upper() == b"DONE":
+                    break
+        self.flush_updates()
+        self.send(f"{tag} OK IDLE terminated\r\n")
+
+    def cmd_search(self, tag, args, mailbox, uid=False):
+        criteria = args.upper()
+        since = re.search(r"SINCE (\S+)", criteria)
+        before = re.search(r"BEFORE (\S+)", criteria)
+        since = since and datetime.strptime(since.group(1).title(), "%d-%b-%Y").date()
+        before = before and datetime.strptime(before.group(1).title(), "%d-%b-%Y").date()
+        with mailbox.lock:
+            hits = []
+            for seq, msg in enumerate(mailbox.messages, start=1):
+                if "UNSEEN" in criteria and "\\Seen" in msg["flags"]:
+                    continue
+                if since or before:
+                    day = parsedate_to_datetime(self.parsed(msg)["Date"]).date()
+                    if (since and day < since) or (before and day >= before):
+                        continue
+                hits.append(str(msg["uid"] if uid else seq))
+        self.send(f"* SEARCH {' '.join(hits)}\r\n{tag} OK SEARCH completed\r\n")
+
+    def cmd_fetch(self, tag, args, mailbox, uid=False):
+        spec, _, items = args.partition(" ")
+        changed_since = None
+        modifier = re.search(r'\s*\(CHANGEDSINCE (\d+)\)\s*$', items, re.IGNORECASE)
+        if modifier:
+            changed_since = int(modifier.group(1))
+            items = items[:modifier.start()]
+        items = _fetch_items(items)
+        with mailbox.lock:
+            selected = self._selected_uids(spec, mailbox, uid)
+            if changed_since is not None:
+                selected = [(seq, msg) for seq, msg in selected if msg["modseq"] > changed_since]
+
+        out = bytearray()
+        for seq, msg in selected:
+            out += self.render_fetch(seq, msg, items, uid)
+        out += f"{tag} OK FETCH completed\r\n".encode()
+        self.send(bytes(out))
+
+    def render_fetch(self, seq, msg, items, uid):
+        fields = []
+        if uid and not any(i.upper() == "UID" for i in items):
+            items = ["UID"] + items
+        for item in items:
+            name = item.upper()
+            if name == "UID":
+                fields.append(f"UID {msg['uid']}".encode())
+            elif name == "MODSEQ":
+                fields.append(f"MODSEQ ({msg['modseq']})".encode())
+            elif name == "FLAGS":
+                fields.append(f"FLAGS ({' '.join(sorted(msg['flags']))})".encode())
+            elif name == "X-GM-LABELS":
+                fields.append(f"X-GM-LABELS ({' '.join(_quote(l) for l in sorted(msg['labels']))})".encode())
+            elif name == "RFC822.SIZE":
+                fields.append(f"RFC822.SIZE {len(msg['raw'])}".encode())
+            elif name == "RFC822":
+                fields.append(f"RFC822 {{{len(msg['raw'])}}}\r\n".encode() + msg["raw"])
+            elif name == "BODYSTRUCTURE":
+                fields.append(f"BODYSTRUCTURE {_bodystructure(self.parsed(msg))}".encode())
+            elif name.startswith(("BODY[", "BODY.PEEK[")):
+                spec = item[item.index("[") + 1:item.rindex("]")]
+                data = _section(self.parsed(msg), msg["raw"], spec)
+                partial = re.search(r"<(\d+)\.(\d+)>$", item)
+                origin = ""
+                if partial:
+                    start, length = int(partial.group(1)), int(partial.group(2))
+                    data = data[start:start + length]
+                    origin = f"<{start}>"
+                fields.append(f"BODY[{spec}]{origin} {{{len(data)}}}\r\n".encode() + data)
+        return f"* {seq} FETCH (".encode() + b" ".join(fields) + b")\r\n"
+
+    def _selected_uids(self, spec, mailbox, uid):
+        messages = list(enumerate(mailbox.messages, start=1))
+        if uid:
+            wanted = set(_parse_set(spec, messages[-1][1]["uid"] if messages else 0))
+            return [(seq, msg) for seq, msg in messages if msg["uid"] in wanted]
+        wanted = set(_parse_set(spec, len(messages)))
+        return [(seq, msg) for seq, msg in messages if seq in wanted]
+
+    def cmd_store(self, tag, args, mailbox, uid=False):
+        spec, _, rest = args.partition(" ")
+        item, _, values = rest.partition(" ")
+        item = item.upper()
+        values = set(re.findall(r'"([^"]*)"|([^\s()"]+)', values))
+        values = {a or b for a, b in values}
+        out = []
+        with mailbox.lock:
+            for seq, msg in self._selected_uids(spec, mailbox, uid):
+                if item.startswith("+X-GM-LABELS"):
+                    msg["labels"] |= values
+                    continue
+                flags = msg["flags"] | values if item.startswith("+") else msg["flags"] - values if item.startswith("-") else values
+                mailbox.set_flags(msg["uid"], flags)
+                if not item.endswith(".SILENT"):
+                    out.append(f"* {seq} FETCH (UID {msg['uid']} FLAGS ({' '.join(sorted(flags))}))\r\n")
+        self.send("".join(out) + f"{tag} OK STORE completed\r\n")
+
+    def _copy_to(self, spec, folder, mailbox, uid):
+        folder = folder.strip().strip('"')
+        if folder not in self.server.folders:
+            return None
+        target = self.server.folders[folder]
+        with mailbox.lock:
+            selected = self._selected_uids(spec, mailbox, uid)
+        for _, msg in selected:
+            target.append(msg["raw"], msg["flags"] - {"\\Deleted"})
+        return selected
+
+    def cmd_copy(self, tag, args, mailbox, uid=False):
+        spec, _, folder = args.partition(" ")
+        if self._copy_to(spec, folder, mailbox, uid) is None:
+            self.send(f"{tag} NO [TRYCREATE] no such mailbox\r\n")
+            return
+        self.send(f"{tag} OK COPY completed\r\n")
+
+    def cmd_move(self, tag, args, mailbox, uid=False):
+        spec, _, folder = args.partition(" ")
+        selected = self._copy_to(spec, folder, mailbox, uid)
+        if selected is None:
+            self.send(f"{tag} NO [TRYCREATE] no such mailbox\r\n")
+            return
+        for _, msg in selected:
+            mailbox.expunge(msg["uid"])
+        self.flush_updates()
+        self.send(f"{tag} OK MOVE completed\r\n")
+
+    def cmd_expunge(self, tag, args, mailbox, uid=False):
+        with mailbox.lock:
+            selected = self._selected_uids(args, mailbox, True) if uid else list(enumerate(mailbox.messages, start=1))
+            for _, msg in selected:
+                if "\\Deleted" in msg["flags"]:
+                    mailbox.expunge(msg["uid"])
+        self.flush_updates()
+        self.send(f"{tag} OK EXPUNGE completed\r\n")
+
+    def cmd_list(self, tag, args, mailbox):
+        lines = ['* LIST (\\Noselect) "/" ""\r\n'] if args.strip() == '"" ""' else [
+            f'* LIST () "/" "{name}"\r\n' for name in ["INBOX", *self.server.folders]
+        ]
+        self.send("".join(lines) + f"{tag} OK LIST completed\r\n")
+
+    def cmd_create(self, tag, args, mailbox):
+        name = args.strip().strip('"')
+        if name in self.server.folders or name.upper() == "INBOX":
+            self.send(f"{tag} NO [ALREADYEXISTS] mailbox exists\r\n")
+            return
+        self.server.folders[name] = Mailbox()
+        self.send(f"{tag} OK CREATE completed\r\n")
+
+    def parsed(self, msg):
+        if "parsed" not in msg:
+            msg["parsed"] = email.message_from_bytes(msg["raw"])
+        return msg["parsed"]
+
+    def cmd_uid(self, tag, args, mailbox):
+        sub, _, rest = args.partition(" ")
+        handler = getattr(self, f"cmd_{sub.lower()}", None)
+        if handler is None:
+            self.send(f"{tag} BAD unknown UID command\r\n")
+            return
+        return handler(tag, rest, mailbox, uid=True)
+
+
+class IMAPStubServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, mailbox, latency=0.0, host="127.0.0.1", port=0):
+        self.mailbox = mailbox
+        self.latency = latency
+        # Add " X-GM-EXT-1" to act like Gmail (labels instead of folders)
+        self.capabilities = "IMAP4rev1 UIDPLUS CONDSTORE IDLE MOVE"
+        self.folders = {}
+        super().__init__((host, port), IMAPStubHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+def start_stub(mailbox, latency=0.0):
+    server = IMAPStubServer(mailbox, latency=latency)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from prompts import estimate_tokens
+
+# --- LOCAL OLLAMA STAND-IN ---
+# Enough of Ollama's HTTP API (/api/chat, /api/generate, /api/embed,
+# /api/tags) for the ollama client. Each model has a load time, prompt
+# (prefill) and generation speed; models stay loaded for their keep_alive
+# and one request per model runs at a time, as with OLLAMA_NUM_PARALLEL=1.
+# Timings are real sleeps multiplied by `scale`, and the time actually
+# slept is reported back in the response fields (load_duration,
+# prompt_eval_duration, ...) like Ollama does.
+# `latency` adds fixed real seconds to every request (HTTP, queueing).
+# point_ollama_at() sends the ollama module's calls to it.
+
+# name: (load seconds, prompt tokens/s, generated tokens/s), roughly a laptop CPU
+PROFILES = {
+    "llama3.2": (4.0, 60.0, 12.0),
+    "llama3.2:1b": (1.5, 180.0, 35.0),
+    "nomic-embed-text": (0.5, 2000.0, 0.0),
+}
+FREE_TEXT_TOKENS = 150
+WORDS = "the meeting is moved to thursday please review the attached notes and reply with any questions".split()
+
+
+def _keep_alive_seconds(value):
+    # Ollama's forms: seconds, "30m", "1h", "0", negative for forever
+    if value is None:
+        return 300.0
+    if isinstance(value, (int, float)):
+        return float("inf") if value < 0 else float(value)
+    match = re.fullmatch(r"(-?\d+(?:\.\d+)?)(ms|s|m|h)?", str(value).strip())
+    if not match:
+        return 300.0
+    number = float(match.group(1))
+    if number < 0:
+        return float("inf")
+    return number * {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}[match.group(2)]
+
+
+def _answer(prompt, schema, limit, length=FREE_TEXT_TOKENS):
+    # Deterministic per prompt: valid JSON for a schema, otherwise filler text
+    seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+    if isinstance(schema, dict):
+        values = {}
+        for n, (name, spec) in enumerate(schema.get("properties", {}).items()):
+            options = spec.get("enum") or ["ok"]
+            values[name] = options[(seed >> n) % len(options)]
+        return json.dumps(values)
+    if schema == "json":
+        return json.dumps({"1": "Personal"})
+    words = []
+    while estimate_tokens(" ".join(words)) < min(limit, length):
+        words.append(WORDS[(seed + len(words)) % len(WORDS)])
+    return " ".join(words).capitalize() + "."
+
+
+class OllamaStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": m, "model": m, "size": 1, "digest": "0" * 64,
+                                         "modified_at": "2024-01-01T00:00:00Z"} for m in self.server.profiles]})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        model = request.get("model", "")
+        if model not in self.server.profiles:
+            self._send_json({"error": f"model '{model}' not found"}, 404)
+            return
+        self.server.requests.append((self.path, model, request))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.path == "/api/embed":
+            self._embed(model, request)
+        elif self.path in ("/api/chat", "/api/generate"):
+            self._complete(model, request)
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def _embed(self, model, request):
+        texts = request.get("input") or []
+        texts = [texts] if isinstance(texts, str) else texts
+        with self.server.slot(model):
+            load = self.server.load(model, request.get("keep_alive"))
+            tokens = sum(estimate_tokens(t) for t in texts)
+            self.server.sleep(tokens / self.server.profiles[model][1])
+        vectors = [[((int(hashlib.md5(f"{t}{i}".encode()).hexdigest(), 16) % 200) - 100) / 100 for i in range(64)] for t in texts]
+        self._send_json({"model": model, "embeddings": vectors, "load_duration": int(load * 1e9 * self.server.scale),
+                         "prompt_eval_count": tokens})
+
+    def _complete(self, model, request):
+        chat = self.path == "/api/chat"
+        prompt = "\n".join(m.get("content") or "" for m in request.get("messages") or []) if chat else request.get("prompt") or ""
+        options = request.get("options") or {}
+        limit = options.get("num_predict") or 10 ** 6
+        stream = request.get("stream", True)
+        _, prefill_tps, decode_tps = self.server.profiles[model]
+
+        with self.server.slot(model):
+            load = self.server.load(model, request.get("keep_alive"))
+            prompt_tokens = estimate_tokens(prompt)
+            if not prompt and not chat:
+                # An empty generate only loads the model
+                self._send_json(self._final(model, chat, "", load, 0, 0.0, 0, 0.0))
+                return
+            prefill = self.server.sleep(prompt_tokens / prefill_tps)
+            answer = _answer(prompt, request.get("format"), limit, self.server.free_text_tokens)
+            pieces = re.findall(r"\S+\s*", answer)
+            if stream:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+            decode = 0.0
+            eval_count = 0
+            for piece in pieces:
+                tokens = estimate_tokens(piece)
+                if eval_count + tokens > limit:
+                    break
+                eval_count += tokens
+                decode += self.server.sleep(tokens / decode_tps)
+                if stream:
+                    self._chunk(self._partial(model, chat, piece))
+            final = self._final(model, chat, "" if stream else answer, load, prompt_tokens, prefill, eval_count, decode)
+            if stream:
+                self._chunk(final)
+                self.wfile.write(b"0\r\n\r\n")
+            else:
+                self._send_json(final)
+
+    def _chunk(self, payload):
+        data = json.dumps(payload).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    @staticmethod
+    def _partial(model, chat, text):
+        created = datetime.now(timezone.utc).isoformat()
+        if chat:
+            return {"model": model, "created_at": created, "message": {"role": "assistant", "content": text}, "done": False}
+        return {"model": model, "created_at": created, "response": text, "done": False}
+
+    def _final(self, model, chat, text, load, prompt_tokens, prefill, eval_count, decode):
+        payload = self._partial(model, chat, text)
+        ns = 1e9 * self.server.scale
+        payload.update(done=True, done_reason="stop", total_duration=int((load + prefill + decode) * ns),
+                       load_duration=int(load * ns), prompt_eval_count=prompt_tokens,
+                       prompt_eval_duration=int(prefill * ns), eval_count=eval_count, eval_duration=int(decode * ns))
+        return payload
+
+
+class OllamaStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, profiles=None, scale=1.0, host="127.0.0.1", port=0, latency=0.0):
+        self.profiles = dict(PROFILES if profiles is None else profiles)
+        self.scale = scale
+        self.latency = latency
+        self.free_text_tokens = FREE_TEXT_TOKENS
+        self.requests = []
+        self.loads = []
+        self._expires = {}
+        self._slots = {m: threading.Lock() for m in self.profiles}
+        self._lock = threading.Lock()
+        super().__init__((host, port), OllamaStubHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def slot(self, model):
+        return self._slots[model]
+
+    def sleep(self, seconds):
+        # Returns the simulated duration; sleeps for scale times that
+        time.sleep(seconds * self.scale)
+        return seconds
+
+    def load(self, model, keep_alive):
+        # Seconds spent loading (0 when already resident); renews the keep-alive
+        with self._lock:
+            resident = self._expires.get(model, 0) > time.monotonic()
+        load = 0.0 if resident else self.sleep(self.profiles[model][0])
+        if load:
+            self.loads.append(model)
+        with self._lock:
+            self._expires[model] = time.monotonic() + _keep_alive_seconds(keep_alive) * self.scale
+        return load
+
+    def idle(self, seconds):
+        # As if nothing had been asked for `seconds`: models past their keep_alive unload
+        with self._lock:
+            for model in self._expires:
+                self._expires[model] -= seconds * self.scale
+
+    def unload_all(self):
+        with self._lock:
+            self._expires.clear()
+
+
+def start_ollama_stub(profiles=None, scale=1.0, latency=0.0):
+    server = OllamaStubServer(profiles, scale, latency=latency)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def point_ollama_at(url):
+    # The module-level ollama.chat/generate/... are bound to a client made at
+    # import time from OLLAMA_HOST; rebind them to one for `url`
+    import ollama
+
+    os.environ["OLLAMA_HOST"] = url
+    client = ollama.Client(host=url)
+    for name in ("chat", "generate", "embed", "embeddings", "list", "ps", "show"):
+        setattr(ollama, name, getattr(client, name))
+    return client
@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+
+# --- PODCAST BRIEFING ---
+# The briefing is one spoken segment per email between a greeting and a
+# sign-off. Emails are summarised concurrently and each worker voices its
+# own segment as soon as its summary is back, so the greeting can play
+# while the rest is still being written. Segments come out in briefing
+# order; the TTS cache makes replaying or re-ordering them free.
+
+# Order used for "By priority"; anything else goes last, newest first
+PRIORITY = ['Security Alert', 'Personal', 'Job Application', 'Newsletter', 'Promotion/Spam']
+
+
+def by_priority(emails):
+    rank = {category: n for n, category in enumerate(PRIORITY)}
+    return sorted(emails, key=lambda mail: rank.get(mail.get('category'), len(PRIORITY)))
+
+
+def greeting(user_name):
+    return f"Good morning, {user_name}. Here is your daily briefing. "
+
+
+def email_segment(mail, summary):
+    sender_clean = mail['sender'].split('<')[0].strip().replace('"', '')
+    return f"From {sender_clean}: {mail['subject']}. {summary}. Next email. "
+
+
+SIGN_OFF = "That concludes your briefing."
+
+
+def briefing_segments(user_name, emails, summaries):
+    return [greeting(user_name)] + [email_segment(m, s) for m, s in zip(emails, summaries)] + [SIGN_OFF]
+
+
+def stream_briefing(user_name, emails, summarize, speak, max_workers=3):
+    # Yields (summary, text, clip) per segment in order; summary is None
+    # for the greeting and sign-off, clip is speak()'s (audio, mime) or None
+    def voice(text, summary=None):
+        return summary, text, speak(text)
+
+    def email_task(mail):
+        summary = summarize(mail['body'])
+        return voice(email_segment(mail, summary), summary)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="briefing") as pool:
+        # Submission order is start order: the greeting is voiced first
+        futures = [pool.submit(voice, greeting(user_name))]
+        futures += [pool.submit(email_task, mail) for mail in emails]
+        futures.append(pool.submit(voice, SIGN_OFF))
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            # The listener went away (or a segment failed): drop what has not started
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,339 @@
+import imaplib
+import os
+import sqlite3
+import threading
+import time
+
+from imap_fetch import message_set, select_mailbox
+from mail_cache import DATA_DIR
+from triage import triage_emails
+
+# --- BULK TRIAGE ---
+# Classifies a whole mailbox (or a date range of it) in chunks and writes
+# the categories back to the server. Gmail gets one UID STORE +X-GM-LABELS
+# per category and chunk; other servers one UID MOVE into a
+# "Triage/<category>" folder; "local" mode only records the categories
+# in the message cache. Every classified and applied UID is
+# checkpointed in SQLite, so an interrupted run picks up where it stopped.
+
+BULK_PATH = os.path.join(DATA_DIR, "bulk_triage.db")
+LABEL_PREFIX = "Triage"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job TEXT PRIMARY KEY,
+    uidvalidity INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS results (
+    job TEXT NOT NULL,
+    uid INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    applied INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (job, uid)
+);
+"""
+
+_DROPPED = (imaplib.IMAP4.abort, OSError)
+
+
+def search_criteria(base="ALL", since=None, before=None):
+    # since / before are dates; BEFORE is exclusive in IMAP
+    parts = [base] if base != "ALL" or not (since or before) else []
+    if since:
+        parts.append(f"SINCE {since.strftime('%d-%b-%Y')}")
+    if before:
+        parts.append(f"BEFORE {before.strftime('%d-%b-%Y')}")
+    return " ".join(parts)
+
+
+def label_name(category, delimiter="/"):
+    # "/" nests labels on Gmail, so it cannot stay inside a category name
+    return f"{LABEL_PREFIX}{delimiter}{category.replace('/', '-')}"
+
+
+class TriageCheckpoint:
+    def __init__(self, path=BULK_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def start(self, job, uidvalidity, mode):
+        # {uid: (category, applied)} from earlier runs of the same job; a new
+        # UIDVALIDITY or apply mode starts over
+        with self._lock, self._db:
+            row = self._db.execute("SELECT uidvalidity, mode FROM jobs WHERE job=?", (job,)).fetchone()
+            if row != (uidvalidity, mode):
+                self._db.execute("DELETE FROM results WHERE job=?", (job,))
+                self._db.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, NULL)", (job, uidvalidity, mode, time.time()))
+            else:
+                self._db.execute("UPDATE jobs SET finished=NULL WHERE job=?", (job,))
+            rows = self._db.execute("SELECT uid, category, applied FROM results WHERE job=?", (job,)).fetchall()
+        return {uid: (category, bool(applied)) for uid, category, applied in rows}
+
+    def record(self, job, categories):
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, 0)",
+                [(job, uid, category) for uid, category in categories.items()],
+            )
+
+    def mark_applied(self, job, uids):
+        with self._lock, self._db:
+            self._db.executemany("UPDATE results SET applied=1 WHERE job=? AND uid=?", [(job, uid) for uid in uids])
+
+    def finish(self, job):
+        with self._lock, self._db:
+            self._db.execute("UPDATE jobs SET finished=? WHERE job=?", (time.time(), job))
+
+    def status(self, job):
+        with self._lock:
+            row = self._db.execute("SELECT started, finished FROM jobs WHERE job=?", (job,)).fetchone()
+            counts = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(applied), 0) FROM results WHERE job=?", (job,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"started": row[0], "finished": row[1], "classified": counts[0], "applied": counts[1]}
+
+    def forget(self, job):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM results WHERE job=?", (job,))
+            self._db.execute("DELETE FROM jobs WHERE job=?", (job,))
+
+
+# --- applying results on the server ---
+
+def _ok(response, what):
+    typ, data = response
+    if typ != "OK":
+        raise imaplib.IMAP4.error(f"{what} failed: {data}")
+    return data
+
+
+def server_capabilities(mail):
+    # Refreshed after LOGIN; servers such as Gmail only list MOVE then
+    data = _ok(mail.capability(), "CAPABILITY")
+    return set(data[0].decode(errors="replace").upper().split()) if data and data[0] else set(mail.capabilities)
+
+
+def hierarchy_delimiter(mail):
+    try:
+        data = _ok(mail.list('""', '""'), "LIST")
+        parts = data[0].decode().split('"')
+        return parts[1] if len(parts) > 2 and parts[1] else "/"
+    except Exception:
+        return "/"
+
+
+def apply_labels(mail, uids, label):
+    _ok(mail.uid("STORE", message_set(uids), "+X-GM-LABELS", f'("{label}")'), "STORE")
+
+
+def move_messages(mail, uids, folder, capabilities):
+    # True when the messages left the mailbox. Without MOVE or UIDPLUS they
+    # are only copied and flagged \Deleted: a plain EXPUNGE would also purge
+    # whatever else the user had flagged, so that is left to their client.
+    uid_set = message_set(uids)
+    if "MOVE" in capabilities:
+        _ok(mail.uid("MOVE", uid_set, f'"{folder}"'), "MOVE")
+        return True
+    _ok(mail.uid("COPY", uid_set, f'"{folder}"'), "COPY")
+    _ok(mail.uid("STORE", uid_set, "+FLAGS.SILENT", "(\\Deleted)"), "STORE")
+    if "UIDPLUS" in capabilities:
+        _ok(mail.uid("EXPUNGE", uid_set), "EXPUNGE")
+        return True
+    return False
+
+
+class BulkTriage:
+    def __init__(self, connect, account, load, mailbox="inbox", criteria="ALL", mode=None, cache=None,
+                 checkpoint=None, chunk_size=200, batch_size=500, max_retries=5):
+        # connect() -> logged-in connection; load(mail, uids, uidvalidity, mailbox) -> [message dicts with a body].
+        # mode: "label" (Gmail), "move", "local" (cache only), or None to pick from the server's capabilities
+        self.connect = connect
+        self.account = account
+        self.load = load
+        self.mailbox = mailbox
+        self.criteria = criteria
+        self.mode = mode
+        self.cache = cache
+        self.checkpoint = checkpoint or get_checkpoint()
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.job = f"{account}|{mailbox}|{criteria}|{mode or 'server'}"
+        self.state = "starting"
+        self.last_error = None
+        # flagged: copied into their folder but still in the mailbox, flagged \Deleted
+        self.stats = {"total": 0, "classified": 0, "applied": 0, "flagged": 0, "commands": 0, "resumed": 0, "reconnects": 0}
+        self._folders = set()
+        self._delimiter = "/"
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bulk-triage", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        for attempt in range(self.max_retries + 1):
+            mail = None
+            try:
+                mail = self.connect()
+                self.state = "running"
+                self._work(mail)
+                return
+            except _DROPPED as e:
+                # Dropped connection: resume from the checkpoint on a new one
+                self.last_error = str(e)
+                self.stats["reconnects"] += 1
+                if attempt == self.max_retries or self._stop.wait(min(2 ** attempt, 30)):
+                    break
+            except Exception as e:
+                self.last_error = str(e)
+                break
+            finally:
+                if mail is not None:
+                    try:
+                        mail.logout()
+                    except Exception:
+                        pass
+        self.state = "stopped" if self._stop.is_set() else "error"
+
+    def _work(self, mail):
+        capabilities = server_capabilities(mail)
+        mode = self.mode or ("label" if "X-GM-EXT-1" in capabilities else "move")
+        uidvalidity = select_mailbox(mail, self.mailbox)["uidvalidity"]
+        done = self.checkpoint.start(self.job, uidvalidity, mode)
+        self.mode = mode
+        if mode == "move":
+            self._delimiter = hierarchy_delimiter(mail)
+
+        data = _ok(mail.uid("SEARCH", None, self.criteria), "SEARCH")
+        uids = sorted((int(u) for u in data[0].split()), reverse=True) if data and data[0] else []
+        todo = [uid for uid in uids if uid not in done]
+        self.stats["total"] = len(todo) + len(done)
+        self.stats["classified"] = self.stats["resumed"] = len(done)
+        self.stats["applied"] = sum(1 for _, applied in done.values() if applied)
+
+        # Classified before an interruption but never written back
+        leftover = {uid: category for uid, (category, applied) in done.items() if not applied}
+        if leftover:
+            self._apply(mail, mode, capabilities, uidvalidity, leftover)
+
+        # Newest first, one chunk at a time
+        unlabelled = 0
+        for start in range(0, len(todo), self.chunk_size):
+            if self._stop.is_set():
+                self.state = "stopped"
+                return
+            chunk = todo[start:start + self.chunk_size]
+            messages = self.load(mail, chunk, uidvalidity, self.mailbox)
+            categories = {}
+            for i, category in triage_emails(messages):
+                if category is None:
+                    # The model was unreachable: neither recorded nor applied, so a later run retries it
+                    unlabelled += 1
+                    continue
+                categories[int(messages[i]["uid"])] = category
+            self.checkpoint.record(self.job, categories)
+            self.stats["classified"] += len(categories)
+            self._apply(mail, mode, capabilities, uidvalidity, categories)
+
+        if unlabelled:
+            self.last_error = f"the model could not classify {unlabelled} emails"
+            self.state = "error"
+            return
+        self.checkpoint.finish(self.job)
+        self.last_error = None
+        self.state = "done"
+
+    def _apply(self, mail, mode, capabilities, uidvalidity, categories):
+        # One command per category and batch instead of one per message
+        by_category = {}
+        for uid, category in categories.items():
+            by_category.setdefault(category, []).append(uid)
+        for category, uids in sorted(by_category.items()):
+            uids.sort()
+            target = label_name(category, self._delimiter)
+            if mode == "move" and target not in self._folders:
+                # Fails harmlessly when the folder already exists
+                mail.create(f'"{target}"')
+                self._folders.add(target)
+            for start in range(0, len(uids), self.batch_size):
+                batch = uids[start:start + self.batch_size]
+                moved = False
+                if mode == "label":
+                    apply_labels(mail, batch, target)
+                elif mode == "move":
+                    moved = move_messages(mail, batch, target, capabilities)
+                    if not moved:
+                        self.stats["flagged"] += len(batch)
+                if mode != "local":
+                    self.stats["commands"] += 1
+                self.checkpoint.mark_applied(self.job, batch)
+                self.stats["applied"] += len(batch)
+                self._update_cache(moved, uidvalidity, {uid: category for uid in batch})
+        # Moves leave EXPUNGE / FETCH responses behind; nobody reads them
+        mail.untagged_responses.clear()
+
+    def _update_cache(self, moved, uidvalidity, categories):
+        # Messages still on the server (labelled, or only flagged \Deleted) stay cached
+        if self.cache is None:
+            return
+        if moved:
+            self.cache.remove_messages(self.account, self.mailbox, uidvalidity, list(categories))
+        else:
+            self.cache.update_messages(self.account, self.mailbox, uidvalidity,
+                                       {uid: {"category": category} for uid, category in categories.items()})
+
+    def progress(self):
+        total = self.stats["total"]
+        return self.stats["applied"] / total if total else (1.0 if self.state == "done" else 0.0)
+
+    def alive(self):
+        return self._thread.is_alive()
+
+    def stop(self):
+        self._stop.set()
+
+
+_checkpoint = None
+_checkpoint_lock = threading.Lock()
+
+
+def get_checkpoint():
+    global _checkpoint
+    with _checkpoint_lock:
+        if _checkpoint is None:
+            _checkpoint = TriageCheckpoint()
+        return _checkpoint
+
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def start_bulk_triage(account, factory):
+    # One job per account; a finished or failed job is replaced
+    with _jobs_lock:
+        job = _jobs.get(account)
+        if job is None or not job.alive():
+            job = factory()
+            _jobs[account] = job
+        return job
+
+
+def get_bulk_triage(account):
+    with _jobs_lock:
+        return _jobs.get(account)
+
+
+def stop_bulk_triage(account):
+    with _jobs_lock:
+        job = _jobs.get(account)
+    if job is not None:
+        job.stop()
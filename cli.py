@@ -0,0 +1,236 @@
+import argparse
+import getpass
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+from bulk_triage import BulkTriage, search_criteria
+from imap_idle import InboxWatcher
+from mail_agent import (
+    mail_pool, sync_mailbox, recent_emails, summarize_with_ollama, speak, join_briefing,
+    fetch_headers, triage_arrivals, bulk_load,
+)
+from mail_cache import get_cache
+from models import start_warm_up, usage
+from briefing import stream_briefing
+from tracing import enable as enable_tracing, TRACE_PATH, stage_stats, counters as trace_counters
+
+# --- COMMAND LINE ---
+# The app's work without the Streamlit UI, for cron jobs and workers:
+#
+#   python cli.py sync --bodies
+#   python cli.py triage --since 2024-01-01 --apply server
+#   python cli.py digest --count 5 --audio briefing.mp3
+#   python cli.py daemon --window 01:00-06:00
+#   python cli.py --trace run.jsonl sync      per-stage timings as JSON lines
+#
+# Results land in the same caches the UI reads, so a nightly daemon run
+# means the inbox opens with categories and summaries already there.
+# Credentials come from EMAIL_AGENT_USER / EMAIL_AGENT_PASSWORD.
+
+
+def log(message):
+    print(f"{datetime.now():%H:%M:%S} {message}", file=sys.stderr, flush=True)
+
+
+def credentials(args):
+    user = args.user or os.environ.get("EMAIL_AGENT_USER")
+    password = os.environ.get("EMAIL_AGENT_PASSWORD")
+    if not user:
+        sys.exit("Set EMAIL_AGENT_USER or pass --user")
+    if not password:
+        if not sys.stdin.isatty():
+            sys.exit("Set EMAIL_AGENT_PASSWORD")
+        password = getpass.getpass(f"App password for {user}: ")
+    return user, password
+
+
+def _date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def _window(value):
+    start, end = value.split("-")
+    return datetime.strptime(start, "%H:%M").time(), datetime.strptime(end, "%H:%M").time()
+
+
+def in_window(window, now=None):
+    if window is None:
+        return True
+    now = (now or datetime.now()).time()
+    start, end = window
+    # Windows may wrap past midnight, e.g. 22:00-06:00
+    return start <= now < end if start <= end else now >= start or now < end
+
+
+# --- commands ---
+
+def run_triage(user, password, criteria, mode, stop=None, quiet=False):
+    job = BulkTriage(
+        lambda: mail_pool(user, password).dedicated(), user,
+        lambda mail, uids, uidvalidity, mailbox: bulk_load(mail, user, uids, uidvalidity, mailbox),
+        criteria=criteria, mode=mode, cache=get_cache()
+    )
+    last = None
+    while job.alive():
+        if stop is not None and stop.is_set():
+            job.stop()
+        progress = (job.stats["applied"], job.stats["total"])
+        if not quiet and progress != last and progress[1]:
+            log(f"triage: {progress[0]}/{progress[1]}")
+            last = progress
+        time.sleep(1)
+    return job
+
+
+def cmd_sync(args):
+    user, password = credentials(args)
+    result = sync_mailbox(user, password, bodies=args.bodies)
+    log(f"sync: {result}")
+
+
+def cmd_triage(args):
+    user, password = credentials(args)
+    criteria = search_criteria("UNSEEN" if args.unread else "ALL", args.since, args.before)
+    mode = None if args.apply == "server" else args.apply
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    job = run_triage(user, password, criteria, mode, stop)
+    if job.state != "done":
+        sys.exit(f"triage {job.state}: {job.last_error or 'run again to resume'}")
+    log(f"triage: {job.stats['applied']} emails, {job.stats['commands']} server commands ({job.mode})")
+    if job.stats["flagged"]:
+        log(f"triage: {job.stats['flagged']} only copied and flagged \\Deleted (no MOVE or UIDPLUS); expunge the mailbox to finish the move")
+
+
+def cmd_digest(args):
+    user, password = credentials(args)
+    emails = recent_emails(user, password, args.count)
+    # Emails are summarised (and voiced) concurrently, printed in order
+    voice = speak if args.audio else (lambda text: None)
+    segments = stream_briefing(args.name or user.split("@")[0], emails, summarize_with_ollama, voice)
+    texts, clips = [], []
+    for mail, (summary, text, clip) in zip([None] + emails + [None], segments):
+        if mail is not None:
+            print(f"{mail['date']}  {mail['sender']}\n  {mail['subject']}\n  {summary}\n")
+        texts.append(text)
+        clips.append(clip)
+    if args.audio:
+        try:
+            full = None if None in clips else join_briefing(texts, clips)
+        except Exception as e:
+            sys.exit(f"Could not join the audio: {e}")
+        if full is None:
+            sys.exit("Could not generate audio")
+        with open(args.audio, "wb") as f:
+            f.write(full[0])
+        log(f"digest: {full[1]} audio written to {args.audio}")
+
+
+def warm_up(user, password, args, stop):
+    # The overnight pass: whole inbox cached with bodies, every message
+    # categorised, the newest ones summarised
+    result = sync_mailbox(user, password, bodies=True)
+    log(f"sync: {result}")
+    if stop.is_set():
+        return
+    job = run_triage(user, password, "ALL", "local", stop, quiet=True)
+    log(f"triage: {job.state}, {job.stats['classified']} classified")
+    for mail in recent_emails(user, password, args.summaries):
+        if stop.is_set():
+            return
+        summarize_with_ollama(mail["body"])
+    log(f"summaries: newest {args.summaries} ready")
+    # Per task and model, to tune EMAIL_AGENT_MODELS
+    for row in usage():
+        log(f"model: {row['task']} on {row['model']}: {row['calls']} calls, {row['mean_s']:.2f}s mean, "
+            f"{row['prompt_tokens']} prompt / {row['output_tokens']} output tokens, {row['loads']} loads, {row['errors']} errors")
+
+
+def log_trace():
+    for row in stage_stats():
+        log(f"trace: {row['stage']}: {row['count']} x {row['mean_ms']:.1f}ms mean, p95 {row['p95_ms']:.1f}ms, "
+            f"{row['total_s']:.2f}s total, {row['errors']} errors")
+    if trace_counters:
+        log("trace: " + ", ".join(f"{name} {value}" for name, value in sorted(trace_counters.items())))
+
+
+def cmd_daemon(args):
+    user, password = credentials(args)
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    watcher = None
+    if args.live:
+        # New mail is categorised as it arrives, between the scheduled passes
+        watcher = InboxWatcher(
+            lambda: mail_pool(user, password).dedicated(), user, fetch_headers,
+            cache=get_cache(), triage=lambda mail, items: triage_arrivals(mail, user, items)
+        )
+        watcher.auto_triage = True
+
+    start_warm_up(user)
+    log(f"daemon: every {args.interval}s" + (f" between {args.window}" if args.window else ""))
+    window = _window(args.window) if args.window else None
+    while not stop.is_set():
+        if in_window(window):
+            try:
+                warm_up(user, password, args, stop)
+            except Exception as e:
+                log(f"daemon: pass failed: {e}")
+        if watcher is not None:
+            arrived = sum(len(payload) for kind, payload in watcher.poll_events() if kind == "new")
+            if arrived:
+                log(f"live: {arrived} new emails triaged")
+        stop.wait(args.interval)
+    if watcher is not None:
+        watcher.stop()
+    log("daemon: stopped")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Private AI Email Agent without the UI")
+    parser.add_argument("--user", help="email address (default: $EMAIL_AGENT_USER)")
+    parser.add_argument("--trace", nargs="?", const=TRACE_PATH, metavar="PATH",
+                        help=f"write timing spans as JSON lines (default file: {TRACE_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sync = commands.add_parser("sync", help="cache the whole inbox locally")
+    sync.add_argument("--bodies", action="store_true", help="also download text bodies and index them for chat")
+    sync.set_defaults(run=cmd_sync)
+
+    triage = commands.add_parser("triage", help="classify the whole inbox (resumable)")
+    triage.add_argument("--since", type=_date, help="YYYY-MM-DD")
+    triage.add_argument("--before", type=_date, help="YYYY-MM-DD, exclusive")
+    triage.add_argument("--unread", action="store_true")
+    triage.add_argument("--apply", choices=["local", "server", "label", "move"], default="local",
+                        help="local: cache only; server: Gmail labels or folders, whichever the server supports")
+    triage.set_defaults(run=cmd_triage)
+
+    digest = commands.add_parser("digest", help="summarise the newest emails")
+    digest.add_argument("--count", type=int, default=5)
+    digest.add_argument("--audio", help="write the spoken briefing to this file (.mp3, or .wav with an offline voice)")
+    digest.add_argument("--name", help="name used in the spoken greeting")
+    digest.set_defaults(run=cmd_digest)
+
+    daemon = commands.add_parser("daemon", help="keep triage and summaries warm for the UI")
+    daemon.add_argument("--interval", type=int, default=3600, help="seconds between passes")
+    daemon.add_argument("--window", help="only run passes between HH:MM-HH:MM, e.g. 01:00-06:00")
+    daemon.add_argument("--summaries", type=int, default=20, help="newest emails to pre-summarise")
+    daemon.add_argument("--live", action="store_true", help="also triage new mail as it arrives (IMAP IDLE)")
+    daemon.set_defaults(run=cmd_daemon)
+
+    args = parser.parse_args(argv)
+    if args.trace:
+        enable_tracing(args.trace)
+    args.run(args)
+    if args.trace:
+        log_trace()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import re
+import time
+
+from tracing import add_span, enabled as tracing_enabled
+
+# --- BATCHED IMAP FETCH ---
+# One FETCH command covers a whole message-set; untagged responses are
+# parsed and yielded as soon as each one has been read off the socket.
+
+_LITERAL_RE = re.compile(rb'\{(\d+)\}$')
+_TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"\[]+(?:\[[^\]]*\])?(?:<[\d.]+>)?))')
+
+
+def _as_int(value):
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode()
+    return int(value)
+
+
+def message_set(ids):
+    if isinstance(ids, (str, bytes)):
+        return ids if isinstance(ids, str) else ids.decode()
+
+    numbers = sorted({_as_int(i) for i in ids})
+    if not numbers:
+        return ""
+
+    ranges = []
+    start = prev = numbers[0]
+    for n in numbers[1:]:
+        if n == prev + 1:
+            prev = n
+            continue
+        ranges.append(f"{start}:{prev}" if start != prev else str(start))
+        start = prev = n
+    ranges.append(f"{start}:{prev}" if start != prev else str(start))
+    return ",".join(ranges)
+
+
+def _tokenize(pieces):
+    tokens = []
+    for text, literal in pieces:
+        pos = 0
+        while pos < len(text):
+            mo = _TOKEN_RE.match(text, pos)
+            if not mo or mo.end() == pos:
+                break
+            pos = mo.end()
+            if mo.group(1):
+                tokens.append("(")
+            elif mo.group(2):
+                tokens.append(")")
+            elif mo.group(3) is not None:
+                tokens.append(re.sub(rb'\\(.)', rb'\1', mo.group(3)))
+            elif mo.group(4) is not None:
+                atom = mo.group(4)
+                tokens.append(None if atom.upper() == b"NIL" else atom)
+        if literal is not None:
+            tokens.append(literal)
+    return tokens
+
+
+def _build(tokens, pos=0):
+    items = []
+    while pos < len(tokens):
+        tok = tokens[pos]
+        if tok == "(":
+            sub, pos = _build(tokens, pos + 1)
+            items.append(sub)
+            continue
+        if tok == ")":
+            return items, pos + 1
+        items.append(tok)
+        pos += 1
+    return items, pos
+
+
+def parse_imap_list(pieces):
+    tokens = _tokenize(pieces)
+    items, _ = _build(tokens)
+    return items
+
+
+def parse_fetch_response(parts):
+    # `parts` is what imaplib stores for one untagged FETCH: zero or more
+    # (text, literal) tuples followed by the closing bytes line.
+    pieces = []
+    for part in parts:
+        if isinstance(part, tuple):
+            text, literal = part
+            text = _LITERAL_RE.sub(b"", text)
+            pieces.append((text, literal))
+        elif part:
+            pieces.append((part, None))
+
+    items = parse_imap_list(pieces)
+    if len(items) < 2 or not isinstance(items[1], list):
+        return None, {}
+
+    seq = _as_int(items[0])
+    attrs = {}
+    values = items[1]
+    for i in range(0, len(values) - 1, 2):
+        key = values[i]
+        if isinstance(key, bytes):
+            key = key.decode(errors="replace").upper()
+        attrs[key] = values[i + 1]
+    return seq, attrs
+
+
+def _drain_fetch_responses(mail, buffer):
+    for item in mail.untagged_responses.pop("FETCH", []):
+        buffer.append(item)
+        if not isinstance(item, tuple):
+            parts = list(buffer)
+            buffer.clear()
+            yield parse_fetch_response(parts)
+
+
+def iter_fetch(mail, ids, items="(RFC822)", uid=False):
+    msg_set = message_set(ids)
+    if not msg_set:
+        return
+
+    wanted = None
+    if not isinstance(ids, (str, bytes)):
+        wanted = {_as_int(i) for i in ids}
+
+    if uid:
+        tag = mail._command("UID", "FETCH", msg_set, items)
+    else:
+        tag = mail._command("FETCH", msg_set, items)
+
+    # Only the time spent reading from the server counts as the fetch,
+    # not the caller's work between messages
+    timed = tracing_enabled()
+    waited = 0.0
+    received = 0
+    buffer = []
+    try:
+        while mail.tagged_commands[tag] is None:
+            if timed:
+                began = time.perf_counter()
+                mail._get_response()
+                waited += time.perf_counter() - began
+            else:
+                mail._get_response()
+            for seq, attrs in _drain_fetch_responses(mail, buffer):
+                key = _as_int(attrs["UID"]) if uid and "UID" in attrs else seq
+                # Unsolicited FETCH (e.g. flag changes) may be interleaved
+                if seq is None or (wanted is not None and key not in wanted):
+                    continue
+                if uid and "UID" not in attrs:
+                    continue
+                received += 1
+                yield key, attrs
+    finally:
+        # Leave the connection in a clean state even if the caller stopped early
+        while mail.tagged_commands.get(tag) is None:
+            mail._get_response()
+        mail.untagged_responses.pop("FETCH", None)
+        typ, data = mail.tagged_commands.pop(tag)
+        if timed:
+            add_span("imap.fetch", waited, messages=received, items=items[:60])
+
+    if typ != "OK":
+        raise mail.error(f"FETCH failed: {data}")
+
+
+def fetch_uid_range(mail, start_uid, end_uid="*", items="(UID RFC822)"):
+    return iter_fetch(mail, f"{start_uid}:{end_uid}", items=items, uid=True)
+
+
+# --- HEADER-FIRST / ON-DEMAND PARTS ---
+# Page loads fetch headers and BODYSTRUCTURE only; individual body parts
+# are pulled with BODY.PEEK[section] when a message is actually used.
+
+HEADER_ITEMS = "(UID FLAGS RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (SUBJECT FROM DATE)])"
+
+
+def _text(value):
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode(errors="replace")
+    return value
+
+
+def _params(values):
+    if not isinstance(values, list):
+        return {}
+    return {_text(values[i]).lower(): _text(values[i + 1]) for i in range(0, len(values) - 1, 2)}
+
+
+def parse_bodystructure(structure, section=""):
+    if structure and isinstance(structure[0], list):
+        # Child parts come first; the subtype and extension data follow them
+        parts = []
+        for n, child in enumerate(structure, start=1):
+            if not isinstance(child, list):
+                break
+            parts.extend(parse_bodystructure(child, f"{section}.{n}" if section else str(n)))
+        return parts
+
+    maintype = (_text(structure[0]) or "text").lower()
+    subtype = (_text(structure[1]) or "plain").lower()
+    params = _params(structure[2])
+    size = structure[6] if len(structure) > 6 else None
+
+    # Extension data starts after the type-specific fields
+    ext = 7
+    if maintype == "text":
+        ext = 8
+    elif maintype == "message" and subtype == "rfc822":
+        ext = 10
+    disposition = structure[ext + 1] if len(structure) > ext + 1 else None
+    disposition_type, disposition_params = None, {}
+    if isinstance(disposition, list) and disposition:
+        disposition_type = (_text(disposition[0]) or "").lower()
+        if len(disposition) > 1:
+            disposition_params = _params(disposition[1])
+
+    return [{
+        "section": section or "1",
+        "type": f"{maintype}/{subtype}",
+        "charset": params.get("charset"),
+        "encoding": (_text(structure[5]) or "7bit").lower() if len(structure) > 5 else "7bit",
+        "size": _as_int(size) if size is not None else 0,
+        "disposition": disposition_type,
+        "filename": disposition_params.get("filename") or params.get("name"),
+    }]
+
+
+def header_bytes(attrs):
+    for key, value in attrs.items():
+        if key.startswith("BODY[HEADER"):
+            return value or b""
+    return b""
+
+
+def fetch_sections(mail, uids, sections, max_bytes=None):
+    # max_bytes: {section: cap}; capped sections use a partial fetch
+    # (BODY.PEEK[1]<0.N>) so oversized parts never cross the wire
+    max_bytes = max_bytes or {}
+    items = []
+    for s in sections:
+        cap = max_bytes.get(s)
+        items.append(f"BODY.PEEK[{s}]<0.{cap}>" if cap else f"BODY.PEEK[{s}]")
+    for uid, attrs in iter_fetch(mail, uids, "(" + " ".join(items) + ")", uid=True):
+        yield uid, {s: attrs.get(f"BODY[{s}]", attrs.get(f"BODY[{s}]<0>")) for s in sections}
+
+
+# --- MAILBOX STATE / CONDSTORE ---
+
+def select_mailbox(mail, mailbox="inbox"):
+    # Ask for CONDSTORE once per connection; servers without it get a plain SELECT
+    condstore = getattr(mail, "_condstore", True)
+    if condstore:
+        try:
+            typ, data = mail.select(f"{mailbox} (CONDSTORE)")
+        except mail.error:
+            typ = "NO"
+        if typ != "OK":
+            mail._condstore = condstore = False
+    if not condstore:
+        typ, data = mail.select(mailbox)
+        if typ != "OK":
+            raise mail.error(f"SELECT {mailbox} failed: {data}")
+
+    def last(name):
+        values = mail.untagged_responses.get(name)
+        if not values or values[-1] is None:
+            return None
+        return _as_int(values[-1].split()[0])
+
+    return {
+        "exists": _as_int(data[0] or 0),
+        "uidvalidity": last("UIDVALIDITY"),
+        "uidnext": last("UIDNEXT"),
+        "highestmodseq": last("HIGHESTMODSEQ") if condstore else None,
+    }
+
+
+def fetch_changed_flags(mail, uid_range, modseq):
+    items = f"(UID FLAGS) (CHANGEDSINCE {modseq})"
+    for uid, attrs in iter_fetch(mail, uid_range, items, uid=True):
+        yield uid, [_text(f) for f in attrs.get("FLAGS") or []]
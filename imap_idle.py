@@ -0,0 +1,316 @@
+import imaplib
+import queue
+import re
+import select
+import threading
+import time
+
+from imap_fetch import iter_fetch, select_mailbox
+
+# --- INBOX WATCHER ---
+# A dedicated connection per account sits in IDLE on the inbox and turns
+# EXISTS / EXPUNGE / FETCH notifications into small deltas: headers for
+# new UIDs only, removals and flag changes. Servers without IDLE are
+# polled with NOOP, backing off while the inbox is quiet. Updates go to
+# the message cache and are handed to the UI through a queue.
+
+_UNTAGGED = re.compile(rb"^\* (\d+) (EXISTS|EXPUNGE|FETCH)\b(.*)", re.IGNORECASE)
+_FLAGS = re.compile(rb"FLAGS \(([^)]*)\)", re.IGNORECASE)
+
+
+class _UnbufferedReader:
+    # imaplib only asks for whole lines and exact-size literals, so nothing
+    # is read ahead and select() on the socket stays truthful.
+    def __init__(self, sock):
+        self._raw = sock.makefile("rb", buffering=0)
+
+    def readline(self, limit=-1):
+        return self._raw.readline(limit)
+
+    def read(self, size):
+        chunks = []
+        while size > 0:
+            chunk = self._raw.read(size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def close(self):
+        self._raw.close()
+
+
+def _readable(mail, timeout):
+    pending = getattr(mail.sock, "pending", None)
+    if pending is not None and pending():
+        return True
+    return bool(select.select([mail.sock], [], [], timeout)[0])
+
+
+def _capabilities(mail):
+    # imaplib keeps the list from the greeting; many servers only advertise
+    # IDLE once logged in, so ask again
+    try:
+        typ, data = mail.capability()
+        if typ == "OK" and data and data[-1]:
+            return data[-1].decode(errors="replace").upper().split()
+    except imaplib.IMAP4.error:
+        pass
+    return mail.capabilities
+
+
+def _close(mail):
+    try:
+        mail.logout()
+    except Exception:
+        try:
+            mail.shutdown()
+        except Exception:
+            pass
+
+
+class InboxWatcher:
+    def __init__(self, connect, account, fetch_headers, cache=None, triage=None, use_idle=True,
+                 idle_timeout=25 * 60, poll_interval=30, max_poll_interval=300, max_backoff=300):
+        # connect() -> logged-in connection; fetch_headers(mail, uids, uidvalidity) -> {uid: message};
+        # triage(mail, messages) runs on new arrivals while auto_triage is on
+        self.connect = connect
+        self.account = account
+        self.fetch_headers = fetch_headers
+        self.cache = cache
+        self.triage = triage
+        self.auto_triage = False
+        self.use_idle = use_idle
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.max_backoff = max_backoff
+        self.mode = None
+        self.last_error = None
+        self.stats = {"connects": 0, "new": 0, "expunged": 0, "flag_changes": 0, "resyncs": 0}
+        self.events = queue.Queue()
+        self._uids = []
+        self._last_uid = None
+        self._uidvalidity = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="inbox-watcher", daemon=True)
+        self._thread.start()
+
+    # --- connection lifecycle ---
+
+    def _run(self):
+        backoff = 1
+        while not self._stop.is_set():
+            mail = None
+            connected_at = time.monotonic()
+            try:
+                mail = self.connect()
+                self.stats["connects"] += 1
+                mail.file = _UnbufferedReader(mail.sock)
+                self._start(mail)
+                self.last_error = None
+                if self.use_idle and "IDLE" in _capabilities(mail):
+                    self.mode = "idle"
+                    self._idle_loop(mail)
+                else:
+                    self.mode = "poll"
+                    self._poll_loop(mail)
+            except Exception as e:
+                self.last_error = str(e)
+                self.mode = "reconnecting"
+            finally:
+                if mail is not None:
+                    _close(mail)
+            if time.monotonic() - connected_at > 60:
+                backoff = 1
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+        self.mode = None
+
+    def _start(self, mail):
+        uidvalidity = select_mailbox(mail, "inbox")["uidvalidity"]
+        if self._uidvalidity is not None and uidvalidity != self._uidvalidity:
+            self._uids, self._last_uid = [], None
+            self.events.put(("reset", None))
+        self._uidvalidity = uidvalidity
+
+        if self._last_uid is None:
+            # First connection: start from what the app has already loaded
+            stored = self.cache.mailbox_state(self.account, "inbox") if self.cache else None
+            if stored and stored["uidvalidity"] == uidvalidity:
+                self._last_uid = stored["last_uid"]
+        self._resync(mail)
+
+    def _resync(self, mail):
+        # Authoritative UID list; anything missing was expunged while we
+        # were not listening, anything above the last UID is new
+        status, data = mail.uid("SEARCH", None, "ALL")
+        uids = sorted(int(u) for u in data[0].split()) if data and data[0] else []
+        mail.untagged_responses.clear()
+        if self._last_uid is None:
+            self._last_uid = uids[-1] if uids else 0
+        live = set(uids)
+        gone = [uid for uid in self._uids if uid not in live]
+        new = [uid for uid in uids if uid > self._last_uid]
+        self._uids = [uid for uid in uids if uid <= self._last_uid]
+        if gone:
+            self._expunged(gone)
+        if new:
+            self._arrived(mail, new)
+
+    def _idle_loop(self, mail):
+        while not self._stop.is_set():
+            tag = mail._new_tag()
+            mail.send(tag + b" IDLE\r\n")
+            new = self._read_until(mail, tag, continuation=True)
+            started = time.monotonic()
+            # Re-issue IDLE before the server's inactivity timeout
+            while not new and not self._stop.is_set() and time.monotonic() - started < self.idle_timeout:
+                if _readable(mail, 1.0):
+                    new = self._handle(mail._get_line())
+            mail.send(b"DONE\r\n")
+            new = self._read_until(mail, tag) or new
+            if new:
+                self._fetch_new(mail)
+
+    def _poll_loop(self, mail):
+        interval = self.poll_interval
+        while not self._stop.wait(interval):
+            before = dict(self.stats)
+            tag = mail._new_tag()
+            mail.send(tag + b" NOOP\r\n")
+            if self._read_until(mail, tag):
+                self._fetch_new(mail)
+            # Poll less often while nothing happens
+            interval = self.poll_interval if self.stats != before else min(interval * 1.5, self.max_poll_interval)
+
+    def _read_until(self, mail, tag, continuation=False):
+        # Handles untagged lines in order until the tagged reply (or "+")
+        new = False
+        while True:
+            line = mail._get_line()
+            if continuation and line.startswith(b"+"):
+                return new
+            if line.startswith(tag + b" "):
+                if not line[len(tag) + 1:].upper().startswith(b"OK") or continuation:
+                    raise imaplib.IMAP4.error(line.decode(errors="replace"))
+                return new
+            new = self._handle(line) or new
+
+    # --- updates ---
+
+    def _handle(self, line):
+        # True when new messages are waiting to be fetched
+        if line.upper().startswith(b"* BYE"):
+            raise imaplib.IMAP4.abort(line.decode(errors="replace"))
+        match = _UNTAGGED.match(line)
+        if not match:
+            return False
+        seq, kind, rest = int(match.group(1)), match.group(2).upper(), match.group(3)
+        if kind == b"EXISTS":
+            return seq > len(self._uids)
+        if not 1 <= seq <= len(self._uids):
+            return False
+        if kind == b"EXPUNGE":
+            self._expunged([self._uids.pop(seq - 1)])
+        else:
+            flags = _FLAGS.search(rest)
+            if flags:
+                self._flag_change(self._uids[seq - 1], [f.decode() for f in flags.group(1).split()])
+        return False
+
+    def _fetch_new(self, mail):
+        last = self._last_uid
+        new = [uid for uid, _ in iter_fetch(mail, f"{last + 1}:*", "(UID)", uid=True) if uid > last]
+        if new:
+            self._arrived(mail, new)
+        self._check_leftovers(mail)
+
+    def _check_leftovers(self, mail):
+        # Expunges that arrived in the middle of our own commands were
+        # collected by imaplib; their sequence numbers are no longer
+        # trustworthy, so fall back to a full UID comparison
+        leftovers = mail.untagged_responses
+        if "EXPUNGE" in leftovers or any(int(n) > len(self._uids) for n in leftovers.get("EXISTS", [])):
+            self.stats["resyncs"] += 1
+            self._resync(mail)
+        mail.untagged_responses.clear()
+
+    def _arrived(self, mail, uids):
+        uids = sorted(uids)
+        messages = self.fetch_headers(mail, uids, self._uidvalidity)
+        self._uids.extend(uids)
+        self._last_uid = uids[-1]
+        fresh = [messages[uid] for uid in reversed(uids) if uid in messages]
+        if self.cache is not None:
+            # The app may have cached (and loaded or triaged) some of these
+            # already; keep its copy rather than the bare headers
+            cached = self.cache.get_messages(self.account, "inbox", self._uidvalidity, uids, touch=False)
+            self.cache.put_messages(self.account, "inbox", self._uidvalidity, [m for m in fresh if m["uid"] not in cached])
+            fresh = [cached.get(m["uid"], m) for m in fresh]
+            stored = self.cache.mailbox_state(self.account, "inbox")
+            if stored and stored["uidvalidity"] == self._uidvalidity and stored["last_uid"] < self._last_uid:
+                self.cache.set_mailbox_state(self.account, "inbox", self._uidvalidity, self._last_uid, stored["highestmodseq"])
+        self._check_leftovers(mail)
+        if self.auto_triage and self.triage is not None and fresh:
+            try:
+                self.triage(mail, fresh)
+            except Exception:
+                pass
+            self._check_leftovers(mail)
+        self.stats["new"] += len(fresh)
+        self.events.put(("new", fresh))
+
+    def _expunged(self, uids):
+        if self.cache is not None:
+            self.cache.remove_messages(self.account, "inbox", self._uidvalidity, uids)
+        self.stats["expunged"] += len(uids)
+        self.events.put(("expunged", uids))
+
+    def _flag_change(self, uid, flags):
+        if self.cache is not None:
+            self.cache.update_message(self.account, "inbox", self._uidvalidity, uid, flags=flags)
+        self.stats["flag_changes"] += 1
+        self.events.put(("flags", {uid: flags}))
+
+    # --- consumer side ---
+
+    def poll_events(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def alive(self):
+        return self._thread.is_alive() and not self._stop.is_set()
+
+    def stop(self):
+        self._stop.set()
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def start_watcher(account, factory):
+    with _watchers_lock:
+        watcher = _watchers.get(account)
+        if watcher is None or not watcher.alive():
+            watcher = factory()
+            _watchers[account] = watcher
+        return watcher
+
+
+def get_watcher(account):
+    with _watchers_lock:
+        return _watchers.get(account)
+
+
+def stop_watcher(account):
+    with _watchers_lock:
+        watcher = _watchers.pop(account, None)
+    if watcher is not None:
+        watcher.stop()
@@ -0,0 +1,170 @@
+import imaplib
+import threading
+import time
+from contextlib import contextmanager
+
+from tracing import span
+
+# --- IMAP CONNECTION POOL ---
+# Logged-in connections are kept between Streamlit reruns so warm
+# operations skip the TLS handshake and LOGIN entirely.
+
+IMAP_HOST = "imap.gmail.com"
+
+_DROPPED = (imaplib.IMAP4.abort, OSError)
+
+
+class IMAPPool:
+    def __init__(self, username, password, host=IMAP_HOST, port=None, use_ssl=True,
+                 max_connections=2, idle_timeout=600, check_after=15, acquire_timeout=30):
+        self.username = username
+        self.password = password
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.acquire_timeout = acquire_timeout
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.stats = {"connects": 0, "reuses": 0, "reconnects": 0}
+
+    def _connect(self):
+        cls = imaplib.IMAP4_SSL if self.use_ssl else imaplib.IMAP4
+        with span("imap.connect", host=self.host):
+            mail = cls(self.host, self.port) if self.port else cls(self.host)
+            try:
+                mail.login(self.username, self.password)
+            except Exception:
+                _discard(mail)
+                raise
+        self._count("connects")
+        return mail
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _is_alive(self, mail, last_used):
+        if time.monotonic() - last_used < self.check_after:
+            return True
+        try:
+            return mail.noop()[0] == "OK"
+        except Exception:
+            return False
+
+    def acquire(self):
+        if self._closed:
+            raise imaplib.IMAP4.error("connection pool is closed")
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError(f"No free IMAP connection for {self.username} (limit {self.max_connections})")
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    return self._connect()
+
+                mail, last_used = item
+                if time.monotonic() - last_used > self.idle_timeout:
+                    _discard(mail)
+                    continue
+                if self._is_alive(mail, last_used):
+                    self._count("reuses")
+                    return mail
+                self._count("reconnects")
+                _discard(mail)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, mail, broken=False):
+        try:
+            if broken or self._closed:
+                _discard(mail)
+            else:
+                with self._lock:
+                    self._idle.append((mail, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        mail = self.acquire()
+        broken = False
+        try:
+            yield mail
+        except _DROPPED:
+            broken = True
+            raise
+        finally:
+            self.release(mail, broken)
+
+    def run(self, operation, retries=0):
+        # A connection that died between health checks is thrown away. Only
+        # idempotent operations (reads, flag syncs) should pass retries to
+        # be replayed on a fresh one: a dropped APPEND may already have
+        # reached the server.
+        for attempt in range(retries + 1):
+            try:
+                with self.connection() as mail:
+                    return operation(mail)
+            except _DROPPED:
+                if attempt == retries:
+                    raise
+                self._count("reconnects")
+
+    def dedicated(self):
+        # A fresh logged-in connection outside the pool's slots, for long
+        # blocking work such as IDLE. The caller owns and closes it.
+        if self._closed:
+            raise imaplib.IMAP4.error("connection pool is closed")
+        return self._connect()
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for mail, _ in idle:
+            _discard(mail)
+
+
+def _discard(mail):
+    try:
+        mail.logout()
+    except Exception:
+        try:
+            mail.shutdown()
+        except Exception:
+            pass
+
+
+# --- PER-ACCOUNT REGISTRY ---
+# Module state survives Streamlit reruns, so one pool per account is
+# shared by every rerun (and every tab) until logout.
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(username, password, host=IMAP_HOST, port=None, **options):
+    key = (host, port, username)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is not None and pool.password != password:
+            pool.close()
+            pool = None
+        if pool is None:
+            pool = IMAPPool(username, password, host=host, port=port, **options)
+            _pools[key] = pool
+        return pool
+
+
+def close_pool(username, host=IMAP_HOST, port=None):
+    with _pools_lock:
+        pool = _pools.pop((host, port, username), None)
+    if pool is not None:
+        pool.close()
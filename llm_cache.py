@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from mail_cache import DATA_DIR
+from tracing import count
+
+# --- LLM RESULT CACHE ---
+# Results are keyed by a hash of (task, model, prompt template version,
+# normalized input), so identical work is answered from disk. Bump a
+# template's version whenever its prompt changes.
+
+LLM_CACHE_PATH = os.path.join(DATA_DIR, "llm_cache.db")
+
+
+def normalize(text):
+    return " ".join(str(text or "").split())
+
+
+def cache_key(task, model, version, inputs):
+    payload = json.dumps([task, model, version, [normalize(i) for i in inputs]], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path=LLM_CACHE_PATH, ttl=14 * 24 * 3600, max_entries=20000):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, task TEXT, value TEXT, created REAL, last_access REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_lru ON results (last_access)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute("SELECT value, created FROM results WHERE key=?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM results WHERE key=?", (key,))
+                self.misses += 1
+                count("llm_cache.miss")
+                return None
+            self._db.execute("UPDATE results SET last_access=? WHERE key=?", (now, key))
+            self.hits += 1
+            count("llm_cache.hit")
+            return json.loads(row[0])
+
+    def set(self, key, value, task=""):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (key, task, json.dumps(value), now, now),
+            )
+            count = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            if count > self.max_entries:
+                # Drop expired rows first, then the least recently used
+                self._db.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,))
+                count = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+                self._db.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_access LIMIT ?)",
+                    (max(0, count - self.max_entries),),
+                )
+
+    def memoize(self, task, model, version, inputs, compute):
+        # Only successful results are stored; exceptions from compute propagate
+        key = cache_key(task, model, version, inputs)
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value, task)
+        return value
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM results")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache()
+        return _cache
@@ -0,0 +1,94 @@
+import time
+from collections import deque
+
+import ollama
+
+from llm_cache import cache_key, get_llm_cache
+from models import record
+
+# --- STREAMING COMPLETIONS ---
+# Tokens are yielded as the model produces them so the UI can render
+# them straight away. Each call records time-to-first-token and
+# tokens/sec; the most recent calls are kept in stream_log, and every
+# call also lands in models.call_log with the server's token counts.
+
+stream_log = deque(maxlen=100)
+
+
+def _new_stats(task, model):
+    return {"task": task, "model": model, "ttft": None, "tokens": 0, "tok_per_sec": None,
+            "elapsed": None, "cached": False, "cancelled": False}
+
+
+def stream_chat(model, messages, task="", cancel=None, stats=None, **options):
+    # cancel: optional threading.Event. Closing the generator (e.g. a
+    # Streamlit rerun) also cancels; either way the HTTP stream is closed
+    # so Ollama stops generating.
+    stats = _new_stats(task, model) if stats is None else stats
+    stats.update(_new_stats(task, model))
+    start = time.perf_counter()
+    completed = False
+    final = None
+    stream = ollama.chat(model=model, messages=messages, stream=True, **options)
+    try:
+        for chunk in stream:
+            if cancel is not None and cancel.is_set():
+                break
+            content = chunk['message']['content']
+            if content:
+                if stats["ttft"] is None:
+                    stats["ttft"] = time.perf_counter() - start
+                stats["tokens"] += 1
+                yield content
+            if chunk.get('done'):
+                completed = True
+                final = chunk
+                if chunk.get('eval_count') and chunk.get('eval_duration'):
+                    # Server-side counts are exact; chunk counts are only a proxy
+                    stats["tokens"] = chunk['eval_count']
+                    stats["tok_per_sec"] = chunk['eval_count'] / (chunk['eval_duration'] / 1e9)
+    finally:
+        stream.close()
+        stats["elapsed"] = time.perf_counter() - start
+        stats["cancelled"] = not completed
+        if stats["tok_per_sec"] is None and stats["ttft"] is not None and stats["elapsed"] > stats["ttft"]:
+            stats["tok_per_sec"] = stats["tokens"] / (stats["elapsed"] - stats["ttft"])
+        stream_log.append(dict(stats))
+        record(task, model, stats["elapsed"], final, ttft=stats["ttft"], cancelled=stats["cancelled"])
+
+
+def stream_cached(task, model, version, inputs, messages, cancel=None, stats=None, **options):
+    # Same keys as LLMCache.memoize, so streamed and blocking calls share
+    # results. Only complete answers are cached.
+    stats = _new_stats(task, model) if stats is None else stats
+    try:
+        cache = get_llm_cache()
+        key = cache_key(task, model, version, inputs)
+        cached = cache.get(key)
+        if cached is not None:
+            stats.update(_new_stats(task, model), cached=True, ttft=0.0, elapsed=0.0)
+            stream_log.append(dict(stats))
+            yield cached
+            return
+
+        parts = []
+        for token in stream_chat(model, messages, task, cancel, stats, **options):
+            parts.append(token)
+            yield token
+        if not stats["cancelled"]:
+            cache.set(key, "".join(parts), task)
+    except Exception as e:
+        yield f"Error: {e}"
+
+
+def describe_stats(stats):
+    if stats.get("cached"):
+        return "⚡ from cache"
+    if stats.get("ttft") is None:
+        return ""
+    text = f"⚡ first token {stats['ttft']:.1f}s"
+    if stats.get("tok_per_sec"):
+        text += f" · {stats['tok_per_sec']:.1f} tok/s"
+    if stats.get("cancelled"):
+        text += " · stopped"
+    return text
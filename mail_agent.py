@@ -0,0 +1,555 @@
+import email
+import imaplib
+import io
+import os
+import time
+from email.header import decode_header
+from email.mime.text import MIMEText
+from email.utils import parsedate_to_datetime
+
+from imap_fetch import HEADER_ITEMS, iter_fetch, fetch_sections, parse_bodystructure, header_bytes, select_mailbox, fetch_changed_flags
+from imap_pool import IMAP_HOST, get_pool, close_pool
+from mail_cache import get_cache
+from triage import triage_emails
+from llm_cache import get_llm_cache
+from llm_stream import stream_chat, stream_cached
+from ocr_pipeline import get_ocr_pipeline
+from vector_index import get_vector_index
+from mime_parse import html_to_text, part_text, decode_payload, MAX_PART_BYTES, MAX_TEXT_CHARS, MAX_IMAGE_BYTES
+from tts import get_speaker, join_audio
+from briefing import briefing_segments, stream_briefing
+from prompts import input_budget, pack, prepare_email, clean_text, relevance
+from models import chat, model_for, route
+from tracing import span, count
+
+# --- EMAIL AGENT CORE ---
+# Everything the app does that does not need Streamlit: syncing the inbox,
+# loading bodies, triage, summaries, replies and inbox chat. The Streamlit
+# UI (app.py), the CLI and the daemon (cli.py) all run on these functions.
+
+# Gmail unless overridden, e.g. for another provider or a local test server
+IMAP_SERVER = {"host": os.environ.get("EMAIL_AGENT_IMAP_HOST", IMAP_HOST)}
+if os.environ.get("EMAIL_AGENT_IMAP_PORT"):
+    IMAP_SERVER["port"] = int(os.environ["EMAIL_AGENT_IMAP_PORT"])
+if os.environ.get("EMAIL_AGENT_IMAP_SSL", "1") == "0":
+    IMAP_SERVER["use_ssl"] = False
+
+
+def mail_pool(username, password):
+    return get_pool(username, password, **IMAP_SERVER)
+
+def close_mail_pool(username):
+    close_pool(username, IMAP_SERVER["host"], IMAP_SERVER.get("port"))
+
+# --- HELPER FUNCTIONS ---
+
+def clean_email_body(raw_html):
+    return html_to_text(raw_html)
+
+def safe_decode(byte_data, encoding="utf-8"):
+    try:
+        if not encoding: encoding = "utf-8"
+        return byte_data.decode(encoding)
+    except Exception:
+        return byte_data.decode("utf-8", errors="replace")
+
+def speak(text):
+    # (audio bytes, mime type) from the configured TTS engine, or None
+    try:
+        return get_speaker().speak(text)
+    except Exception:
+        return None
+
+def join_briefing(texts, clips):
+    # The briefing as one (audio, mime), or None. Segments voiced before a
+    # switch to the offline engine are voiced again first.
+    return join_audio(get_speaker().revoice(texts, clips))
+
+def text_to_audio(text):
+    clip = speak(text)
+    return io.BytesIO(clip[0]) if clip else None
+
+def _append_draft(mail, msg):
+    date_now = imaplib.Time2Internaldate(time.localtime())
+    
+    try:
+        mail.append('[Gmail]/Drafts', None, date_now, msg.as_bytes())
+        return True, "Saved to [Gmail]/Drafts"
+    except imaplib.IMAP4.abort:
+        raise
+    except Exception:
+        try:
+            mail.append('Drafts', None, date_now, msg.as_bytes())
+            return True, "Saved to Drafts"
+        except imaplib.IMAP4.abort:
+            raise
+        except Exception as e:
+            return False, str(e)
+
+def save_draft_to_gmail(username, password, to_email, subject, body):
+    try:
+        msg = MIMEText(body)
+        msg['Subject'] = f"Re: {subject}"
+        msg['From'] = username
+        msg['To'] = to_email
+        
+        return mail_pool(username, password).run(lambda mail: _append_draft(mail, msg))
+
+    except Exception as e:
+        return False, str(e)
+
+# --- CORE LOGIC ---
+
+def parse_email_headers(raw_headers):
+    msg = email.message_from_bytes(raw_headers)
+    
+    subject_header = decode_header(msg["Subject"] or "")[0]
+    subject, encoding = subject_header
+    if isinstance(subject, bytes):
+        subject = safe_decode(subject, encoding)
+    
+    sender = msg.get("From") or ""
+    sender_email = sender
+    if "<" in sender:
+        sender_email = sender.split("<")[1].replace(">", "")
+    
+    raw_date = msg.get("Date")
+    timestamp = None
+    try:
+        dt_obj = parsedate_to_datetime(raw_date)
+        local_dt = dt_obj.astimezone()
+        date = local_dt.strftime("%b %d, %I:%M %p")
+        timestamp = dt_obj.timestamp()
+    except Exception:
+        date = raw_date 
+
+    return subject, sender, sender_email, date, timestamp
+
+def _wanted_sections(mail_item, enable_ocr):
+    sections = []
+    for part in mail_item["parts"]:
+        if part["type"] in ("text/plain", "text/html") and part["disposition"] != "attachment":
+            sections.append(part["section"])
+        elif enable_ocr and part["type"].startswith("image/") and 5000 < part["size"] <= MAX_IMAGE_BYTES:
+            sections.append(part["section"])
+    return tuple(sections)
+
+def _section_caps(parts, sections, max_part_bytes=MAX_PART_BYTES):
+    # Only about max_part_bytes of each text part is downloaded; base64 needs
+    # 4/3 of that plus line breaks
+    caps = {}
+    for part in parts:
+        if part["section"] in sections and part["type"].startswith("text/"):
+            caps[part["section"]] = max_part_bytes * 7 // 5 if part["encoding"] == "base64" else max_part_bytes
+    return caps
+
+def assemble_body(parts, payloads, enable_ocr=False, max_part_bytes=MAX_PART_BYTES, max_text_chars=MAX_TEXT_CHARS):
+    texts = []
+    ocr_pending = []
+    
+    for part in parts:
+        raw = payloads.get(part["section"])
+        if raw is None:
+            continue
+        content_type = part["type"]
+        
+        if content_type in ("text/plain", "text/html"):
+            texts.append(part_text(raw, content_type, part["charset"], part["encoding"], max_part_bytes, max_text_chars))
+        elif enable_ocr and content_type.startswith("image/"):
+            payload = decode_payload(raw, part["encoding"], MAX_IMAGE_BYTES)
+            if len(payload) > 5000:
+                # OCR runs in the background; apply_ocr_results merges the text later
+                ocr_pending.append(get_ocr_pipeline().submit(payload))
+    
+    full_text = "\n".join(t for t in texts if t)[:max_text_chars]
+    return (full_text or "No text content found."), ocr_pending
+
+def apply_ocr_results(username, mail_items):
+    still_pending = 0
+    changes = {}
+    for mail in mail_items:
+        keys = mail.get("ocr_pending") or []
+        if not keys:
+            continue
+        waiting = []
+        for key in keys:
+            ocr_text = get_ocr_pipeline().result(key)
+            if ocr_text is None:
+                waiting.append(key)
+            elif ocr_text is False:
+                # The next load fetches the image again and resubmits it,
+                # once the pipeline's backoff allows
+                mail["ocr"] = False
+            elif ocr_text:
+                mail["body"] += f"\n\n[🔍 IMAGE TEXT DETECTED]:\n{ocr_text}\n"
+                mail["has_image"] = True
+        mail["ocr_pending"] = waiting
+        still_pending += len(waiting)
+        if len(waiting) != len(keys):
+            changes.setdefault(mail["uidvalidity"], {})[mail["uid"]] = {
+                "body": mail["body"], "has_image": mail["has_image"], "ocr": mail.get("ocr", False), "ocr_pending": waiting
+            }
+    
+    for uidvalidity, updates in changes.items():
+        get_cache().update_messages(username, "inbox", uidvalidity, updates)
+    return still_pending
+
+def _header_message(uid, uidvalidity, attrs):
+    subject, sender, sender_email, date, timestamp = parse_email_headers(header_bytes(attrs))
+    return {
+        "id": str(uid),
+        "uid": uid,
+        "uidvalidity": uidvalidity,
+        "subject": subject,
+        "sender": sender,
+        "sender_email": sender_email,
+        "date": date,
+        "timestamp": timestamp,
+        "size": int(attrs.get("RFC822.SIZE") or 0),
+        "flags": [f.decode() for f in attrs.get("FLAGS") or []],
+        "parts": parse_bodystructure(attrs["BODYSTRUCTURE"]),
+        "body": None,
+        "category": None,
+        "has_image": False
+    }
+
+def fetch_headers(mail, uids, uidvalidity):
+    # Headers + BODYSTRUCTURE only; bodies are fetched when a message is used
+    fetched = {}
+    for uid, attrs in iter_fetch(mail, uids, HEADER_ITEMS, uid=True):
+        try:
+            with span("parse.headers", uid=uid):
+                fetched[uid] = _header_message(uid, uidvalidity, attrs)
+        except Exception:
+            # The span keeps the uid and the error for the Performance tab
+            count("messages.failed")
+            continue
+    return fetched
+
+def _sync_inbox(mail, account, cache):
+    state = select_mailbox(mail, "inbox")
+    uidvalidity = state["uidvalidity"]
+    
+    stored = cache.mailbox_state(account, "inbox")
+    if stored is None or stored["uidvalidity"] != uidvalidity:
+        cache.reset_mailbox(account, "inbox")
+        stored = {"uidvalidity": uidvalidity, "last_uid": 0, "highestmodseq": None}
+    last_uid = stored["last_uid"]
+    
+    # New arrivals: only UIDs above the last one we have seen
+    if last_uid and (state["uidnext"] is None or state["uidnext"] > last_uid + 1):
+        new_uids = [uid for uid, _ in iter_fetch(mail, f"{last_uid + 1}:*", "(UID)", uid=True) if uid > last_uid]
+        if new_uids:
+            fetched = fetch_headers(mail, new_uids, uidvalidity)
+            cache.put_messages(account, "inbox", uidvalidity, fetched.values())
+            last_uid = max(new_uids)
+    
+    # Flag changes since the last sync (CONDSTORE)
+    modseq = state["highestmodseq"]
+    if last_uid and modseq and stored["highestmodseq"] and modseq != stored["highestmodseq"]:
+        changed = {uid: {"flags": flags} for uid, flags in fetch_changed_flags(mail, f"1:{last_uid}", stored["highestmodseq"])}
+        cache.update_messages(account, "inbox", uidvalidity, changed)
+    
+    return uidvalidity, last_uid, modseq
+
+def _fetch_page(mail, account, limit, folder, page):
+    cache = get_cache()
+    uidvalidity, last_uid, modseq = _sync_inbox(mail, account, cache)
+    
+    status, search_data = mail.uid("SEARCH", None, folder)
+    
+    if not search_data[0]:
+        cache.set_mailbox_state(account, "inbox", uidvalidity, last_uid, modseq)
+        return [], 0 
+
+    mail_ids = sorted(int(uid) for uid in search_data[0].split())
+    total_emails = len(mail_ids)
+    if folder == "ALL":
+        cache.remove_missing(account, "inbox", uidvalidity, mail_ids)
+    
+    end_idx = total_emails - ((page - 1) * limit)
+    start_idx = max(0, end_idx - limit)
+    
+    if end_idx <= 0:
+        cache.set_mailbox_state(account, "inbox", uidvalidity, last_uid, modseq)
+        return [], total_emails 
+        
+    batch_ids = mail_ids[start_idx:end_idx]
+    batch_ids = list(reversed(batch_ids)) 
+    
+    # Pages already seen come straight from disk; only unseen UIDs hit the server
+    parsed = cache.get_messages(account, "inbox", uidvalidity, batch_ids)
+    missing = [uid for uid in batch_ids if uid not in parsed]
+    count("mail_cache.hit", len(parsed))
+    count("mail_cache.miss", len(missing))
+    if missing:
+        fetched = fetch_headers(mail, missing, uidvalidity)
+        cache.put_messages(account, "inbox", uidvalidity, fetched.values())
+        parsed.update(fetched)
+    
+    cache.set_mailbox_state(account, "inbox", uidvalidity, max([last_uid] + batch_ids), modseq)
+    messages = [parsed[uid] for uid in batch_ids if uid in parsed]
+    return messages, total_emails 
+
+def fetch_emails(username, password, limit=10, folder="ALL", page=1):
+    try:
+        # Pooled connection: warm calls skip the TLS handshake and LOGIN
+        pool = mail_pool(username, password)
+        with span("fetch.page", page=page, limit=limit):
+            return pool.run(lambda mail: _fetch_page(mail, username, limit, folder, page), retries=1)
+        
+    except Exception as e:
+        return str(e)
+
+def fetch_bodies(mail, account, mail_items, enable_ocr, mailbox="inbox"):
+    uidvalidity = select_mailbox(mail, mailbox)["uidvalidity"]
+    
+    # Messages needing the same sections share one UID FETCH
+    groups = {}
+    for item in mail_items:
+        if item.get("uidvalidity") != uidvalidity:
+            count("messages.skipped")
+            continue
+        sections = _wanted_sections(item, enable_ocr)
+        caps = _section_caps(item["parts"], sections)
+        groups.setdefault((sections, tuple(sorted(caps.items()))), []).append(item)
+    
+    loaded = {}
+    for (sections, caps), items in groups.items():
+        by_uid = {item["uid"]: item for item in items}
+        payloads = {}
+        if sections:
+            payloads = dict(fetch_sections(mail, list(by_uid), sections, dict(caps)))
+        for uid, item in by_uid.items():
+            try:
+                with span("parse.body", uid=uid):
+                    item["body"], item["ocr_pending"] = assemble_body(item["parts"], payloads.get(uid, {}), enable_ocr)
+                item["has_image"] = False
+                item["ocr"] = enable_ocr
+                loaded[uid] = {"body": item["body"], "has_image": False, "ocr": enable_ocr, "ocr_pending": item["ocr_pending"]}
+            except Exception:
+                count("messages.failed")
+                item["body"] = "No text content found."
+    
+    get_cache().update_messages(account, mailbox, uidvalidity, loaded)
+
+def load_email_bodies(username, password, mail_items, enable_ocr=False):
+    # Re-fetch when OCR was switched on after the text was already loaded
+    pending = [m for m in mail_items if m.get("body") is None or (enable_ocr and not m.get("ocr"))]
+    if not pending:
+        return None
+    try:
+        with span("fetch.bodies", messages=len(pending), ocr=enable_ocr):
+            mail_pool(username, password).run(lambda mail: fetch_bodies(mail, username, pending, enable_ocr), retries=1)
+        return None
+    except Exception as e:
+        return str(e)
+
+def remember_category(username, mail_item):
+    try:
+        get_cache().update_message(username, "inbox", mail_item["uidvalidity"], mail_item["uid"], category=mail_item["category"])
+    except Exception:
+        pass
+
+SUMMARY_VERSION = 2
+REPLY_VERSION = 2
+
+_SUMMARY_PROMPT = "Summarize this email in 2 sentences. Capture the main action item:\n\n"
+
+def _summary_text(text):
+    return prepare_email(text, model_for("summary"), "summary", _SUMMARY_PROMPT)
+
+def _summary_messages(text):
+    return [{'role': 'user', 'content': _SUMMARY_PROMPT + text}]
+
+def summarize_with_ollama(text):
+    prepared = _summary_text(text)
+
+    def ask_model():
+        response = chat("summary", _summary_messages(prepared))
+        return response['message']['content']
+    
+    try:
+        # Shared by the Summarize button and the podcast briefing
+        return get_llm_cache().memoize("summary", model_for("summary"), SUMMARY_VERSION, [prepared], ask_model)
+    except Exception as e:
+        return f"Ollama Error: {e}"
+
+def stream_summary(text, stats=None):
+    prepared = _summary_text(text)
+    model, args = route("summary")
+    return stream_cached("summary", model, SUMMARY_VERSION, [prepared], _summary_messages(prepared), stats=stats, **args)
+
+def _reply_prompt(email_text, user_notes, user_name):
+    return f"""
+        You are an email assistant for {user_name}.
+        
+        Incoming Email:
+        {email_text}
+        
+        My Draft Notes:
+        {user_notes}
+        
+        Task: Write a professional reply based on my notes.
+        
+        STRICT RULES:
+        1. Output ONLY the email body.
+        2. Do NOT write "Here is a draft" or "Subject:".
+        3. Do NOT include placeholders like "[Your Name]".
+        4. Sign off specifically as "{user_name}".
+        """
+
+def _reply_text(email_text, user_notes, user_name):
+    return prepare_email(email_text, model_for("reply"), "reply", _reply_prompt("", user_notes, user_name))
+
+def generate_reply(email_text, user_notes, user_name="Sai"):
+    try:
+        incoming = _reply_text(email_text, user_notes, user_name)
+        prompt = _reply_prompt(incoming, user_notes, user_name)
+        
+        def ask_model():
+            response = chat("reply", [{'role': 'user', 'content': prompt}])
+            return response['message']['content']
+        
+        return get_llm_cache().memoize("reply", model_for("reply"), REPLY_VERSION, [incoming, user_notes, user_name], ask_model)
+    except Exception as e:
+        return f"Error: {e}"
+
+def stream_reply(email_text, user_notes, user_name="Sai", stats=None):
+    incoming = _reply_text(email_text, user_notes, user_name)
+    messages = [{'role': 'user', 'content': _reply_prompt(incoming, user_notes, user_name)}]
+    model, args = route("reply")
+    return stream_cached("reply", model, REPLY_VERSION, [incoming, user_notes, user_name], messages, stats=stats, **args)
+
+def _email_block(sender, subject, content, date=None):
+    dated = f"Date: {date}\n" if date else ""
+    return f"--- START EMAIL ---\nFrom: {sender}\nSubject: {subject}\n{dated}Content: {content}\n--- END EMAIL ---\n\n"
+
+def _retrieve_context(account, query, k=8, emails=()):
+    # Top-k chunks from the whole cached mailbox, grouped per email, best
+    # match first. The index follows the cache in the background; bodies
+    # loaded for the current page a moment ago are indexed here first.
+    index = get_vector_index()
+    grouped = {}
+    with span("retrieve", k=k):
+        loaded = {int(m["uid"]) for m in emails if m.get("body") is not None}
+        if loaded:
+            index.sync(account, "inbox", max_new=None, uids=loaded)
+        for hit in index.search(account, "inbox", query, k):
+            grouped.setdefault(hit["uid"], []).append(hit)
+    return [(hits[0]['sender'], hits[0]['subject'], "\n...\n".join(h["text"] for h in hits), hits[0]['date'])
+            for hits in grouped.values()]
+
+def _inbox_prompt(emails, query, account=None):
+    found = []
+    if account:
+        try:
+            found = _retrieve_context(account, query, emails=emails)
+        except Exception:
+            found = []
+    if not found:
+        # No index yet: fall back to the emails on the current page, most relevant first
+        ranked = sorted(emails, key=lambda m: -relevance(query, f"{m['subject']} {m['body'] or ''}"))
+        found = [(m['sender'], m['subject'], m['body'] or "", None) for m in ranked]
+    frame = f"Context:\n\n\nUser Question: {query}\n\nAnswer based on the emails."
+    frame += "".join(_email_block(sender, subject, "", date) for sender, subject, _, date in found)
+    room = input_budget(model_for("chat"), "chat", frame)
+    contents = pack([clean_text(content[:room * 16]) for _, _, content, _ in found], room)
+    context_blob = "".join(_email_block(sender, subject, content, date)
+                           for (sender, subject, _, date), content in zip(found, contents))
+    return f"Context:\n{context_blob}\n\nUser Question: {query}\n\nAnswer based on the emails."
+
+def ask_inbox(emails, query, account=None):
+    try:
+        response = chat("chat", [{'role': 'user', 'content': _inbox_prompt(emails, query, account)}])
+        return response['message']['content']
+    except Exception as e:
+        return f"Error: {e}"
+
+def stream_inbox_answer(emails, query, account=None, stats=None):
+    try:
+        messages = [{'role': 'user', 'content': _inbox_prompt(emails, query, account)}]
+        model, args = route("chat")
+        yield from stream_chat(model, messages, "chat", stats=stats, **args)
+    except Exception as e:
+        yield f"Error: {e}"
+
+def triage_arrivals(mail, account, items):
+    # Runs on the watcher thread: bodies first, then the usual triage
+    fetch_bodies(mail, account, items, enable_ocr=False)
+    for i, category in triage_emails(items):
+        if category is not None:
+            items[i]["category"] = category
+            remember_category(account, items[i])
+
+def bulk_load(mail, account, uids, uidvalidity, mailbox="inbox"):
+    # One bulk-triage chunk: cached messages are reused, the rest fetched
+    # and cached like any page, then bodies for those still missing one
+    cache = get_cache()
+    messages = cache.get_messages(account, mailbox, uidvalidity, uids, touch=False)
+    missing = [uid for uid in uids if uid not in messages]
+    if missing:
+        fetched = fetch_headers(mail, missing, uidvalidity)
+        cache.put_messages(account, mailbox, uidvalidity, fetched.values())
+        messages.update(fetched)
+    items = [messages[uid] for uid in uids if uid in messages]
+    pending = [m for m in items if m.get("body") is None]
+    if pending:
+        fetch_bodies(mail, account, pending, enable_ocr=False, mailbox=mailbox)
+    return items
+
+# --- BATCH JOBS ---
+
+def _sync_all(mail, account, bodies, chunk_size):
+    cache = get_cache()
+    uidvalidity, last_uid, modseq = _sync_inbox(mail, account, cache)
+    status, search_data = mail.uid("SEARCH", None, "ALL")
+    uids = sorted((int(u) for u in search_data[0].split()), reverse=True) if search_data[0] else []
+    removed = cache.remove_missing(account, "inbox", uidvalidity, uids)
+    
+    fetched = loaded = 0
+    for start in range(0, len(uids), chunk_size):
+        chunk = uids[start:start + chunk_size]
+        messages = cache.get_messages(account, "inbox", uidvalidity, chunk, touch=False)
+        missing = [uid for uid in chunk if uid not in messages]
+        if missing:
+            new = fetch_headers(mail, missing, uidvalidity)
+            cache.put_messages(account, "inbox", uidvalidity, new.values())
+            messages.update(new)
+            fetched += len(new)
+        pending = [m for m in messages.values() if m.get("body") is None]
+        if bodies and pending:
+            fetch_bodies(mail, account, pending, enable_ocr=False)
+            loaded += len(pending)
+    
+    cache.set_mailbox_state(account, "inbox", uidvalidity, max([last_uid] + uids), modseq)
+    return {"messages": len(uids), "fetched": fetched, "bodies": loaded, "removed": len(removed)}
+
+def sync_mailbox(username, password, bodies=False, chunk_size=500):
+    # Whole inbox into the local cache (headers, optionally text bodies) and the chat index
+    result = mail_pool(username, password).run(lambda mail: _sync_all(mail, username, bodies, chunk_size), retries=1)
+    if bodies:
+        # The background indexer has been following the sync; finish here
+        # so a one-shot command does not exit half indexed
+        result["indexed"] = get_vector_index().sync(username, "inbox", max_new=None)
+    return result
+
+def recent_emails(username, password, count=5):
+    # Newest messages with their bodies, as the first inbox page would show them
+    result = fetch_emails(username, password, limit=count, folder="ALL", page=1)
+    if isinstance(result, str):
+        raise imaplib.IMAP4.error(result)
+    emails, _ = result
+    error = load_email_bodies(username, password, emails)
+    if error:
+        raise imaplib.IMAP4.error(error)
+    for mail in emails:
+        if mail.get("body") is None: mail["body"] = "No text content found."
+    return emails
+
+def briefing_script(user_name, emails, summaries):
+    return "".join(briefing_segments(user_name, emails, summaries))
+
+def podcast_briefing(user_name, emails, max_workers=3):
+    # Spoken segments as they become ready; see briefing.stream_briefing
+    return stream_briefing(user_name, emails, summarize_with_ollama, speak, max_workers)
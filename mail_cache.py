@@ -0,0 +1,271 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import analytics
+
+# --- LOCAL MESSAGE CACHE ---
+# Parsed messages keyed by (account, mailbox, UIDVALIDITY, UID). A change
+# of UIDVALIDITY invalidates everything cached for that mailbox. Listeners
+# registered with on_change() hear which mailbox gained, changed or lost
+# messages in the shared cache, e.g. to keep the chat index up to date.
+
+DATA_DIR = os.environ.get("EMAIL_AGENT_HOME", os.path.join(os.path.expanduser("~"), ".email_agent"))
+CACHE_PATH = os.path.join(DATA_DIR, "mail_cache.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mailboxes (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    last_uid INTEGER NOT NULL DEFAULT 0,
+    highestmodseq INTEGER,
+    PRIMARY KEY (account, mailbox)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (account, mailbox, uidvalidity, uid)
+);
+CREATE INDEX IF NOT EXISTS messages_lru ON messages (last_access);
+"""
+
+
+class MailCache:
+    def __init__(self, path=CACHE_PATH, max_bytes=256 * 1024 * 1024, max_messages=100000, listeners=()):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.listeners = listeners
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._db.executescript(analytics.SCHEMA)
+
+    # --- mailbox sync state ---
+
+    def mailbox_state(self, account, mailbox):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT uidvalidity, last_uid, highestmodseq FROM mailboxes WHERE account=? AND mailbox=?",
+                (account, mailbox),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"uidvalidity": row[0], "last_uid": row[1], "highestmodseq": row[2]}
+
+    def set_mailbox_state(self, account, mailbox, uidvalidity, last_uid, highestmodseq=None):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO mailboxes VALUES (?, ?, ?, ?, ?)",
+                (account, mailbox, uidvalidity, last_uid, highestmodseq),
+            )
+
+    def reset_mailbox(self, account, mailbox):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM messages WHERE account=? AND mailbox=?", (account, mailbox))
+            self._db.execute("DELETE FROM mailboxes WHERE account=? AND mailbox=?", (account, mailbox))
+            analytics.reset(self._db, account, mailbox)
+        self._changed({(account, mailbox)})
+
+    # --- messages ---
+
+    def get_messages(self, account, mailbox, uidvalidity, uids, touch=True):
+        uids = [int(u) for u in uids]
+        found = {}
+        if not uids:
+            return found
+        with self._lock, self._db:
+            for start in range(0, len(uids), 500):
+                chunk = uids[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = self._db.execute(
+                    f"SELECT uid, data FROM messages WHERE account=? AND mailbox=? AND uidvalidity=? AND uid IN ({marks})",
+                    (account, mailbox, uidvalidity, *chunk),
+                ).fetchall()
+                for uid, data in rows:
+                    found[uid] = json.loads(data)
+                if not touch:
+                    continue
+                self._db.execute(
+                    f"UPDATE messages SET last_access=? WHERE account=? AND mailbox=? AND uidvalidity=? AND uid IN ({marks})",
+                    (time.time(), account, mailbox, uidvalidity, *chunk),
+                )
+        return found
+
+    def put_messages(self, account, mailbox, uidvalidity, messages):
+        now = time.time()
+        messages = list(messages)
+        rows = []
+        for msg in messages:
+            data = json.dumps(msg)
+            rows.append((account, mailbox, uidvalidity, int(msg["uid"]), data, len(data), now))
+        if not rows:
+            return
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            analytics.record(self._db, account, mailbox, uidvalidity, messages)
+        self.evict()
+        self._changed({(account, mailbox)})
+
+    def message_versions(self, account, mailbox, uidvalidity):
+        # {uid: stored size}; a cheap way to spot rows that changed
+        with self._lock:
+            return dict(self._db.execute(
+                "SELECT uid, bytes FROM messages WHERE account=? AND mailbox=? AND uidvalidity=?",
+                (account, mailbox, uidvalidity),
+            ))
+
+    def update_message(self, account, mailbox, uidvalidity, uid, **fields):
+        self.update_messages(account, mailbox, uidvalidity, {uid: fields})
+
+    def update_messages(self, account, mailbox, uidvalidity, changes):
+        # changes: {uid: {field: value}}
+        if not changes:
+            return
+        uids = list(changes)
+        with self._lock, self._db:
+            rows = []
+            for start in range(0, len(uids), 500):
+                chunk = uids[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                rows += self._db.execute(
+                    f"SELECT uid, data FROM messages WHERE account=? AND mailbox=? AND uidvalidity=? AND uid IN ({marks})",
+                    (account, mailbox, uidvalidity, *chunk),
+                ).fetchall()
+            updates, merged = [], []
+            for uid, data in rows:
+                msg = json.loads(data)
+                msg.update(changes[uid])
+                merged.append(msg)
+                data = json.dumps(msg)
+                updates.append((data, len(data), account, mailbox, uidvalidity, uid))
+            self._db.executemany(
+                "UPDATE messages SET data=?, bytes=? WHERE account=? AND mailbox=? AND uidvalidity=? AND uid=?",
+                updates,
+            )
+            analytics.record(self._db, account, mailbox, uidvalidity, merged)
+        self.evict()
+        self._changed({(account, mailbox)})
+
+    def remove_missing(self, account, mailbox, uidvalidity, live_uids):
+        live_uids = set(int(u) for u in live_uids)
+        with self._lock, self._db:
+            cached = [r[0] for r in self._db.execute(
+                "SELECT uid FROM messages WHERE account=? AND mailbox=? AND uidvalidity=?",
+                (account, mailbox, uidvalidity),
+            )]
+            gone = [(account, mailbox, uidvalidity, uid) for uid in cached if uid not in live_uids]
+            self._db.executemany(
+                "DELETE FROM messages WHERE account=? AND mailbox=? AND uidvalidity=? AND uid=?", gone
+            )
+            # Messages evicted earlier are no longer cached but still counted
+            counted = [r[0] for r in self._db.execute(
+                "SELECT uid FROM facts WHERE account=? AND mailbox=? AND uidvalidity=?",
+                (account, mailbox, uidvalidity),
+            )]
+            analytics.forget(self._db, account, mailbox, uidvalidity, [uid for uid in counted if uid not in live_uids])
+        if gone:
+            self._changed({(account, mailbox)})
+        return [g[3] for g in gone]
+
+    def remove_messages(self, account, mailbox, uidvalidity, uids):
+        with self._lock, self._db:
+            self._db.executemany(
+                "DELETE FROM messages WHERE account=? AND mailbox=? AND uidvalidity=? AND uid=?",
+                [(account, mailbox, uidvalidity, int(uid)) for uid in uids],
+            )
+            analytics.forget(self._db, account, mailbox, uidvalidity, uids)
+        self._changed({(account, mailbox)})
+
+    def evict(self):
+        # LRU eviction until both the byte and message budgets are met
+        with self._lock, self._db:
+            count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM messages").fetchone()
+            if count <= self.max_messages and total <= self.max_bytes:
+                return 0
+            doomed, mailboxes = [], set()
+            for rowid, size, account, mailbox in self._db.execute(
+                    "SELECT rowid, bytes, account, mailbox FROM messages ORDER BY last_access"):
+                if count <= self.max_messages and total <= self.max_bytes:
+                    break
+                doomed.append((rowid,))
+                mailboxes.add((account, mailbox))
+                count -= 1
+                total -= size
+            self._db.executemany("DELETE FROM messages WHERE rowid=?", doomed)
+        self._changed(mailboxes)
+        return len(doomed)
+
+    def _changed(self, mailboxes):
+        # Outside the lock: a listener may read the cache straight away
+        for listener in list(self.listeners):
+            for account, mailbox in mailboxes:
+                try:
+                    listener(account, mailbox)
+                except Exception:
+                    pass
+
+    # --- analytics ---
+
+    def analytics(self, account, mailbox, kind, limit=None, since=None):
+        with self._lock:
+            if not self._db.execute("SELECT 1 FROM facts WHERE account=? AND mailbox=? LIMIT 1", (account, mailbox)).fetchone():
+                # Messages cached before the counters existed
+                self._backfill(account, mailbox)
+            return analytics.counts(self._db, account, mailbox, kind, limit, since)
+
+    def analytics_total(self, account, mailbox):
+        with self._lock:
+            return analytics.total(self._db, account, mailbox)
+
+    def _backfill(self, account, mailbox):
+        with self._db:
+            state = self._db.execute(
+                "SELECT uidvalidity FROM mailboxes WHERE account=? AND mailbox=?", (account, mailbox)
+            ).fetchone()
+            if state is None:
+                return
+            rows = self._db.execute(
+                "SELECT data FROM messages WHERE account=? AND mailbox=? AND uidvalidity=?",
+                (account, mailbox, state[0]),
+            ).fetchall()
+            analytics.record(self._db, account, mailbox, state[0], [json.loads(r[0]) for r in rows])
+
+    def stats(self):
+        with self._lock:
+            count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM messages").fetchone()
+        return {"messages": count, "bytes": total}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_listeners = []
+
+
+def on_change(listener):
+    # listener(account, mailbox) after the shared cache's messages change;
+    # it runs on the writer's thread, so it should only hand the work off
+    _listeners.append(listener)
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = MailCache(listeners=_listeners)
+        return _cache
@@ -0,0 +1,78 @@
+import base64
+import binascii
+import html
+import os
+import quopri
+import re
+
+from tracing import span
+
+# --- MIME PARSING ---
+# Text extraction with hard byte caps. Only the first MAX_PART_BYTES of
+# each text part is fetched (a partial BODY.PEEK) and decoded, and the
+# extracted body stops at MAX_TEXT_CHARS, so a 5 MB newsletter costs about
+# as much as a 200 KB one. HTML is turned into text with a few regex
+# passes instead of building a DOM. Both caps can be changed with
+# EMAIL_AGENT_MAX_PART_BYTES / EMAIL_AGENT_MAX_TEXT_CHARS, or per call.
+
+MAX_PART_BYTES = int(os.environ.get("EMAIL_AGENT_MAX_PART_BYTES", 256 * 1024))
+MAX_TEXT_CHARS = int(os.environ.get("EMAIL_AGENT_MAX_TEXT_CHARS", 50000))
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+
+_HIDDEN = re.compile(
+    r"<!--.*?(?:-->|$)|<(script|style|head|title|noscript|template|svg)\b[^>]*>.*?(?:</\1\s*>|$)",
+    re.IGNORECASE | re.DOTALL,
+)
+_TAG = re.compile(r"</?[A-Za-z!?][^>]*>?")
+# Block-level breaks survive as newlines, so quoted replies and footers
+# can still be told apart from the message itself
+_BREAK = re.compile(r"<(?:br|hr|/?p|/div|/tr|/li|/h[1-6]|/?blockquote|/table)\b[^>]*>", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+_LINE_SPACE = re.compile(r"[^\S\n]+")
+_LINES = re.compile(r" ?\n\s*")
+
+
+def html_to_text(raw_html, max_chars=MAX_TEXT_CHARS):
+    with span("html.clean", chars=len(raw_html)):
+        text = _SPACE.sub(" ", _HIDDEN.sub(" ", raw_html))
+        text = _BREAK.sub("\n", text)
+        text = _TAG.sub(" ", text)
+        # Entities last, so an escaped "&lt;b&gt;" stays text
+        text = _LINES.sub("\n", _LINE_SPACE.sub(" ", html.unescape(text))).strip()
+    return text[:max_chars] if max_chars else text
+
+
+def decode_payload(data, encoding, max_bytes=None):
+    # Safe on payloads cut short by a byte cap
+    encoding = (encoding or "").lower()
+    if max_bytes is not None and encoding != "base64":
+        data = data[:max_bytes]
+    try:
+        if encoding == "base64":
+            if max_bytes is not None:
+                # Line breaks make the encoded form well under 2x the decoded size
+                data = data[:max_bytes * 2]
+            data = re.sub(rb"[^A-Za-z0-9+/=]", b"", data)
+            if max_bytes is not None:
+                data = data[:(max_bytes + 2) // 3 * 4]
+            data = data[:len(data) // 4 * 4]
+            return base64.b64decode(data)
+        if encoding == "quoted-printable":
+            return quopri.decodestring(data)
+    except (binascii.Error, ValueError):
+        pass
+    return data
+
+
+def to_unicode(payload, charset):
+    try:
+        return payload.decode(charset or "utf-8", errors="replace")
+    except LookupError:
+        return payload.decode("utf-8", errors="replace")
+
+
+def part_text(payload, content_type, charset, encoding, max_bytes=MAX_PART_BYTES, max_chars=MAX_TEXT_CHARS):
+    text = to_unicode(decode_payload(payload, encoding, max_bytes), charset)
+    if content_type == "text/html":
+        return html_to_text(text, max_chars)
+    return text
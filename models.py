@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+from collections import deque
+
+import ollama
+
+from prompts import TASKS, context_tokens
+from tracing import add_span
+
+# --- MODEL ROUTING ---
+# Which model answers which task, with what limits. Classification only
+# needs a one-word label, so it goes to a small model with a short,
+# schema-constrained answer; summaries, replies and chat go to the main
+# model. Loaded models are kept in memory between calls (keep_alive) and
+# warmed up at login, so the first click after idle does not pay for a
+# model load. A routed model that is not pulled falls back to the main one.
+#
+#   EMAIL_AGENT_MODEL=llama3.2                       main model
+#   EMAIL_AGENT_MODELS=classify=qwen2.5:0.5b,reply=llama3.1:8b
+#   EMAIL_AGENT_KEEP_ALIVE=30m                       how long models stay loaded
+#
+# Every call's latency and token counts are kept in call_log; usage()
+# sums them per task and model.
+
+DEFAULT_MODEL = os.environ.get("EMAIL_AGENT_MODEL", "llama3.2")
+KEEP_ALIVE = os.environ.get("EMAIL_AGENT_KEEP_ALIVE", "30m")
+
+# Warm-up goes in this order, the main model first
+ROUTES = {
+    "summary": DEFAULT_MODEL,
+    "reply": DEFAULT_MODEL,
+    "chat": DEFAULT_MODEL,
+    "classify": "llama3.2:1b",
+    "classify_batch": "llama3.2:1b",
+}
+# Labels are copied, not written
+SAMPLING = {"classify": {"temperature": 0}, "classify_batch": {"temperature": 0}}
+
+call_log = deque(maxlen=500)
+
+_installed = {"names": None, "checked": 0.0}
+_installed_lock = threading.Lock()
+
+
+def installed_models(max_age=300):
+    # Names pulled into Ollama, or None when the server cannot be asked
+    with _installed_lock:
+        if time.time() - _installed["checked"] > max_age:
+            try:
+                names = set()
+                for entry in ollama.list()["models"]:
+                    names.add(entry["model"])
+                    if entry["model"].endswith(":latest"):
+                        names.add(entry["model"][:-len(":latest")])
+                _installed["names"] = names
+            except Exception:
+                _installed["names"] = None
+            _installed["checked"] = time.time()
+        return _installed["names"]
+
+
+def _overrides():
+    routes = {}
+    for item in os.environ.get("EMAIL_AGENT_MODELS", "").split(","):
+        task, _, model = item.partition("=")
+        if task.strip() and model.strip():
+            routes[task.strip()] = model.strip()
+    return routes
+
+
+def model_for(task):
+    model = _overrides().get(task) or ROUTES.get(task, DEFAULT_MODEL)
+    names = installed_models()
+    if names is not None and model not in names:
+        return DEFAULT_MODEL
+    return model
+
+
+def options_for(task, model):
+    # num_ctx matches the prompt budget, num_predict the answer room it reserves
+    options = {"num_ctx": context_tokens(model)}
+    if task in TASKS:
+        options["num_predict"] = TASKS[task][1]
+    options.update(SAMPLING.get(task, {}))
+    return options
+
+
+def route(task):
+    # (model, keyword arguments for ollama.chat)
+    model = model_for(task)
+    return model, {"options": options_for(task, model), "keep_alive": KEEP_ALIVE}
+
+
+def record(task, model, elapsed, response=None, **fields):
+    # response: the final ollama response (or stream chunk) with the server's counts
+    entry = {"task": task, "model": model, "elapsed": elapsed, "at": time.time(),
+             "prompt_tokens": None, "output_tokens": None, "load": None}
+    if response is not None:
+        entry["prompt_tokens"] = response.get("prompt_eval_count")
+        entry["output_tokens"] = response.get("eval_count")
+        if response.get("load_duration"):
+            entry["load"] = response["load_duration"] / 1e9
+    entry.update(fields)
+    call_log.append(entry)
+    _trace(entry, response)
+    return entry
+
+
+def _trace(entry, response):
+    # The call, and within it Ollama's own load / prefill / decode times;
+    # a stream stopped early has no server counts, only time to first token
+    attrs = {"task": entry["task"], "model": entry["model"]}
+    if entry.get("error"):
+        attrs["error"] = entry["error"]
+    add_span(f"llm.{entry['task']}", entry["elapsed"], **attrs)
+    timings = response or {}
+    if entry["load"]:
+        add_span("llm.load", entry["load"], **attrs)
+    if timings.get("prompt_eval_duration"):
+        add_span("llm.prefill", timings["prompt_eval_duration"] / 1e9, tokens=entry["prompt_tokens"], **attrs)
+    elif entry.get("ttft") is not None:
+        add_span("llm.prefill", entry["ttft"], **attrs)
+    if timings.get("eval_duration"):
+        add_span("llm.decode", timings["eval_duration"] / 1e9, tokens=entry["output_tokens"], **attrs)
+
+
+def chat(task, messages, **extra):
+    model, args = route(task)
+    start = time.perf_counter()
+    try:
+        response = ollama.chat(model=model, messages=messages, **args, **extra)
+    except Exception as e:
+        record(task, model, time.perf_counter() - start, error=str(e))
+        raise
+    record(task, model, time.perf_counter() - start, response)
+    return response
+
+
+def usage():
+    # [{task, model, calls, errors, mean_s, max_s, prompt_tokens, output_tokens, loads}] per task and model
+    totals = {}
+    for entry in list(call_log):
+        if entry.get("cached"):
+            continue
+        row = totals.setdefault((entry["task"], entry["model"]), {
+            "task": entry["task"], "model": entry["model"], "calls": 0, "errors": 0, "mean_s": 0.0, "max_s": 0.0,
+            "prompt_tokens": 0, "output_tokens": 0, "loads": 0})
+        row["calls"] += 1
+        row["errors"] += 1 if entry.get("error") else 0
+        row["mean_s"] += entry["elapsed"]
+        row["max_s"] = max(row["max_s"], entry["elapsed"])
+        row["prompt_tokens"] += entry["prompt_tokens"] or 0
+        row["output_tokens"] += entry["output_tokens"] or 0
+        # Ollama reports a few ms of load_duration even for a loaded model
+        row["loads"] += 1 if (entry["load"] or 0) > 0.5 else 0
+    for row in totals.values():
+        row["mean_s"] /= row["calls"]
+    return sorted(totals.values(), key=lambda r: (r["task"], r["model"]))
+
+
+# --- warm-up ---
+
+def warm_up(tasks=tuple(ROUTES)):
+    # Loads each routed model; an empty prompt generates nothing
+    # (num_ctx must match the calls' or Ollama reloads the model for them)
+    loaded = {}
+    for model in dict.fromkeys(model_for(task) for task in tasks):
+        start = time.perf_counter()
+        try:
+            ollama.generate(model=model, prompt="", options={"num_ctx": context_tokens(model)}, keep_alive=KEEP_ALIVE)
+            loaded[model] = time.perf_counter() - start
+            record("warm_up", model, loaded[model])
+        except Exception as e:
+            record("warm_up", model, time.perf_counter() - start, error=str(e))
+    return loaded
+
+
+_warming = {}
+_warming_lock = threading.Lock()
+
+
+def start_warm_up(key="default"):
+    # At most one warm-up in flight per key (e.g. per account)
+    with _warming_lock:
+        thread = _warming.get(key)
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(target=warm_up, name="model-warm-up", daemon=True)
+            _warming[key] = thread
+            thread.start()
+        return thread
@@ -0,0 +1,180 @@
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytesseract
+from PIL import Image, ImageStat
+
+from mail_cache import DATA_DIR
+from tracing import add_span, count
+
+# --- OCR PIPELINE ---
+# Images are OCR'd in worker processes, off the fetch path. Results are
+# cached by a hash of the image bytes, so a logo or signature image seen
+# in a hundred emails is only ever scanned once.
+
+OCR_CACHE_PATH = os.path.join(DATA_DIR, "ocr_cache.db")
+MAX_SIDE = 2000
+MIN_SIDE = 32
+# A failed scan is not cached; the image can be submitted again after
+# RETRY_AFTER seconds, doubling with each further failure
+RETRY_AFTER = 60.0
+MAX_RETRY_AFTER = 3600.0
+
+
+def _otsu_threshold(histogram):
+    total = sum(histogram)
+    sum_all = sum(i * h for i, h in enumerate(histogram))
+    sum_bg, weight_bg, best, threshold = 0.0, 0, 0.0, 127
+    for i, h in enumerate(histogram):
+        weight_bg += h
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += i * h
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if between > best:
+            best, threshold = between, i
+    return threshold
+
+
+def prepare_image(image):
+    # Returns a downscaled, binarized image, or None when the image is
+    # unlikely to contain text (icons, spacers, flat fills).
+    gray = image.convert("L")
+    width, height = gray.size
+    if min(width, height) < MIN_SIDE:
+        return None
+
+    scale = MAX_SIDE / max(width, height)
+    if scale < 1:
+        gray = gray.resize((int(width * scale), int(height * scale)), Image.Resampling.LANCZOS)
+
+    if ImageStat.Stat(gray).stddev[0] < 2:
+        return None
+
+    histogram = gray.histogram()
+    threshold = _otsu_threshold(histogram)
+    dark = sum(histogram[:threshold + 1]) / float(sum(histogram))
+    if min(dark, 1 - dark) < 0.0005:
+        return None
+
+    return gray.point([0 if p <= threshold else 255 for p in range(256)])
+
+
+def extract_text_from_image(image_bytes):
+    # Runs in a worker process. None means "failed, do not cache".
+    try:
+        prepared = prepare_image(Image.open(io.BytesIO(image_bytes)))
+        if prepared is None:
+            return ""
+        return pytesseract.image_to_string(prepared).strip()
+    except Exception:
+        return None
+
+
+class OCRPipeline:
+    def __init__(self, path=OCR_CACHE_PATH, max_workers=2):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_workers = max_workers
+        self._executor = self._new_executor()
+        self._done = {}
+        self._futures = {}
+        self._failures = {}  # key -> (failed attempts, monotonic time it may be retried)
+        # Re-entrant: a future that is already done runs its callback inside submit()
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS ocr (key TEXT PRIMARY KEY, text TEXT NOT NULL, created REAL NOT NULL)")
+        self.hits = 0
+
+    def _new_executor(self):
+        try:
+            return ProcessPoolExecutor(max_workers=self.max_workers)
+        except (OSError, NotImplementedError):
+            return ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def _cached(self, key):
+        if key in self._done:
+            return self._done[key]
+        row = self._db.execute("SELECT text FROM ocr WHERE key=?", (key,)).fetchone()
+        if row is not None:
+            self._done[key] = row[0]
+            return row[0]
+        return None
+
+    def submit(self, image_bytes):
+        key = hashlib.sha256(image_bytes).hexdigest()
+        with self._lock:
+            if self._cached(key) is not None:
+                self.hits += 1
+                count("ocr.cache_hit")
+                return key
+            retry_at = self._failures.get(key, (0, 0.0))[1]
+            if key not in self._futures and time.monotonic() >= retry_at:
+                try:
+                    future = self._executor.submit(extract_text_from_image, image_bytes)
+                except BrokenExecutor:
+                    # A worker died (e.g. a corrupt image crashed Tesseract); start fresh
+                    self._executor = self._new_executor()
+                    future = self._executor.submit(extract_text_from_image, image_bytes)
+                self._futures[key] = future
+                count("ocr.cache_miss")
+                future.add_done_callback(lambda f, key=key, started=time.perf_counter(): self._finish(key, f, started))
+        return key
+
+    def _finish(self, key, future, started):
+        try:
+            text = future.result()
+        except Exception:
+            text = None
+        # From submit to done, so it includes time queued behind other images
+        add_span("ocr", time.perf_counter() - started, chars=len(text or ""), failed=text is None)
+        with self._lock:
+            self._futures.pop(key, None)
+            if text is None:
+                attempts = self._failures.get(key, (0, 0.0))[0] + 1
+                self._failures[key] = (attempts, time.monotonic() + min(MAX_RETRY_AFTER, RETRY_AFTER * 2 ** (attempts - 1)))
+                count("ocr.failed")
+                return
+            self._failures.pop(key, None)
+            self._done[key] = text
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO ocr VALUES (?, ?, ?)", (key, text, time.time()))
+
+    def result(self, key):
+        # The text ("" when the image holds none), None while the image is
+        # still queued or being scanned, or False when the scan failed or was
+        # never submitted to this process; submit it again to retry
+        with self._lock:
+            text = self._cached(key)
+            if text is None and key not in self._futures:
+                return False
+            return text
+
+    def pending(self):
+        with self._lock:
+            return len(self._futures)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_ocr_pipeline():
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = OCRPipeline()
+        return _pipeline
@@ -0,0 +1,150 @@
+import itertools
+import queue
+import threading
+import time
+
+# --- BACKGROUND PAGE LOADER ---
+# Inbox pages are fetched on a worker thread, outside the Streamlit rerun
+# cycle. The page being viewed is fetched first, its neighbours next, and
+# finished pages are handed back through a queue. Changing the filter or
+# page size starts a new generation: queued work for the old view is
+# dropped and late results are discarded.
+
+
+class PageLoader:
+    def __init__(self, fetch, max_age=120, neighbours=1):
+        # fetch(limit, folder, page) -> (emails, total) or an error string
+        self.fetch = fetch
+        self.max_age = max_age
+        self.neighbours = neighbours
+        self.stats = {"fetched": 0, "served": 0, "prefetch_hits": 0, "cancelled": 0}
+        self._jobs = queue.PriorityQueue()
+        self._results = queue.Queue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._view = None
+        self._generation = 0
+        self._pages = {}
+        self._queued = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="page-loader", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                priority, _, (generation, limit, folder, page) = self._jobs.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._lock:
+                if generation != self._generation or self._queued.get(page) != priority:
+                    # Cancelled, or superseded by a higher-priority copy of the same job
+                    if generation != self._generation:
+                        self.stats["cancelled"] += 1
+                    continue
+            try:
+                result = self.fetch(limit, folder, page)
+            except Exception as e:
+                result = str(e)
+            with self._lock:
+                if generation == self._generation:
+                    self._queued.pop(page, None)
+                self.stats["fetched"] += 1
+            self._results.put((generation, page, result, time.time(), priority))
+
+    def _drain(self):
+        while True:
+            try:
+                generation, page, result, fetched_at, priority = self._results.get_nowait()
+            except queue.Empty:
+                return
+            if generation == self._generation:
+                self._pages[page] = (result, fetched_at, priority)
+
+    def _set_view(self, limit, folder):
+        if self._view != (limit, folder):
+            self._view = (limit, folder)
+            self._cancel()
+
+    def _cancel(self):
+        self._generation += 1
+        self._pages.clear()
+        self._queued.clear()
+
+    def _want(self, page, priority):
+        entry = self._pages.get(page)
+        if entry is not None and time.time() - entry[1] < self.max_age:
+            return
+        if page in self._queued and self._queued[page] <= priority:
+            return
+        self._queued[page] = priority
+        limit, folder = self._view
+        self._jobs.put((priority, next(self._seq), (self._generation, limit, folder, page)))
+
+    def request(self, page, limit, folder, last_page=None):
+        # Queues the page (if it is not already loaded) and its neighbours
+        with self._lock:
+            self._set_view(limit, folder)
+            self._drain()
+            self._want(page, 0)
+            for offset in range(1, self.neighbours + 1):
+                for neighbour in (page + offset, page - offset):
+                    if neighbour >= 1 and (last_page is None or neighbour <= last_page):
+                        self._want(neighbour, 1)
+
+    def get(self, page, limit, folder):
+        # The finished page, or None while it is still loading. Errors are
+        # returned once and then forgotten so the next request retries.
+        with self._lock:
+            self._set_view(limit, folder)
+            self._drain()
+            entry = self._pages.get(page)
+            if entry is None or time.time() - entry[1] >= self.max_age:
+                return None
+            result, _, priority = entry
+            if isinstance(result, str):
+                del self._pages[page]
+            else:
+                self.stats["served"] += 1
+                if priority > 0:
+                    self.stats["prefetch_hits"] += 1
+            return result
+
+    def ready(self, page, limit, folder):
+        with self._lock:
+            self._set_view(limit, folder)
+            self._drain()
+            entry = self._pages.get(page)
+            return entry is not None and time.time() - entry[1] < self.max_age
+
+    def invalidate(self):
+        with self._lock:
+            self._cancel()
+
+    def pending(self):
+        with self._lock:
+            return len(self._queued)
+
+    def close(self):
+        self._stop.set()
+        self.invalidate()
+
+
+_loaders = {}
+_loaders_lock = threading.Lock()
+
+
+def get_page_loader(username, fetch, **options):
+    with _loaders_lock:
+        loader = _loaders.get(username)
+        if loader is None:
+            loader = PageLoader(fetch, **options)
+            _loaders[username] = loader
+        return loader
+
+
+def close_page_loader(username):
+    with _loaders_lock:
+        loader = _loaders.pop(username, None)
+    if loader is not None:
+        loader.close()
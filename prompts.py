@@ -0,0 +1,202 @@
+import os
+import re
+from urllib.parse import urlsplit
+
+# --- PROMPT BUDGETS ---
+# Every prompt is built against a token budget instead of a character
+# cut. Email text is cleaned first (quoted reply history, signatures,
+# unsubscribe footers, tracking URLs), then cut at a paragraph or
+# sentence boundary to fit. Several emails in one prompt share the
+# budget, the most relevant first. Tokens are estimated with a regex
+# close to Llama 3's tokenizer on English text and slightly on the high
+# side, so prompts stay inside the window.
+#
+# The context window per model matches Ollama's num_ctx; override it with
+# EMAIL_AGENT_NUM_CTX, either one number or e.g. "llama3.2=8192,mistral=4096".
+
+CONTEXT_TOKENS = {"llama3.2": 4096}
+DEFAULT_CONTEXT = 2048
+
+# task: (most input tokens worth sending, tokens kept free for the answer);
+# a batch fills the window, each email in it capped like a single one
+TASKS = {
+    "classify": (250, 16),
+    "classify_batch": (None, 128),
+    "summary": (800, 256),
+    "reply": (400, 512),
+    "chat": (1500, 512),
+}
+
+_TOKEN = re.compile(r"\d{1,3}|[^\W\d]{1,6}|[^\w\s]")
+
+
+def estimate_tokens(text):
+    return len(_TOKEN.findall(text or ""))
+
+
+def context_tokens(model):
+    setting = os.environ.get("EMAIL_AGENT_NUM_CTX", "").strip()
+    if setting.isdigit():
+        return int(setting)
+    for item in setting.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() == model and value.strip().isdigit():
+            return int(value)
+    return CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT)
+
+
+def input_budget(model, task, template=""):
+    # Tokens left for email text once the template and the answer fit
+    cap, reserve = TASKS[task]
+    room = context_tokens(model) - reserve - estimate_tokens(template)
+    return max(0, min(cap, room) if cap else room)
+
+
+# --- cleaning ---
+
+_INVISIBLE = re.compile("[\u00ad\u034f\u200b-\u200f\u2060\ufeff]")
+_URL = re.compile(r"https?://[^\s<>()\"']+")
+# Where quoted history starts: "On <date>, <name> wrote:" (possibly wrapped
+# onto a second line), Outlook's "-----Original Message-----" or its
+# "From: ... Sent: ..." block
+_REPLY_HEADER = re.compile(
+    r"(?:^|(?<=\s))(?:(?-i:On)\s[^\n]{0,300}?(?:\n[^\n]{0,120}?)?wrote:"
+    r"|-{2,}\s*Original Message\s*-{2,}"
+    r"|_{20,}\s*From:"
+    r"|From:\s[^\n]{1,120}\n\s*(?:Sent|Date):\s)",
+    re.IGNORECASE,
+)
+_SIGNATURE = re.compile(r"^--\s*$|^(?:Sent from my|Get Outlook for) ", re.IGNORECASE)
+# The phrases only a footer uses; "unsubscribe", "privacy policy" or "all
+# rights reserved" on their own can be what the email is about
+_FOOTER_ONLY = re.compile(
+    r"view (?:this email |it )?in (?:your |a )?browser|manage (?:your )?(?:email )?(?:preferences|subscriptions)"
+    r"|you(?:'re| are) receiving this|you received this (?:email|message)|this (?:email|message) was sent to"
+    r"|update your preferences|(?:©|copyright) ?\d{4}",
+    re.IGNORECASE,
+)
+_BOILERPLATE = re.compile(r"unsubscribe|privacy policy|all rights reserved|©|" + _FOOTER_ONLY.pattern, re.IGNORECASE)
+_RULE_LINE = re.compile(r"^[\W_]{3,}$")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+
+
+def _short_url(match):
+    host = urlsplit(match.group()).hostname or "link"
+    return f"[{host.removeprefix('www.')}]"
+
+
+def _footer_share(line):
+    # Share of the line's characters that are footer phrases
+    chars = len(line.replace(" ", ""))
+    return sum(len(m.group().replace(" ", "")) for m in _BOILERPLATE.finditer(line)) / max(1, chars)
+
+
+def _is_boilerplate(line):
+    # A short standalone line that is little but footer phrases:
+    # "Unsubscribe | Manage preferences", "© 2024 Acme. All rights reserved."
+    return len(line) < 80 and _footer_share(line) >= 0.4
+
+
+def _is_footer(line):
+    return bool(line) and len(line) <= 300 and (_is_boilerplate(line) or bool(_FOOTER_ONLY.search(line)))
+
+
+def _drop_footer(lines):
+    # Footer lines are only taken off the end, so a body line that merely
+    # mentions an unsubscribe link or a privacy policy stays
+    end = len(lines)
+    while end and (not lines[end - 1] or _is_footer(lines[end - 1])):
+        end -= 1
+    return lines[:end]
+
+
+def clean_text(text):
+    text = _URL.sub(_short_url, _INVISIBLE.sub("", text or "").replace("\xa0", " "))
+    # Quoted history, unless the quote is all there is. Headers of a
+    # forwarded message introduce the content, so they stay.
+    for match in _REPLY_HEADER.finditer(text):
+        if match.group().startswith("On") and not re.search(r"\d", match.group()):
+            continue  # "On the other hand, as I wrote:" is not a quote header
+        if "forwarded" not in text[max(0, match.start() - 80):match.start()].lower():
+            if text[:match.start()].strip():
+                text = text[:match.start()]
+            break
+    lines = []
+    rule_at = None
+    for line in text.splitlines():
+        if _SIGNATURE.match(line) and lines:
+            if line.strip().startswith("--"):
+                break
+            continue
+        line = line.strip()
+        if _RULE_LINE.match(line):
+            rule_at = len(lines)
+            continue
+        line = " ".join(line.split())
+        if line.startswith(">"):
+            continue
+        if len(line) > 300:
+            # A whole HTML email can be one long line: filter its sentences instead
+            line = " ".join(s for s in _SENTENCE.split(line) if not _is_boilerplate(s))
+        lines.append(line)
+    # A few lines under a separator that include a footer line are the
+    # footer, company address and all
+    tail = [line for line in lines[rule_at:] if line] if rule_at is not None else []
+    if tail and len(tail) <= 10 and any(_is_footer(line) for line in tail):
+        lines = lines[:rule_at]
+    lines = _drop_footer([line for line in lines if not _is_boilerplate(line)])
+    if lines and len(lines[-1]) > 300:
+        lines[-1] = " ".join(_drop_footer(_SENTENCE.split(lines[-1])))
+    cleaned = re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+    return cleaned or " ".join((text or "").split())
+
+
+# --- fitting ---
+
+def fit(text, tokens):
+    # The longest prefix within the budget that ends on a paragraph or
+    # sentence boundary (a word boundary if nothing better is close)
+    if estimate_tokens(text) <= tokens:
+        return text
+    if tokens <= 0:
+        return ""
+    cut = 0
+    for n, match in enumerate(_TOKEN.finditer(text)):
+        if n == tokens:
+            break
+        cut = match.end()
+    head = text[:cut]
+    for boundary in ("\n", ". ", "? ", "! ", " "):
+        at = head.rfind(boundary)
+        if at >= len(head) * 0.6:
+            return head[:at + 1].rstrip() + " …"
+    return head.rstrip() + " …"
+
+
+def pack(texts, tokens, min_tokens=40):
+    # Shares a budget between texts given most relevant first. Short texts
+    # keep all of theirs and their unused share goes to the longer ones;
+    # the least relevant are dropped if everyone cannot get min_tokens.
+    keep = len(texts)
+    while keep and keep * min_tokens > tokens:
+        keep -= 1
+    sizes = [estimate_tokens(t) for t in texts[:keep]]
+    shares = [0] * keep
+    left = tokens
+    for position, i in enumerate(sorted(range(keep), key=sizes.__getitem__)):
+        shares[i] = min(sizes[i], left // (keep - position))
+        left -= shares[i]
+    return [fit(text, share) for text, share in zip(texts, shares)]
+
+
+def prepare_email(body, model, task, template=""):
+    # Cleaned body fitted to what the task's prompt has room for. Only a
+    # generous prefix is cleaned; a token is rarely more than 16 characters.
+    budget = input_budget(model, task, template)
+    return fit(clean_text((body or "")[:budget * 16]), budget)
+
+
+def relevance(query, text):
+    # Shared words with the question; enough to order a page of emails
+    words = set(re.findall(r"\w{3,}", query.lower()))
+    return sum(1 for w in set(re.findall(r"\w{3,}", text.lower())) if w in words)
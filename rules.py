@@ -0,0 +1,102 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from mail_cache import DATA_DIR
+
+# --- TRIAGE RULES ---
+# Rules live in triage_rules.json (first match wins, in file order). A copy
+# in EMAIL_AGENT_HOME overrides the bundled one and is picked up on edit.
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "triage_rules.json")
+USER_RULES_PATH = os.path.join(DATA_DIR, "triage_rules.json")
+FIELDS = ("sender", "subject", "body")
+
+log = logging.getLogger(__name__)
+
+
+class RuleSet:
+    def __init__(self, rules, body_chars=500):
+        self.body_chars = body_chars
+        self.plan = []
+        used = set()
+        for rule in rules:
+            category = rule["category"]
+            fields = rule.get("fields", FIELDS)
+            unknown = set(fields) - set(FIELDS)
+            if unknown:
+                raise ValueError(f"Rule '{category}' uses unknown fields: {sorted(unknown)}")
+
+            keywords = sorted({k.lower() for k in rule.get("keywords", []) if k})
+            # A keyword containing another keyword of the same rule can never decide anything
+            keywords = tuple(k for k in keywords if not any(o != k and o in k for o in keywords))
+            pattern = None
+            if rule.get("patterns"):
+                pattern = re.compile("|".join(f"(?:{p})" for p in rule["patterns"]), re.IGNORECASE)
+
+            # Cheap short fields before the body
+            field_idx = tuple(sorted(FIELDS.index(f) for f in fields))
+            used.update(field_idx)
+            self.plan.append((category, field_idx, keywords, pattern))
+        self.uses_body = FIELDS.index("body") in used
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding="utf-8") as fh:
+            data = json.load(fh)
+        return cls(data["rules"], body_chars=data.get("body_chars", 500))
+
+    def classify(self, sender, subject, body):
+        # Slice before lowercasing: only the first body_chars are ever matched
+        values = (
+            (sender or "").lower(),
+            (subject or "").lower(),
+            (body or "")[:self.body_chars].lower() if self.uses_body else "",
+        )
+        for category, field_idx, keywords, pattern in self.plan:
+            for i in field_idx:
+                value = values[i]
+                for k in keywords:
+                    if k in value:
+                        return category
+                if pattern is not None and pattern.search(value):
+                    return category
+        return None
+
+
+_rules = None
+_rules_source = None
+_checked_at = 0.0
+_rules_lock = threading.Lock()
+
+
+def rules_path():
+    return USER_RULES_PATH if os.path.exists(USER_RULES_PATH) else DEFAULT_RULES_PATH
+
+
+def get_rules(check_every=2.0):
+    # Re-stat the rule file at most every few seconds so edits apply without a restart
+    global _rules, _rules_source, _checked_at
+    now = time.monotonic()
+    if _rules is not None and now - _checked_at < check_every:
+        return _rules
+    with _rules_lock:
+        path = rules_path()
+        try:
+            source = (path, os.path.getmtime(path))
+        except OSError:
+            source = _rules_source  # removed since rules_path() looked; next check picks the other file
+        if source != _rules_source:
+            # Remembered even when the file is bad, so it is not parsed again until it changes
+            _rules_source = source
+            try:
+                _rules = RuleSet.from_file(path)
+            except (OSError, ValueError, KeyError, TypeError, AttributeError, re.error) as exc:
+                log.warning("Ignoring invalid triage rules in %s: %s", path, exc)
+        if _rules is None:
+            _rules = RuleSet.from_file(DEFAULT_RULES_PATH)
+        _checked_at = now
+        return _rules
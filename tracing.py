@@ -0,0 +1,208 @@
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from mail_cache import DATA_DIR
+
+# --- TRACING ---
+# Timed spans around each stage (IMAP connect and FETCH, MIME parse, HTML
+# clean, OCR, LLM load/prefill/decode, TTS) plus counters for cache hits
+# and skipped or failed messages. Off by default: span() then hands back
+# one shared no-op object and count() returns straight away, so the
+# instrumented code pays a function call and a flag check.
+#
+#   EMAIL_AGENT_TRACE=1                  on, written to ~/.email_agent/trace.jsonl
+#   EMAIL_AGENT_TRACE=/tmp/run.jsonl     on, written to that file
+#
+# Each finished span is one JSON line:
+#   {"name": "imap.fetch", "start": <unix time>, "ms": 41.2, "id": 7, "parent": 3, "thread": "...", ...attributes}
+# The most recent spans are also kept in memory for the Performance tab.
+
+TRACE_PATH = os.path.join(DATA_DIR, "trace.jsonl")
+
+spans = deque(maxlen=20000)
+counters = {}
+
+_state = {"on": False, "path": None, "file": None}
+_lock = threading.Lock()
+_ids = itertools.count(1)
+_local = threading.local()
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Span:
+    __slots__ = ("name", "attrs", "id", "parent", "_start", "_wall")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.id = next(_ids)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1] if stack else None
+        stack.append(self.id)
+        self._wall = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        _local.stack.pop()
+        if exc_type is not None:
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"
+        _emit(self.name, self._wall, elapsed, self.id, self.parent, self.attrs)
+        return False
+
+
+def _emit(name, wall, seconds, span_id, parent, attrs):
+    record = {"name": name, "start": round(wall, 6), "ms": round(seconds * 1000, 3), "id": span_id,
+              "parent": parent, "thread": threading.current_thread().name}
+    record.update(attrs)
+    spans.append(record)
+    handle = _state["file"]
+    if handle is not None:
+        line = json.dumps(record, default=str) + "\n"
+        with _lock:
+            try:
+                handle.write(line)
+            except Exception:
+                pass
+
+
+def enabled():
+    return _state["on"]
+
+
+def enable(path=TRACE_PATH):
+    # path=None keeps spans in memory only
+    disable()
+    with _lock:
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            _state["file"] = open(path, "a", encoding="utf-8", buffering=1)
+        _state["path"] = path
+        _state["on"] = True
+
+
+def disable():
+    with _lock:
+        _state["on"] = False
+        if _state["file"] is not None:
+            _state["file"].close()
+        _state["file"] = None
+
+
+def trace_path():
+    return _state["path"] if _state["on"] else None
+
+
+def span(name, **attrs):
+    if not _state["on"]:
+        return _NO_SPAN
+    return Span(name, attrs)
+
+
+def add_span(name, seconds, **attrs):
+    # A stage timed elsewhere, e.g. Ollama's own prefill and decode durations
+    if not _state["on"] or seconds is None:
+        return
+    stack = getattr(_local, "stack", None)
+    _emit(name, time.time() - seconds, seconds, next(_ids), stack[-1] if stack else None, attrs)
+
+
+def count(name, n=1):
+    if not _state["on"] or not n:
+        return
+    with _lock:
+        counters[name] = counters.get(name, 0) + n
+
+
+def event(name, **attrs):
+    # Something that happened rather than took time, e.g. a message that failed to parse
+    add_span(name, 0.0, **attrs)
+
+
+def reset():
+    spans.clear()
+    with _lock:
+        counters.clear()
+
+
+def _from_env():
+    value = os.environ.get("EMAIL_AGENT_TRACE", "")
+    if value.lower() in ("1", "true", "yes", "on"):
+        enable()
+    elif value and value.lower() not in ("0", "false", "no", "off"):
+        enable(value)
+
+
+_from_env()
+
+
+# --- REPORTS ---
+
+def _percentile(values, q):
+    # values sorted
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def stage_stats():
+    # [{stage, count, errors, total_s, mean_ms, p50_ms, p95_ms, max_ms}], slowest stages first
+    by_name = {}
+    for record in list(spans):
+        by_name.setdefault(record["name"], []).append(record)
+    rows = []
+    for name, records in by_name.items():
+        ms = sorted(r["ms"] for r in records)
+        rows.append({"stage": name, "count": len(ms), "errors": sum(1 for r in records if r.get("error")),
+                     "total_s": sum(ms) / 1000, "mean_ms": sum(ms) / len(ms), "p50_ms": _percentile(ms, 0.5),
+                     "p95_ms": _percentile(ms, 0.95), "max_ms": ms[-1]})
+    return sorted(rows, key=lambda r: -r["total_s"])
+
+
+def durations(name):
+    return [r["ms"] for r in list(spans) if r["name"] == name]
+
+
+def slowest_messages(n=10):
+    # Messages by the time spent on them across every stage that named their uid
+    totals = {}
+    for record in list(spans):
+        uid = record.get("uid")
+        if uid is None:
+            continue
+        row = totals.setdefault(uid, {"uid": uid, "ms": 0.0, "spans": 0, "errors": 0, "stages": set()})
+        row["ms"] += record["ms"]
+        row["spans"] += 1
+        row["errors"] += 1 if record.get("error") else 0
+        row["stages"].add(record["name"])
+    rows = sorted(totals.values(), key=lambda r: -r["ms"])[:n]
+    for row in rows:
+        row["stages"] = ", ".join(sorted(row["stages"]))
+    return rows
+
+
+def message_spans(uid):
+    return [r for r in list(spans) if r.get("uid") == uid]
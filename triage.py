@@ -0,0 +1,154 @@
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from llm_cache import cache_key, get_llm_cache
+from models import chat, model_for
+from prompts import input_budget, pack, prepare_email
+from rules import get_rules
+
+# --- AUTO-TRIAGE ---
+# Rules first; whatever they miss goes to the model several emails per
+# prompt, with a few prompts in flight at once.
+
+CATEGORIES = ['Job Application', 'Security Alert', 'Personal', 'Newsletter', 'Promotion/Spam']
+CLASSIFY_VERSION = 3
+# The model can only answer with one of the categories
+CATEGORY_SCHEMA = {"type": "object", "properties": {"category": {"type": "string", "enum": CATEGORIES}}, "required": ["category"]}
+
+
+def rule_based_classify(sender, subject, body):
+    return get_rules().classify(sender, subject, body)
+
+
+def match_category(text):
+    for cat in CATEGORIES:
+        if cat in text:
+            return cat
+    return None
+
+
+def classify_email(sender, subject, body, default="Personal"):
+    # default is returned when the model cannot be reached; pass None to
+    # tell a failure apart from a real answer
+    category = rule_based_classify(sender, subject, body)
+    if category:
+        return category
+
+    def ask_model():
+        prompt = _classify_prompt(sender, subject, _prompt_body(body))
+        response = chat("classify", [{'role': 'user', 'content': prompt}], format=CATEGORY_SCHEMA)
+        content = response['message']['content'].strip()
+        try:
+            return match_category(json.loads(content)["category"]) or "Personal"
+        except (ValueError, KeyError, TypeError):
+            return match_category(content) or "Personal"
+
+    try:
+        cache = get_llm_cache()
+        key = _classify_key(sender, subject, body)
+        category = cache.get(key)
+        if category is None:
+            category = ask_model()
+            cache.set(key, category, "classify")
+        return category
+    except Exception:
+        return default
+
+
+def _classify_prompt(sender, subject, body):
+    return f"Classify this email into exactly one of these categories: {CATEGORIES}.\nSender: {sender}\nSubject: {subject}\nBody: {body}\nReply ONLY with JSON like {{\"category\": \"Personal\"}}."
+
+
+def _prompt_body(body):
+    return prepare_email(body or "", model_for("classify"), "classify", _classify_prompt("", "", ""))
+
+
+def _classify_key(sender, subject, body):
+    return cache_key("classify", model_for("classify"), CLASSIFY_VERSION, [sender, subject, _prompt_body(body)])
+
+
+def _batch_prompt(batch):
+    head = f"Classify each email into exactly one of these categories: {CATEGORIES}.\n\n"
+    tail = 'Reply ONLY with a JSON object mapping each email number to its category, e.g. {"1": "Personal", "2": "Newsletter"}.'
+    frame = head + tail + "".join(f"Email {n}:\nSender: {mail['sender']}\nSubject: {mail['subject']}\nBody: \n\n"
+                                  for n, mail in enumerate(batch, start=1))
+    # The batch shares the window; no email gets more than it would alone
+    bodies = pack([_prompt_body(mail['body']) for mail in batch],
+                  input_budget(model_for("classify_batch"), "classify_batch", frame), min_tokens=0)
+    emails = ""
+    for n, (mail, body) in enumerate(zip(batch, bodies), start=1):
+        emails += f"Email {n}:\nSender: {mail['sender']}\nSubject: {mail['subject']}\nBody: {body}\n\n"
+    return head + emails + tail
+
+
+def parse_batch_labels(content, size):
+    labels = {}
+    try:
+        data = json.loads(content)
+        if isinstance(data, dict):
+            for key, value in data.items():
+                digits = re.search(r'\d+', str(key))
+                if digits and isinstance(value, str):
+                    labels[int(digits.group())] = match_category(value)
+    except ValueError:
+        # Not JSON: fall back to "1: Newsletter" style lines
+        for line in content.splitlines():
+            digits = re.search(r'\d+', line)
+            if digits:
+                labels[int(digits.group())] = match_category(line)
+    return {n: cat for n, cat in labels.items() if cat and 1 <= n <= size}
+
+
+def batch_schema(size):
+    numbers = [str(n) for n in range(1, size + 1)]
+    return {"type": "object", "properties": {n: {"type": "string", "enum": CATEGORIES} for n in numbers}, "required": numbers}
+
+
+def classify_batch(batch):
+    # None for an email the model could not label
+    response = chat("classify_batch", [{'role': 'user', 'content': _batch_prompt(batch)}], format=batch_schema(len(batch)))
+    labels = parse_batch_labels(response['message']['content'], len(batch))
+
+    # Anything the model skipped gets a single-email retry
+    cache = get_llm_cache()
+    results = []
+    for n, mail in enumerate(batch, start=1):
+        category = labels.get(n)
+        if category:
+            cache.set(_classify_key(mail['sender'], mail['subject'], mail['body']), category, "classify")
+        else:
+            category = classify_email(mail['sender'], mail['subject'], mail['body'], default=None)
+        results.append(category)
+    return results
+
+
+def triage_emails(emails, batch_size=5, max_workers=3):
+    # Yields (index, category) as soon as each result is known; category is
+    # None when the model could not be reached, so callers that write the
+    # result anywhere can leave that email for a later run
+    cache = get_llm_cache()
+    pending = []
+    for i, mail in enumerate(emails):
+        category = rule_based_classify(mail['sender'], mail['subject'], mail['body'] or "")
+        if not category:
+            category = cache.get(_classify_key(mail['sender'], mail['subject'], mail['body']))
+        if category:
+            yield i, category
+        else:
+            pending.append(i)
+
+    if not pending:
+        return
+
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(classify_batch, [emails[i] for i in batch]): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                categories = future.result()
+            except Exception:
+                categories = [None] * len(batch)
+            for i, category in zip(batch, categories):
+                yield i, category
@@ -0,0 +1,255 @@
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import wave
+
+from mail_cache import DATA_DIR
+from tracing import span, count
+
+# --- TEXT TO SPEECH ---
+# gTTS needs the network, so offline engines can stand in for it: Piper
+# (set EMAIL_AGENT_PIPER_MODEL to a voice .onnx), espeak-ng / espeak, or
+# pyttsx3. EMAIL_AGENT_TTS picks one by name; the default "auto" uses
+# gTTS and switches to the first available offline engine once gTTS
+# fails. Every synthesized clip is cached by (engine, voice, text).
+
+AUDIO_CACHE_PATH = os.path.join(DATA_DIR, "audio_cache.db")
+
+
+class GTTSBackend:
+    name = "gtts"
+    mime = "audio/mp3"
+    offline = False
+
+    def __init__(self, lang="en"):
+        self.voice = lang
+
+    def available(self):
+        return importlib.util.find_spec("gtts") is not None
+
+    def synthesize(self, text):
+        from gtts import gTTS
+
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=self.voice).write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+class PiperBackend:
+    name = "piper"
+    mime = "audio/wav"
+    offline = True
+
+    def __init__(self, model=None):
+        self.voice = model or os.environ.get("EMAIL_AGENT_PIPER_MODEL", "")
+        self.exe = shutil.which("piper")
+
+    def available(self):
+        return bool(self.exe and self.voice and os.path.exists(self.voice))
+
+    def synthesize(self, text):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.wav")
+            subprocess.run([self.exe, "--model", self.voice, "--output_file", path],
+                           input=text.encode("utf-8"), capture_output=True, check=True, timeout=120)
+            with open(path, "rb") as f:
+                return f.read()
+
+
+class EspeakBackend:
+    name = "espeak"
+    mime = "audio/wav"
+    offline = True
+
+    def __init__(self, voice="en-us", words_per_minute=165):
+        self.voice = voice
+        self.words_per_minute = words_per_minute
+        self.exe = shutil.which("espeak-ng") or shutil.which("espeak")
+
+    def available(self):
+        return self.exe is not None
+
+    def synthesize(self, text):
+        # Text on stdin, WAV on stdout
+        result = subprocess.run([self.exe, "-v", self.voice, "-s", str(self.words_per_minute), "--stdout"],
+                                input=text.encode("utf-8"), capture_output=True, check=True, timeout=120)
+        return result.stdout
+
+
+class Pyttsx3Backend:
+    name = "pyttsx3"
+    mime = "audio/wav"
+    offline = True
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.voice = "default"
+
+    def available(self):
+        return importlib.util.find_spec("pyttsx3") is not None
+
+    def synthesize(self, text):
+        import pyttsx3
+
+        # The engine is not thread-safe
+        with self._lock, tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.wav")
+            engine = pyttsx3.init()
+            engine.save_to_file(text, path)
+            engine.runAndWait()
+            with open(path, "rb") as f:
+                return f.read()
+
+
+BACKENDS = {cls.name: cls for cls in (GTTSBackend, PiperBackend, EspeakBackend, Pyttsx3Backend)}
+OFFLINE_ORDER = ("piper", "espeak", "pyttsx3")
+
+
+class AudioCache:
+    def __init__(self, path=AUDIO_CACHE_PATH, max_bytes=200 * 1024 * 1024):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS clips (key TEXT PRIMARY KEY, mime TEXT, audio BLOB, bytes INTEGER, last_access REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS clips_lru ON clips (last_access)")
+
+    @staticmethod
+    def key(backend, text):
+        payload = json.dumps([backend.name, backend.voice, " ".join(text.split())], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock, self._db:
+            row = self._db.execute("SELECT audio, mime FROM clips WHERE key=?", (key,)).fetchone()
+            if row is not None:
+                self._db.execute("UPDATE clips SET last_access=? WHERE key=?", (time.time(), key))
+        return row
+
+    def set(self, key, audio, mime):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO clips VALUES (?, ?, ?, ?, ?)", (key, mime, audio, len(audio), time.time()))
+            total = self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM clips").fetchone()[0]
+            if total > self.max_bytes:
+                doomed = []
+                for rowid, size in self._db.execute("SELECT rowid, bytes FROM clips ORDER BY last_access"):
+                    if total <= self.max_bytes:
+                        break
+                    doomed.append((rowid,))
+                    total -= size
+                self._db.executemany("DELETE FROM clips WHERE rowid=?", doomed)
+
+
+class Speaker:
+    def __init__(self, name=None, cache=None):
+        # name: a BACKENDS key, or "auto"
+        self.name = name or os.environ.get("EMAIL_AGENT_TTS", "auto")
+        self.cache = cache or AudioCache()
+        self.stats = {"hits": 0, "synthesized": 0, "failures": 0}
+        self._lock = threading.Lock()
+        if self.name == "auto":
+            self.backend = GTTSBackend()
+            self.fallback = next((b for b in (BACKENDS[n]() for n in OFFLINE_ORDER) if b.available()), None)
+        else:
+            self.backend = BACKENDS[self.name]()
+            self.fallback = None
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _speak(self, backend, text):
+        key = AudioCache.key(backend, text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self._count("hits")
+            count("tts.cache_hit")
+            return cached
+        count("tts.cache_miss")
+        with span("tts", engine=backend.name, chars=len(text)):
+            audio = backend.synthesize(text)
+        self.cache.set(key, audio, backend.mime)
+        self._count("synthesized")
+        return audio, backend.mime
+
+    def speak(self, text):
+        # (audio bytes, mime type), or None when no engine could do it
+        backend = self.backend
+        while True:
+            try:
+                return self._speak(backend, text)
+            except Exception:
+                pass
+            with self._lock:
+                if self.backend is backend:
+                    if self.fallback is None:
+                        self.stats["failures"] += 1
+                        return None
+                    # gTTS is unreachable: stay offline from now on
+                    self.backend, self.fallback = self.fallback, None
+                # Another thread may have switched already; either way, use the current engine
+                backend = self.backend
+
+    def revoice(self, texts, clips):
+        # A briefing's segments are voiced concurrently, so some may come
+        # from gTTS and some from the offline engine it fell back to. Those
+        # not in the current engine's format are voiced again so the
+        # briefing can be joined into one file.
+        mime = self.backend.mime
+        if all(clip is None or clip[1] == mime for clip in clips):
+            return clips
+        return [clip if clip is None or clip[1] == mime else self.speak(text) for text, clip in zip(texts, clips)]
+
+
+def join_audio(clips):
+    # clips: [(audio, mime)] from one engine. MP3 frames can simply be
+    # concatenated; WAV files are re-wrapped under one header. Clips in
+    # different formats (see Speaker.revoice) or WAVs with different
+    # sample formats are not joined: None.
+    clips = [c for c in clips if c]
+    if not clips:
+        return None
+    mime = clips[0][1]
+    if any(m != mime for _, m in clips):
+        return None
+    if mime != "audio/wav":
+        return b"".join(audio for audio, _ in clips), mime
+    out = io.BytesIO()
+    try:
+        with wave.open(out, "wb") as writer:
+            for n, (audio, _) in enumerate(clips):
+                with wave.open(io.BytesIO(audio), "rb") as reader:
+                    params = reader.getparams()[:3]  # channels, sample width, rate
+                    if n == 0:
+                        writer.setparams(reader.getparams())
+                        first = params
+                    elif params != first:
+                        return None
+                    writer.writeframes(reader.readframes(reader.getnframes()))
+    except (wave.Error, EOFError):
+        return None
+    return out.getvalue(), mime
+
+
+_speaker = None
+_speaker_lock = threading.Lock()
+
+
+def get_speaker():
+    global _speaker
+    with _speaker_lock:
+        if _speaker is None:
+            _speaker = Speaker()
+        return _speaker
@@ -0,0 +1,370 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import zlib
+
+import numpy as np
+import ollama
+
+from mail_cache import DATA_DIR, get_cache, on_change
+from prompts import clean_text
+from models import KEEP_ALIVE
+from tracing import span
+
+# --- INBOX VECTOR INDEX ---
+# Cached messages are split into a few chunks, embedded locally and stored
+# in SQLite. A question is answered from its top-k chunks, so prompt size
+# does not grow with the mailbox. The index follows the message cache on a
+# background thread, so asking a question never waits on embeddings.
+# Without an Ollama embedding model, a hashed bag-of-words vector is used
+# instead; each backend keeps its own rows.
+
+INDEX_PATH = os.path.join(DATA_DIR, "vector_index.db")
+EMBED_MODEL = 'nomic-embed-text'
+HASH_MODEL = 'hash-512'
+HASH_DIM = 512
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    model TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (account, mailbox, model, uidvalidity, uid)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    model TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    chunk INTEGER NOT NULL,
+    sender TEXT,
+    subject TEXT,
+    date TEXT,
+    text TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    PRIMARY KEY (account, mailbox, model, uidvalidity, uid, chunk)
+);
+"""
+
+_WORD = re.compile(r"[a-z0-9]{2,}")
+
+
+def hash_embed(texts, dim=HASH_DIM):
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in _WORD.findall(text.lower()):
+            h = zlib.crc32(word.encode("utf-8"))
+            vectors[row, h % dim] += 1.0 if h & 0x80000000 else -1.0
+    return vectors
+
+
+def chunk_message(msg, chunk_chars=800, max_chunks=4):
+    # [(text to embed, excerpt to quote)]; the first chunk embeds the
+    # headers, later ones the subject so they still match on their own
+    header = f"From: {msg.get('sender') or ''}\nSubject: {msg.get('subject') or ''}\nDate: {msg.get('date') or ''}"
+    # Quoted history and footers would only match (and be quoted) again
+    body = " ".join(clean_text(msg.get("body") or "").split())
+    chunks = [(f"{header}\n{body[:chunk_chars]}", body[:chunk_chars])]
+    for start in range(chunk_chars, min(len(body), chunk_chars * max_chunks), chunk_chars):
+        excerpt = body[start:start + chunk_chars]
+        chunks.append((f"Subject: {msg.get('subject') or ''}\n{excerpt}", excerpt))
+    return chunks
+
+
+def _digest(chunks):
+    return hashlib.sha256("\x00".join(text for text, _ in chunks).encode("utf-8")).hexdigest()
+
+
+def _entry(blocks, meta):
+    positions = {}
+    for i, m in enumerate(meta):
+        positions.setdefault(m["uid"], []).append(i)
+    return {"blocks": blocks, "meta": meta, "positions": positions, "dead": set()}
+
+
+class VectorIndex:
+    def __init__(self, path=INDEX_PATH, model=EMBED_MODEL, chunk_chars=800, max_chunks=4):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.model = model
+        self.chunk_chars = chunk_chars
+        self.max_chunks = max_chunks
+        self._backend = None
+        self._matrices = {}
+        self._lock = threading.Lock()
+        # One sync round at a time, so the worker and other callers never embed the same messages twice
+        self._sync_lock = threading.Lock()
+        self._due = set()
+        self._worker = None
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    # --- embeddings ---
+
+    def backend(self):
+        # Probed once; falls back to hashing when the embedding model is missing
+        if self._backend is None:
+            try:
+                ollama.embed(model=self.model, input=["ping"], keep_alive=KEEP_ALIVE)
+                self._backend = self.model
+            except Exception:
+                self._backend = HASH_MODEL
+        return self._backend
+
+    def embed(self, texts, batch_size=32):
+        backend = self.backend()
+        with span("embed", model=backend, texts=len(texts)):
+            if backend == HASH_MODEL:
+                vectors = hash_embed(texts)
+            else:
+                rows = []
+                for start in range(0, len(texts), batch_size):
+                    rows += ollama.embed(model=self.model, input=texts[start:start + batch_size], keep_alive=KEEP_ALIVE)['embeddings']
+                vectors = np.asarray(rows, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+    # --- maintenance ---
+
+    def sync(self, account, mailbox, max_new=256, uids=None):
+        # Brings the index up to date with the message cache (or just the
+        # given UIDs of it). Changed rows are spotted by their stored size,
+        # so an unchanged mailbox costs one small query; at most max_new
+        # messages are embedded per call (all of them, in rounds, for None),
+        # newest first.
+        total = 0
+        while True:
+            # Per round, so a question's small sync never waits out a whole catch-up
+            with self._sync_lock:
+                added, left = self._sync(account, mailbox, max_new or 256, uids)
+            total += added
+            if max_new is not None or not left:
+                return total
+
+    def _sync(self, account, mailbox, max_new, uids=None):
+        # (messages embedded, whether more changed messages are left)
+        cache = get_cache()
+        state = cache.mailbox_state(account, mailbox)
+        if state is None:
+            return 0, False
+        uidvalidity = state["uidvalidity"]
+        model = self.backend()
+        versions = cache.message_versions(account, mailbox, uidvalidity)
+
+        with self._lock:
+            indexed = dict(self._db.execute(
+                "SELECT uid, version FROM docs WHERE account=? AND mailbox=? AND model=? AND uidvalidity=?",
+                (account, mailbox, model, uidvalidity),
+            ))
+            stale = self._db.execute(
+                "SELECT COUNT(*) FROM docs WHERE account=? AND mailbox=? AND model=? AND uidvalidity!=?",
+                (account, mailbox, model, uidvalidity),
+            ).fetchone()[0]
+
+        gone = [uid for uid in indexed if uid not in versions]
+        if gone or stale:
+            self.remove(account, mailbox, uidvalidity, gone)
+
+        changed = sorted((uid for uid, version in versions.items() if indexed.get(uid) != version
+                          and (uids is None or uid in uids)), reverse=True)
+        left = len(changed) > max_new
+        changed = changed[:max_new]
+        added = 0
+        if changed:
+            messages = cache.get_messages(account, mailbox, uidvalidity, changed, touch=False)
+            added = self.add(account, mailbox, uidvalidity, [(m, versions[uid]) for uid, m in messages.items()])
+        return added, left
+
+    def schedule(self, account, mailbox):
+        # Queues a sync for the background worker; cheap enough to call on
+        # every cache write
+        with self._lock:
+            self._due.add((account, mailbox))
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._index_due, name="vector-index", daemon=True)
+                self._worker.start()
+
+    def _index_due(self):
+        while True:
+            with self._lock:
+                if not self._due:
+                    self._worker = None
+                    return
+                account, mailbox = self._due.pop()
+            try:
+                self.sync(account, mailbox, max_new=None)
+            except Exception:
+                pass
+
+    def wait(self, timeout=None):
+        # Until the worker has caught up (or timeout seconds); True when idle
+        with self._lock:
+            worker = self._worker
+        if worker is not None:
+            worker.join(timeout)
+        with self._lock:
+            return self._worker is None
+
+    def add(self, account, mailbox, uidvalidity, items):
+        # items: [(message dict, version)]
+        model = self.backend()
+        uids = [int(msg["uid"]) for msg, _ in items]
+        digests = {}
+        with self._lock:
+            for start in range(0, len(uids), 500):
+                chunk = uids[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                digests.update(self._db.execute(
+                    f"SELECT uid, digest FROM docs WHERE account=? AND mailbox=? AND model=? AND uidvalidity=? AND uid IN ({marks})",
+                    (account, mailbox, model, uidvalidity, *chunk),
+                ))
+
+        docs, texts, owners, bodiless = [], [], [], []
+        for msg, version in items:
+            uid = int(msg["uid"])
+            if msg.get("body") is None:
+                # Headers only so far: no chunks until the body is cached
+                # (which changes its version), so retrieval never quotes an
+                # empty excerpt
+                docs.append((account, mailbox, model, uidvalidity, uid, version, ""))
+                bodiless.append(uid)
+                continue
+            chunks = chunk_message(msg, self.chunk_chars, self.max_chunks)
+            digest = _digest(chunks)
+            docs.append((account, mailbox, model, uidvalidity, uid, version, digest))
+            if digests.get(uid) == digest:
+                # Only metadata (flags, category) changed; keep the vectors
+                continue
+            for n, (text, excerpt) in enumerate(chunks):
+                texts.append(text)
+                owners.append((uid, n, msg, excerpt))
+        vectors = self.embed(texts) if texts else []
+
+        rows = [
+            (account, mailbox, model, uidvalidity, uid, n, msg.get("sender"), msg.get("subject"), msg.get("date"),
+             excerpt, vector.astype(np.float16).tobytes())
+            for (uid, n, msg, excerpt), vector in zip(owners, vectors)
+        ]
+        embedded = sorted(set(owner[0] for owner in owners))
+        with self._lock, self._db:
+            self._db.executemany(
+                "DELETE FROM chunks WHERE account=? AND mailbox=? AND model=? AND uidvalidity=? AND uid=?",
+                [(account, mailbox, model, uidvalidity, uid) for uid in embedded + bodiless],
+            )
+            self._db.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._db.executemany("INSERT OR REPLACE INTO docs VALUES (?, ?, ?, ?, ?, ?, ?)", docs)
+            if bodiless:
+                self._patch((account, mailbox, model), set(bodiless))
+            if embedded:
+                new_meta = [{"uid": r[4], "sender": r[6], "subject": r[7], "date": r[8], "text": r[9]} for r in rows]
+                new_vectors = np.asarray(vectors, dtype=np.float16).astype(np.float32)
+                self._patch((account, mailbox, model), set(embedded), new_meta, new_vectors)
+        return len(embedded)
+
+    def remove(self, account, mailbox, uidvalidity, uids):
+        # Drops the given UIDs, plus everything from an older UIDVALIDITY
+        with self._lock, self._db:
+            stale = self._db.execute(
+                "SELECT 1 FROM docs WHERE account=? AND mailbox=? AND uidvalidity!=? LIMIT 1",
+                (account, mailbox, uidvalidity),
+            ).fetchone()
+            for table in ("docs", "chunks"):
+                self._db.execute(
+                    f"DELETE FROM {table} WHERE account=? AND mailbox=? AND uidvalidity!=?",
+                    (account, mailbox, uidvalidity),
+                )
+                self._db.executemany(
+                    f"DELETE FROM {table} WHERE account=? AND mailbox=? AND uidvalidity=? AND uid=?",
+                    [(account, mailbox, uidvalidity, uid) for uid in uids],
+                )
+            for key in [k for k in self._matrices if k[:2] == (account, mailbox)]:
+                if stale:
+                    del self._matrices[key]
+                else:
+                    self._patch(key, set(uids))
+
+    # --- retrieval ---
+
+    def _load(self, key):
+        if key not in self._matrices:
+            rows = self._db.execute(
+                "SELECT uid, sender, subject, date, text, vector FROM chunks WHERE account=? AND mailbox=? AND model=?",
+                key,
+            ).fetchall()
+            meta = [{"uid": r[0], "sender": r[1], "subject": r[2], "date": r[3], "text": r[4]} for r in rows]
+            # float16 on disk, float32 in memory: converting per query costs more than the dot product
+            blocks = []
+            if rows:
+                blocks.append(np.frombuffer(b"".join(r[5] for r in rows), dtype=np.float16).reshape(len(rows), -1).astype(np.float32))
+            self._matrices[key] = _entry(blocks, meta)
+        return self._matrices[key]
+
+    def _patch(self, key, drop_uids, new_meta=(), new_vectors=None):
+        # Keeps a loaded matrix in step with the table without copying it:
+        # replaced rows are tombstoned and new rows appended as a block
+        entry = self._matrices.get(key)
+        if entry is None:
+            return
+        for uid in drop_uids:
+            entry["dead"].update(entry["positions"].pop(uid, ()))
+        if new_vectors is not None and len(new_vectors):
+            base = len(entry["meta"])
+            entry["meta"].extend(new_meta)
+            for i, m in enumerate(new_meta):
+                entry["positions"].setdefault(m["uid"], []).append(base + i)
+            entry["blocks"].append(new_vectors)
+        if len(entry["blocks"]) > 16 or len(entry["dead"]) > len(entry["meta"]) // 4:
+            alive = [i for i in range(len(entry["meta"])) if i not in entry["dead"]]
+            blocks = [np.vstack(entry["blocks"])[alive]] if alive else []
+            self._matrices[key] = _entry(blocks, [entry["meta"][i] for i in alive])
+
+    def search(self, account, mailbox, query, k=8):
+        model = self.backend()
+        query_vector = self.embed([query])[0]
+        with self._lock:
+            entry = self._load((account, mailbox, model))
+            if not entry["blocks"]:
+                return []
+            scores = np.concatenate([block @ query_vector for block in entry["blocks"]])
+            if entry["dead"]:
+                scores[list(entry["dead"])] = -np.inf
+            meta = entry["meta"]
+            k = min(k, len(meta) - len(entry["dead"]))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [dict(meta[i], score=float(scores[i])) for i in top]
+
+    def stats(self):
+        with self._lock:
+            docs = self._db.execute("SELECT COUNT(*) FROM docs WHERE digest != ''").fetchone()[0]
+            chunks = self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        return {"messages": docs, "chunks": chunks, "model": self._backend}
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_vector_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = VectorIndex()
+        return _index
+
+
+def _cache_changed(account, mailbox):
+    get_vector_index().schedule(account, mailbox)
+
+
+on_change(_cache_changed)